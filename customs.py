@@ -26,18 +26,28 @@ Usage:
 
 from __future__ import print_function
 
+import argparse
 import csv
 import os
 import time
-import sys
-import sqlite3
 
-import pandas as pd
+import customs_random
+import customs_replication
+import customs_schema
+import customs_sequential
+import customs_shared
+import customs_sql
 
 from customs_obj import PlaneDispatcher
 from customs_obj import Customs
 from customs_obj import _get_sec
-from customs_obj import sample_from_triangular
+from customs_obj import TriangularSampler
+from customs_obj import compile_schedule
+from customs_dataset import DatasetPlaneDispatcher
+from customs_synthetic import CsvPlaneDispatcher
+from customs_synthetic import SyntheticPlaneDispatcher
+from customs_instrument import Instrument
+from customs_instrument import SimulationProfiler
 
 
 ## ====================================================================
@@ -46,33 +56,46 @@ from customs_obj import sample_from_triangular
 # Macros and files.
 customs_db = "customs_db.sqlite"
 server_schedule_file = "schedules/sample_server_schedule.csv"
+arrival_schedule_file = "schedules/sample_arrival_schedule.csv"
 opt_report_file = "output/optimized_models.csv"
 heur_report_file = "output/heuristic_models.csv"
 log_file = "output/log.csv"
+profile_file = "output/profile.csv"
+profile_dir = "output/profiles"
 spd_factor = 10
 
 
 ## ====================================================================
 
 
-def simulate(database, plane_dispatcher, server_schedule, speed_factor):
+def simulate(database, plane_dispatcher, server_schedule, speed_factor,
+             instrument=None):
   """
   Run Customs Simulations for a number of seconds.
 
   Args:
     customs: an initialized Customs object
     plane_dispatcher: an initialized PlaneDispatcher object
-    server_schedule: a Pandas dataframe
+    server_schedule: a Pandas dataframe or a compiled ServerSchedule
     speed_factor: a factor to speed up simulation by only simulating at
                   this time resolution (i.e. every 10 seconds)
     write_output: boolean whether to write output for the passengers
                   and servers.
+    instrument: optional Instrument object to time the simulation with
 
   Returns:
     VOID
   """
-  # Initialize a Customs object.
-  customs = Customs(database, server_schedule)
+  # Compile the schedule once, so the loop needs no pandas.
+  server_schedule = compile_schedule(server_schedule)
+
+  # Initialize a Customs object.  Dispatchers that synthesize their
+  # manifests have no passengers table to report from.
+  customs = Customs(database, server_schedule,
+                    getattr(plane_dispatcher, 'in_memory_report', False))
+
+  # Start timing the phases.
+  if instrument is not None: instrument.attach(customs, plane_dispatcher)
 
   # Set the global time in seconds, from a string of HH:MM:SS format.
   GLOBAL_TIME = _get_sec("00:00:00", speed_factor)
@@ -103,7 +126,7 @@ def simulate(database, plane_dispatcher, server_schedule, speed_factor):
       section.parallel_server.get_utilization(GLOBAL_TIME)
 
     # Update passengers
-    customs.outputs.update_passengers(customs_db, GLOBAL_TIME)
+    customs.outputs.update_passengers(database, GLOBAL_TIME)
 
     # Increment global time by one unit of time.
     GLOBAL_TIME += 1
@@ -114,7 +137,10 @@ def simulate(database, plane_dispatcher, server_schedule, speed_factor):
     #         customs.outputs.passengers_served, " passengers serviced.  ", sep='')
 
   # Write Report Files
-  report = customs.generate_report(opt_report_file, customs_db)
+  report = customs.generate_report(opt_report_file, database)
+
+  # Emit the simulation's profile record.
+  if instrument is not None: instrument.finish(customs)
 
   # Clean-up
   customs.clean_up_db()
@@ -124,6 +150,50 @@ def simulate(database, plane_dispatcher, server_schedule, speed_factor):
   return report
 
 
+def run_simulation(database, plane_dispatcher, server_schedule, speed_factor,
+                   instrument, profiler, hour, num_servers, iteration,
+                   replication=None):
+  """
+  Runs one simulation for the optimizer, under a SimulationProfiler if
+  one is given.
+
+  Args:
+    database: database to write/read i/o data
+    plane_dispatcher: PlaneDispatcher() object holding arrivals
+    server_schedule: a Pandas dataframe
+    speed_factor: a speed factor for simulation time
+    instrument: optional Instrument object to time the simulation with
+    profiler: optional SimulationProfiler to run the simulation under
+    hour: hour being optimized, or a label for the profiler
+    num_servers: candidate server count, for the profiler
+    iteration: index of the simulation, for the profiler
+    replication: replication index of the candidate, for the profiler
+
+  Returns:
+    report: simulation report as pandas dataframe
+  """
+  args = (database, plane_dispatcher, server_schedule, speed_factor,
+          instrument)
+  if profiler is None:
+    return simulate(*args)
+  return profiler.run(simulate, args, hour, num_servers, iteration,
+                      replication)
+
+
+def max_servers(schedule):
+  """
+  Returns the largest hourly server count in a schedule.
+
+  Args:
+    schedule: a CSV of scheduled servers
+
+  Returns:
+    num_servers: an integer
+  """
+  return int(max(schedule.iloc[0, schedule.columns.get_loc(str(hour))]
+                 for hour in range(0, 24)))
+
+
 def adjust_schedule(schedule, starting_hour, num_servers):
   """
   Adjusts the number of servers in a temporary schedule for the current
@@ -143,13 +213,15 @@ def adjust_schedule(schedule, starting_hour, num_servers):
     schedule.iloc[0, schedule.columns.get_loc(str(hour))] = num_servers
 
 
-def init_service_times(database):
+def init_service_times(database, rng=None):
   """
   Sets a passenger's service time once for an optimization routine.
   Read/write from a passengers table in passed db.
 
   Args:
     database: sqlite database holding a 'passengers' table
+    rng: numpy Generator or integer seed to draw service times from;
+         None draws from a fresh stream
 
   Returns:
     VOID
@@ -159,34 +231,35 @@ def init_service_times(database):
   service_dist_dom = ("00:00:30", "00:01:00", "00:02:00")
   service_dist_intl = ("00:01:00", "00:02:00", "00:04:00")
 
-  # Open connection to DB
-  connection = sqlite3.connect(database)
-  cursor = connection.cursor()
-
-  # Insert a service time attribute.
-  cursor.execute('ALTER TABLE passengers ADD service_time INTEGER;')
-
-  # Grab a list of ids.
-  ids = cursor.execute('SELECT id FROM passengers;').fetchall()
-
-  # Loop through every passenger and update.
-  for passenger_id in ids:
-    cursor.execute('UPDATE passengers '
-                       'SET service_time = '
-                   'CASE WHEN nationality = \'domestic\' '
-                       'THEN \'{time_dom}\' '
-                       'ELSE \'{time_for}\' END '
-                   'WHERE id = \'{id}\';'\
-                   .format(time_dom=sample_from_triangular(service_dist_dom),
-                           time_for=sample_from_triangular(service_dist_intl),
-                           id=passenger_id[0]))
-
-  # Commit and close.
-  connection.commit()
-  connection.close()
+  # Draw every service time from the run's stream, a block at a time.
+  rng = customs_random.make_rng(rng)
+  sampler_dom = TriangularSampler(service_dist_dom, rng)
+  sampler_intl = TriangularSampler(service_dist_intl, rng)
 
+  # Reuse the shared connection to the DB.
+  connection = customs_sql.get_connection(database)
 
-def optimize(database, plane_dispatcher, server_schedule, speed_factor, threshold, report_file):
+  # Insert a service time attribute.
+  connection.execute('ALTER TABLE passengers ADD service_time INTEGER;')
+
+  # Grab a list of ids, split by nationality.
+  passengers = connection.execute('SELECT id, nationality '
+                                  'FROM passengers;').fetchall()
+  dom_ids = [row[0] for row in passengers if row[1] == 'domestic']
+  intl_ids = [row[0] for row in passengers if row[1] != 'domestic']
+
+  # Update every passenger in batched transactions.
+  query = 'UPDATE passengers SET service_time = ? WHERE id = ?;'
+  customs_sql.execute_batches(connection, query,
+                              zip(sampler_dom.draws(len(dom_ids)).tolist(),
+                                  dom_ids))
+  customs_sql.execute_batches(connection, query,
+                              zip(sampler_intl.draws(len(intl_ids)).tolist(),
+                                  intl_ids))
+
+
+def optimize(database, plane_dispatcher, server_schedule, speed_factor, threshold, report_file,
+             instrument=None, profiler=None, crn=None, sampler=None):
   """
   Optimizes a schedule using a greedy search method.
 
@@ -197,6 +270,15 @@ def optimize(database, plane_dispatcher, server_schedule, speed_factor, threshol
     speed_factor: a speed factor for simulation time
     threshold: an average wait threshold to optimize for
     report_file: a file to write out simulation data
+    instrument: optional Instrument object to time the simulations with
+    profiler: optional SimulationProfiler to run the simulations under
+    crn: optional CommonRandomNumbers object; each candidate is then
+         simulated once per replication on the block's common service
+         draws and judged by the replications' mean report
+    sampler: optional SequentialSampler; each candidate is then
+             simulated in parallel batches of replications until the
+             hour's threshold decision is settled, and judged by the
+             replications' mean report
 
   Returns:
     data: optimized server schedule as pandas dataframe
@@ -207,6 +289,47 @@ def optimize(database, plane_dispatcher, server_schedule, speed_factor, threshol
   num_simulations = 0
   start_time = time.time()
 
+  # Last candidate's replication reports, for paired comparisons, and
+  # the count of replicated simulations.
+  last_candidate = {}
+  replicated = [0]
+
+  # Run every simulation through the profiler, if one is given, and
+  # every replication on the common random numbers of the hour.
+  def run(hour, num_servers):
+    if sampler is not None:
+      reports = sampler.sample(server_schedule, hour, threshold)
+    elif crn is not None:
+      reports = []
+      for replication in range(crn.replications):
+        crn.apply(plane_dispatcher, hour, replication)
+        reports.append(run_simulation(database, plane_dispatcher,
+                                      server_schedule, speed_factor,
+                                      instrument, profiler, hour, num_servers,
+                                      num_simulations, replication))
+      crn.restore(plane_dispatcher)
+    else:
+      return run_simulation(database, plane_dispatcher, server_schedule,
+                            speed_factor, instrument, profiler, hour,
+                            num_servers, num_simulations)
+    replicated[0] += len(reports)
+
+    # Compare the hour's waits against the previous candidate's.
+    previous = last_candidate.get(hour)
+    if previous is not None and previous[0] != num_servers:
+      stats = customs_replication.paired_difference(
+                  customs_replication.hour_waits(previous[1], hour),
+                  customs_replication.hour_waits(reports, hour))
+      if stats['n'] > 0:
+        print("Paired change in hour ", hour, " wait from ", previous[0],
+              " to ", num_servers, " servers: ", round(stats['mean'], 2),
+              " minutes (95% CI ", round(stats['ci_low'], 2), " to ",
+              round(stats['ci_high'], 2), ", ", stats['n'],
+              " replications).", sep="")
+    last_candidate[hour] = (num_servers, reports)
+
+    return customs_replication.mean_report(reports)
+
   # Adjust schedule to have a max load of servers.
   max_val = server_schedule.iloc[0, server_schedule.columns.get_loc('max')]
   adjust_schedule(server_schedule, 0, max_val)
@@ -222,7 +345,7 @@ def optimize(database, plane_dispatcher, server_schedule, speed_factor, threshol
                                 0, server_schedule.columns.get_loc(str(hour))]
 
     # Simulate and retrieve sim report.
-    data = simulate(database, plane_dispatcher, server_schedule, speed_factor)
+    data = run(hour, num_servers)
     num_simulations += 1
 
     # If there is no activity in the time period, skip forward.
@@ -270,7 +393,7 @@ def optimize(database, plane_dispatcher, server_schedule, speed_factor, threshol
       adjust_schedule(server_schedule, hour, num_servers)
 
       # Simulate and retrieve average wait time.
-      data = simulate(database, plane_dispatcher, server_schedule, speed_factor)
+      data = run(hour, num_servers)
       num_simulations += 1
       new_ave_wait = int(data[data['hour'] == hour].iloc[0]['ave_wait'])
 
@@ -288,7 +411,7 @@ def optimize(database, plane_dispatcher, server_schedule, speed_factor, threshol
           adjust_schedule(server_schedule, hour, num_servers)
 
           # Simulate and retrieve average wait time.
-          data = simulate(database, plane_dispatcher, server_schedule, speed_factor)
+          data = run(hour, num_servers)
           num_simulations += 1
           new_ave_wait = int(data[data['hour'] == hour].iloc[0]['ave_wait'])
 
@@ -315,7 +438,7 @@ def optimize(database, plane_dispatcher, server_schedule, speed_factor, threshol
           adjust_schedule(server_schedule, hour, num_servers)
 
           # Simulate and retrieve average wait time.
-          data = simulate(database, plane_dispatcher, server_schedule, speed_factor)
+          data = run(hour, num_servers)
           num_simulations += 1
           new_ave_wait = int(data[data['hour'] == hour].iloc[0]['ave_wait'])
 
@@ -339,8 +462,7 @@ def optimize(database, plane_dispatcher, server_schedule, speed_factor, threshol
                    "Adding more servers...")
             num_servers = num_servers + 1
             adjust_schedule(server_schedule, hour, num_servers)
-            data = simulate(database, plane_dispatcher, server_schedule,
-                            speed_factor)
+            data = run(hour, num_servers)
             num_simulations += 1
             previous_ave_wait = int(data[data['hour'] == int(previous_hour)].\
                                 iloc[0]['ave_wait'])
@@ -365,11 +487,15 @@ def optimize(database, plane_dispatcher, server_schedule, speed_factor, threshol
            ".***", sep="")
 
   # Write final report to CSV.
-  data = simulate(database, plane_dispatcher, server_schedule, speed_factor)
-  data.to_csv(report_file, mode="a", index=False, columns=["hour", "type", "count",
-                                                 "ave_wait", "max_wait",
-                                                 "ave_server_utilization",
-                                                 "num_servers"])
+  data = run("final", max_servers(server_schedule))
+  data.to_csv(report_file, mode="a", index=False,
+              columns=[column for column in
+                       customs_replication.report_columns +
+                       customs_replication.interval_columns
+                       if column in data.columns])
+
+  # Replicated candidates ran more than one simulation each.
+  if replicated[0]: num_simulations = replicated[0]
 
   # Final Status.
   print(data)
@@ -387,7 +513,8 @@ def optimize(database, plane_dispatcher, server_schedule, speed_factor, threshol
   return data
 
 
-def compare_to_heuristic(model, database, plane_dispatcher, server_schedule, speed_factor, report_file):
+def compare_to_heuristic(model, database, plane_dispatcher, server_schedule, speed_factor, report_file,
+                         instrument=None, profiler=None):
   """"""
 
   # Here
@@ -406,8 +533,10 @@ def compare_to_heuristic(model, database, plane_dispatcher, server_schedule, spe
     server_schedule.iloc[0, server_schedule.columns.get_loc(str(hour))] = num_servers
 
   # Simulate.
-  heuristic_model = simulate(database, plane_dispatcher, server_schedule,
-                             speed_factor)
+  heuristic_model = run_simulation(database, plane_dispatcher,
+                                   server_schedule, speed_factor, instrument,
+                                   profiler, "heuristic",
+                                   max_servers(server_schedule), 0)
 
   # Save to output file.
   heuristic_model.to_csv(report_file, mode="a", index=False,
@@ -428,8 +557,8 @@ def reset_db(database):
     VOID
   """
 
-  # Open connection to the database.
-  connection = sqlite3.connect(database)
+  # Reuse the shared connection to the database.
+  connection = customs_sql.get_connection(database)
   cursor = connection.cursor()
 
   # Get rid of temporary servers table.
@@ -457,9 +586,11 @@ def reset_db(database):
 
   cursor.execute('DROP TABLE tmp_passengers;')
 
-  # Close connection to the database.
+  # The rebuild drops the table's indexes, so put them back.
+  customs_schema.create_indexes(connection, 'passengers')
+
+  # Commit changes to the database.
   connection.commit()
-  connection.close()
 
 
 ## ====================================================================
@@ -473,32 +604,159 @@ def main():
   """
 
   # Read in command line args.
-  ave_wait_threshold = int(sys.argv[1])
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("threshold", type=int,
+                      help="average wait threshold in minutes")
+  parser.add_argument("dataset", nargs="?", default=None,
+                      help="dataset compiled by customs_dataset.py to "
+                           "dispatch planes from")
+  parser.add_argument("--synthetic", action="store_true",
+                      help="draw manifests from the planes table at "
+                           "dispatch instead of reading the passengers "
+                           "table")
+  parser.add_argument("--arrivals", default=None,
+                      help="arrival schedule CSV of passenger counts, in "
+                           "the format of " + arrival_schedule_file + ", to "
+                           "simulate without the database")
+  parser.add_argument("--in-memory", action="store_true",
+                      help="simulate against an in-memory copy of the "
+                           "database and write it back once at the end")
+  parser.add_argument("--instrument", action="store_true",
+                      help="time the phases of every simulation and write "
+                           "one profile record per simulation to " +
+                           profile_file)
+  parser.add_argument("--profile", action="store_true",
+                      help="run every simulation under cProfile and "
+                           "tracemalloc, writing pstats files and a ranking "
+                           "of hours and candidates to " + profile_dir)
+  parser.add_argument("--seed", type=int, default=None,
+                      help="seed for the service time draws, so a run can "
+                           "be reproduced; fresh entropy if omitted")
+  parser.add_argument("--replications", type=int, default=None,
+                      help="simulate each candidate this many times on "
+                           "common random service draws shared by every "
+                           "candidate of an hour, and report paired "
+                           "differences between candidates")
+  parser.add_argument("--sequential", action="store_true",
+                      help="simulate each candidate in parallel batches of "
+                           "replications until the confidence interval of "
+                           "the hour's mean wait clears the threshold")
+  parser.add_argument("--workers", type=int, default=None,
+                      help="worker processes for --sequential, one per CPU "
+                           "if omitted")
+  parser.add_argument("--max-replications", type=int, default=50,
+                      help="replication budget per candidate for "
+                           "--sequential")
+  args = parser.parse_args()
+  ave_wait_threshold = args.threshold
+  dataset_file = args.dataset
+  if args.synthetic and (dataset_file is not None or args.sequential):
+    parser.error("--synthetic cannot be combined with a dataset or "
+                 "--sequential")
+  if args.arrivals and (dataset_file is not None or args.synthetic or
+                        args.sequential):
+    parser.error("--arrivals cannot be combined with a dataset, "
+                 "--synthetic or --sequential")
+  if args.sequential and (args.replications or args.profile or
+                          args.instrument):
+    parser.error("--sequential chooses its own replications and runs them "
+                 "in workers, so it cannot be combined with --replications, "
+                 "--profile or --instrument")
+
+  # Arrival schedules need no database beyond a scratch one for the
+  # server statistics of the reports.
+  database = ":memory:" if args.arrivals else customs_db
+  from_database = not (args.synthetic or args.arrivals)
+
+  # Work on an in-memory copy of the database.
+  if args.in_memory and not args.arrivals:
+    customs_sql.load_into_memory(database)
+
+  # Bring the database up to the current schema and indexes.
+  if not args.arrivals:
+    customs_schema.migrate(customs_sql.get_connection(database))
 
   # Create directory to hold output if not exists.
   if not os.path.exists("./output"):
     os.makedirs("./output")
 
-  # Read in the sample server schedule.
+  # Draw all randomness of the run from streams of one seed.
+  service_seed, crn_seed = customs_random.spawn_seeds(args.seed, 2)
+  rng = customs_random.make_rng(service_seed)
+
+  # Read in the sample server schedule.  Pandas is imported here rather
+  # than at module level, so workers and --help start without it.
+  import pandas as pd
   server_schedule = pd.read_csv(server_schedule_file)
 
-  # Initialize a plane dispatcher to generate arrivals from the databse.
-  plane_dispatcher = PlaneDispatcher(customs_db)
+  # Initialize a plane dispatcher to generate arrivals from the databse,
+  # from the memory-mapped compiled dataset if one was given, from
+  # manifests synthesized at dispatch, or from an arrival schedule CSV.
+  if args.arrivals:
+    plane_dispatcher = CsvPlaneDispatcher(args.arrivals, service_seed)
+  elif args.synthetic:
+    plane_dispatcher = SyntheticPlaneDispatcher(database, service_seed)
+  elif dataset_file is not None:
+    plane_dispatcher = DatasetPlaneDispatcher(dataset_file, rng=rng)
+  else:
+    plane_dispatcher = PlaneDispatcher(database)
 
   # Initialize service times for the passengers.
-  init_service_times(customs_db)
+  if from_database:
+    init_service_times(database, rng)
+
+  # Draw common random numbers for the candidates, if asked for.
+  crn = None
+  if args.replications:
+    crn = customs_replication.CommonRandomNumbers(plane_dispatcher, crn_seed,
+                                                  args.replications)
+
+  # Start the sequential sampling workers, if asked for.  They attach
+  # to the given dataset, or to the database compiled with its service
+  # times, published once in shared memory.
+  sampler = None
+  if args.sequential:
+    if dataset_file is not None:
+      shared_path = customs_shared.publish_dataset(dataset_file)
+    else:
+      customs_sql.get_connection(database).commit()
+      customs_sql.write_back(database)
+      shared_path = customs_shared.publish_database(database)
+    sampler = customs_sequential.SequentialSampler(
+                  shared_path, crn_seed, args.workers,
+                  max_replications=args.max_replications)
+
+  # Initialize the instrumentation and profiler, if asked for.
+  instrument = Instrument() if args.instrument else None
+  profiler = SimulationProfiler(profile_dir) if args.profile else None
 
   # Optimize and save best model.
-  final_model = optimize(customs_db, plane_dispatcher, server_schedule,
-                         spd_factor, ave_wait_threshold, opt_report_file)
+  # The published dataset is removed even if the optimization fails.
+  try:
+    final_model = optimize(database, plane_dispatcher, server_schedule,
+                           spd_factor, ave_wait_threshold, opt_report_file,
+                           instrument, profiler, crn, sampler)
+  finally:
+    if sampler is not None:
+      sampler.close()
+      customs_shared.unpublish_dataset(shared_path)
 
   # Compare with linear heuristic.
-  compare_to_heuristic(final_model, customs_db, plane_dispatcher,
-                       server_schedule, spd_factor, heur_report_file)
+  compare_to_heuristic(final_model, database, plane_dispatcher,
+                       server_schedule, spd_factor, heur_report_file,
+                       instrument, profiler)
+
+  # Write the simulation profiles.
+  if instrument is not None: instrument.write(profile_file)
+  if profiler is not None:
+    profiler.write(os.path.join(profile_dir, "summary.csv"))
+    print(profiler.summary())
 
   # Clean-up Resources.
-  reset_db(customs_db)
+  if from_database: reset_db(database)
   del plane_dispatcher
+  customs_sql.write_back(database)
+  customs_sql.close_all()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,950 @@
+##
+##  JFK Customs Simulation
+##  customs_benchmark.py
+##
+##  Created by Justin Fung on 10/22/17.
+##  Copyright 2017 Justin Fung. All rights reserved.
+##
+## ====================================================================
+# pylint: disable=bad-indentation,bad-continuation,multiple-statements
+# pylint: disable=invalid-name
+
+"""
+Benchmarks for the customs pipeline on synthetic databases built in the
+project's schema.  Can be invoked from the command line through the
+following:
+
+> python customs_benchmark.py queries --scale 10
+> python customs_benchmark.py suite --scale 1 10 100
+> python customs_benchmark.py footprint --scale 1
+> python customs_benchmark.py startup
+> python customs_benchmark.py parse recorded/
+
+Synthetic databases are generated offline from a fixed seed.  One unit
+of scale is a day of JFK-like traffic: 2,500 arrival records, a fifth
+of which are operating flights and the rest code-shares, with ~200
+passengers per operating flight.  The suite also scales the server
+schedule, so each unit of scale adds 20 servers to every hour.
+
+The suite times the pipeline stages, each drawing from a generator
+seeded with the suite's seed, and appends one JSON record per stage
+and scale to a history file:
+
+  Benchmark           | Times
+  ---------------------------------------------------------------------
+  init_service_times  | sampling and storing every passenger's service time
+  simulate            | one 24-hour simulation at the scaled schedule
+  generate_report     | the report step of that simulation
+  optimize            | the full greedy schedule optimization
+  passenger_generator | faking every manifest from the planes table
+
+Each record carries the git revision, so a regression shows up as a
+jump between revisions at the same scale and seed.
+
+The footprint benchmark dispatches every plane of a day and keeps them,
+and reports the memory retained per 100k passengers and per server.
+
+The startup benchmark times fresh interpreters importing the simulation
+core, running "customs.py --help", and initializing a sequential
+sampling worker as a spawned process would, attached to the database
+published in shared memory by customs_shared, and checks each against
+its budget in startup_budgets.  It also checks that importing the core
+does not load pandas.
+
+The parse benchmark runs the arrivals scraper's extraction over a
+corpus of pages recorded with "customs_scrape_arrivals.py --record",
+once per installed HTML parser backend, and reports each backend's
+throughput and whether it extracts the same records as the reference
+html5lib backend.
+
+Usage:
+  Please see README for how to compile the program and run the
+  model and data formatting requirements.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+import pandas as pd
+
+import customs
+import customs_passenger_generator
+import customs_random
+import customs_schema
+import customs_shared
+import customs_sql
+from customs_instrument import Instrument
+from customs_obj import PlaneDispatcher
+from customs_obj import ServiceAgent
+from customs_obj import day_ticks
+
+
+## ====================================================================
+
+
+# Directory holding generated databases.
+bench_dir = "output/benchmarks"
+
+# Append-only record of suite results, one JSON object per line.
+history_file = os.path.join(bench_dir, "history.jsonl")
+
+# Server schedule scaled by the suite.
+server_schedule_file = "schedules/sample_server_schedule.csv"
+
+# Suite stages, in run order.  simulate also yields generate_report.
+suite_benchmarks = ("init_service_times", "simulate", "optimize",
+                    "passenger_generator")
+
+# Slowdown against the previous run that is flagged as a regression.
+regression_ratio = 1.10
+
+# Startup budgets in seconds, best of several fresh interpreters.
+startup_budgets = {'import_core': 0.35,
+                   'cli_help': 0.35,
+                   'worker_init': 0.60}
+
+# Python snippets timed by bench_startup.  The worker snippet takes the
+# filename of a dataset published by customs_shared as its argument.
+core_import = 'import customs_obj, customs, customs_sequential'
+worker_init = ('import sys, customs_sequential; '
+               'customs_sequential.init_worker(sys.argv[1], 0, 10)')
+
+# Records per unit of scale.
+arrivals_per_scale = 2500
+airports_per_scale = 200
+aircraft_types = ["A319", "A320", "A321", "A330", "A340", "A350", "A380",
+                  "B737", "B747", "B757", "B767", "B777", "B787", "E175",
+                  "E190", "CRJ9"]
+airlines = ["AA", "BA", "DL", "LH", "AF", "KL", "EK", "QR", "JL", "B6",
+            "UA", "VS", "IB", "AZ", "TK", "SQ", "CX", "LX", "OS", "SK"]
+terminals = [1, 2, 4, 4, 4, 5, 7, 8]
+
+# Hot queries timed by bench_queries.
+hot_queries = {
+  'passengers by flight_num': ('SELECT id, flight_num, first_name, '
+                                 'last_name, birthdate, nationality '
+                               'FROM passengers WHERE flight_num = ?;'),
+  'intl arrivals join': ('SELECT arrivals.arrival_time, arrivals.id '
+                         'FROM arrivals LEFT JOIN airports '
+                           'ON arrivals.airport_code = airports.code '
+                         'WHERE arrivals.code_share = \'\' '
+                           'AND arrivals.terminal = \'4\' '
+                           'AND airports.country != "United States" '
+                           'AND airports.preclearance != "true";'),
+  'planes by flight_num': ('SELECT aircraft, total_seats FROM planes '
+                           'WHERE flight_num = ?;'),
+  'planes by aircraft': ('SELECT total_seats FROM planes '
+                         'WHERE aircraft = ?;'),
+  'codeshare probe': ('SELECT * FROM passengers WHERE flight_num = ?;')
+}
+
+
+## ====================================================================
+
+
+def synthetic_db_path(scale, seed):
+  """
+  Returns the filename of a synthetic database.
+
+  Args:
+    scale: integer multiple of a day of JFK traffic
+    seed: integer random seed
+
+  Returns:
+    path: a string
+  """
+  return os.path.join(bench_dir, "synthetic_%dx_%d.sqlite" % (scale, seed))
+
+
+def build_synthetic_db(path, scale=1, seed=0, migrate=True):
+  """
+  Builds a synthetic customs database with arrivals, airports, planes
+  and passengers tables.
+
+  Args:
+    path: filename of the database to create, replaced if present
+    scale: integer multiple of a day of JFK traffic
+    seed: integer random seed
+    migrate: boolean for bringing the database to the current schema
+             version; False leaves a bare version 0 database
+
+  Returns:
+    path: filename of the created database
+  """
+  if os.path.exists(path): os.remove(path)
+  directory = os.path.dirname(path)
+  if directory and not os.path.exists(directory): os.makedirs(directory)
+
+  rng = random.Random(seed)
+  connection = customs_sql.connect(path, 'bulk_load')
+
+  # Bare tables, as the original scripts built them.
+  for table in ('arrivals', 'airports', 'planes', 'passengers'):
+    connection.execute(customs_schema.tables[table])
+
+  # Airports: mostly foreign, a few preclearance.
+  codes = ["(%s%s%s)" % (chr(65 + i // 676), chr(65 + i // 26 % 26),
+                         chr(65 + i % 26))
+           for i in range(airports_per_scale * scale)]
+  customs_sql.execute_batches(connection,
+                              'INSERT INTO airports VALUES (?, ?, ?, ?, ?);',
+                              ((code, code, code,
+                                "United States" if rng.random() < 0.2
+                                                else "Abroad",
+                                "true" if rng.random() < 0.05 else "false")
+                               for code in codes))
+
+  # Arrivals: one operating flight for every four code-shares.
+  num_arrivals = arrivals_per_scale * scale
+  operating = []
+  rows = []
+  for i in range(num_arrivals):
+    airline = rng.choice(airlines)
+    flight_num = "%s %d" % (airline, i)
+    if operating and rng.random() < 0.8:
+      code_share, arrival_time, code, terminal = rng.choice(operating)
+    else:
+      code_share = ""
+      arrival_time = "%02d:%02d:00" % (rng.randint(0, 23),
+                                       rng.randint(0, 5) * 10)
+      code = rng.choice(codes)
+      terminal = rng.choice(terminals)
+      operating.append((flight_num, arrival_time, code, terminal))
+    rows.append(("Origin", code, arrival_time, airline, flight_num, terminal,
+                 code_share))
+  customs_sql.execute_batches(connection,
+                              'INSERT INTO arrivals (origin, airport_code, '
+                                'arrival_time, airline, flight_num, '
+                                'terminal, code_share) '
+                              'VALUES (?, ?, ?, ?, ?, ?, ?);', rows)
+
+  # Planes: one per arrival, some with unknown seat counts.
+  seats = dict((aircraft, rng.randint(100, 450)) for aircraft in
+               aircraft_types)
+  plane_types = dict((row[4], rng.choice(aircraft_types)) for row in rows)
+  customs_sql.execute_batches(connection,
+                              'INSERT INTO planes (flight_num, carrier, '
+                                'aircraft, total_seats) '
+                              'VALUES (?, ?, ?, ?);',
+                              ((row[4], row[3], plane_types[row[4]],
+                                -1 if rng.random() < 0.1
+                                   else seats[plane_types[row[4]]])
+                               for row in rows))
+
+  # Passengers: the operating flights' manifests.
+  def passengers():
+    for flight_num, _, _, _ in operating:
+      nationality_distribution = rng.triangular(0.3, 0.5, 0.4)
+      for _ in range(seats[plane_types[flight_num]]):
+        yield (flight_num, "First", "Last", str(rng.randint(1930, 2010)),
+               "domestic" if rng.random() < nationality_distribution
+                          else "foreign")
+  customs_sql.execute_batches(connection,
+                              'INSERT INTO passengers (flight_num, '
+                                'first_name, last_name, birthdate, '
+                                'nationality) '
+                              'VALUES (?, ?, ?, ?, ?);', passengers())
+
+  if migrate:
+    customs_schema.migrate(connection)
+  connection.close()
+  return path
+
+
+## ====================================================================
+
+
+def _time_query(connection, query, params_list):
+  """
+  Times a query over a list of parameter tuples.
+
+  Args:
+    connection: an open sqlite3 connection
+    query: a parameterized SQL statement
+    params_list: list of parameter tuples
+
+  Returns:
+    latency: mean seconds per execution
+  """
+  start = time.time()
+  for params in params_list:
+    connection.execute(query, params).fetchall()
+  return (time.time() - start) / len(params_list)
+
+
+def bench_queries(path, samples=200, seed=0):
+  """
+  Times the hot lookups on a version 0 database, migrates it, and times
+  them again.
+
+  Args:
+    path: filename of a synthetic database at schema version 0
+    samples: number of lookups per query
+    seed: integer random seed for choosing lookup keys
+
+  Returns:
+    results: list of (query, seconds before, seconds after) tuples
+  """
+  rng = random.Random(seed)
+  connection = customs_sql.connect(path, 'read')
+
+  flight_nums = [row[0] for row in connection.execute(
+                      'SELECT flight_num FROM arrivals;').fetchall()]
+  flights = [(rng.choice(flight_nums),) for _ in range(samples)]
+  aircraft = [(rng.choice(aircraft_types),) for _ in range(samples)]
+  params = {'passengers by flight_num': flights,
+            'intl arrivals join': [()] * max(1, samples // 20),
+            'planes by flight_num': flights,
+            'planes by aircraft': aircraft,
+            'codeshare probe': flights}
+
+  before = dict((name, _time_query(connection, query, params[name]))
+                for name, query in hot_queries.items())
+  customs_schema.migrate(connection)
+  after = dict((name, _time_query(connection, query, params[name]))
+               for name, query in hot_queries.items())
+  connection.close()
+
+  return [(name, before[name], after[name]) for name in sorted(hot_queries)]
+
+
+## ====================================================================
+
+
+def _retained(build):
+  """
+  Measures the memory retained by the objects a function builds.
+
+  Args:
+    build: function of no arguments returning the objects
+
+  Returns:
+    objects: the built objects
+    size: bytes still allocated once build returns
+  """
+  tracemalloc.start()
+  before = tracemalloc.get_traced_memory()[0]
+  objects = build()
+  size = tracemalloc.get_traced_memory()[0] - before
+  tracemalloc.stop()
+  return objects, size
+
+
+def bench_footprint(path, servers=1000):
+  """
+  Measures the memory retained by the simulation's hot objects: every
+  plane of a day with its passengers, as dispatched, and a pool of
+  service agents.
+
+  Args:
+    path: filename of a database with service times initialized
+    servers: number of service agents to build
+
+  Returns:
+    footprint: dictionary of passengers, bytes per 100k passengers and
+               bytes per server
+  """
+  plane_dispatcher = PlaneDispatcher(path)
+
+  def dispatch_all():
+    planes = []
+    for tick in range(0, day_ticks + 1):
+      planes += plane_dispatcher.dispatch_planes(tick)
+    return planes
+
+  planes, plane_bytes = _retained(dispatch_all)
+  passengers = sum(len(plane.plist) for plane in planes)
+  del planes
+
+  agents, server_bytes = _retained(
+                  lambda: [ServiceAgent(i, 'domestic', None)
+                           for i in range(servers)])
+  del agents
+
+  return {'passengers': passengers,
+          'per_100k_passengers': plane_bytes * 100000.0 / max(passengers, 1),
+          'per_server': server_bytes / float(servers)}
+
+
+def _best_seconds(command, repeat):
+  """
+  Times a command in fresh processes.
+
+  Args:
+    command: argument list of the command
+    repeat: number of runs
+
+  Returns:
+    seconds: best wall time of the runs
+  """
+  here = os.path.dirname(os.path.abspath(__file__))
+  best = None
+  with open(os.devnull, 'w') as devnull:
+    for _ in range(repeat):
+      start = time.time()
+      subprocess.check_call(command, cwd=here, stdout=devnull, stderr=devnull)
+      seconds = time.time() - start
+      best = seconds if best is None else min(best, seconds)
+  return best
+
+
+def bench_startup(path, repeat=5):
+  """
+  Times interpreter startup for the simulation core, the command line
+  and a sequential sampling worker, against startup_budgets.  The
+  database is published in shared memory for the worker to attach to,
+  as customs.py does for --sequential, and unpublished afterwards.
+
+  Args:
+    path: filename of a database with service times initialized
+    repeat: runs per command, the best of which is kept
+
+  Returns:
+    results: list of (name, seconds, budget) tuples
+    pandas_loaded: whether importing the core loaded pandas
+  """
+  shared_path = customs_shared.publish_database(path)
+  try:
+    commands = {
+      'import_core': [sys.executable, '-c', core_import],
+      'cli_help': [sys.executable, 'customs.py', '--help'],
+      'worker_init': [sys.executable, '-c', worker_init, shared_path]
+    }
+    results = [(name, _best_seconds(commands[name], repeat),
+                startup_budgets[name])
+               for name in ('import_core', 'cli_help', 'worker_init')]
+  finally:
+    customs_shared.unpublish_dataset(shared_path)
+
+  check = core_import + '; import sys; sys.exit("pandas" in sys.modules)'
+  pandas_loaded = subprocess.call(
+                      [sys.executable, '-c', check],
+                      cwd=os.path.dirname(os.path.abspath(__file__))) != 0
+
+  return results, pandas_loaded
+
+
+def load_corpus(corpus):
+  """
+  Reads a directory of recorded pages, split into listing pages and
+  flight pages.
+
+  Args:
+    corpus: directory of pages recorded by a customs_fetch.Fetcher
+
+  Returns:
+    listings: list of listing page html, by filename
+    flight_pages: list of flight page html, by filename
+  """
+  import customs_scrape_arrivals
+  listings, flight_pages = [], []
+  for name in sorted(os.listdir(corpus)):
+    if not name.endswith(".html"): continue
+    with open(os.path.join(corpus, name), "rb") as the_file:
+      html = the_file.read().decode("utf-8")
+    parent = 'id="%s"' % customs_scrape_arrivals.flight_divs['parent_div']
+    (listings if parent in html else flight_pages).append(html)
+  return listings, flight_pages
+
+
+def extract_corpus(listings, flight_pages, parser):
+  """
+  Extracts every record of a corpus as the arrivals scraper does.
+
+  Args:
+    listings: list of listing page html
+    flight_pages: list of flight page html
+    parser: a backend of customs_scrape_arrivals.parser_backends
+
+  Returns:
+    records: list of (flight attribute items, flight page link) tuples
+             of every listing, then the code share of every flight page
+  """
+  import customs_scrape_arrivals
+  cleaner = customs_scrape_arrivals.CleanExtractAndVerify()
+  records = []
+  for html in listings:
+    for flight in customs_scrape_arrivals.parse_listing(html, parser):
+      flight_attrs, link = customs_scrape_arrivals.extract_flight(cleaner,
+                                                                  flight)
+      records.append((sorted(flight_attrs.items()) if flight_attrs else None,
+                      link))
+  records += [customs_scrape_arrivals.code_share(html, parser)
+              for html in flight_pages]
+  return records
+
+
+def bench_parse(corpus, parsers=None, repeat=3):
+  """
+  Times the extraction of a corpus of recorded pages per parser backend
+  and checks each against the reference backend.
+
+  Args:
+    corpus: directory of pages recorded by a customs_fetch.Fetcher
+    parsers: backends to time, defaults to every installed one
+    repeat: runs per backend, the best of which is kept
+
+  Returns:
+    results: list of dictionaries, one per backend, the reference first
+  """
+  import customs_scrape_arrivals
+  listings, flight_pages = load_corpus(corpus)
+  pages = len(listings) + len(flight_pages)
+  megabytes = sum(len(html) for html in listings + flight_pages) / 1048576.0
+
+  reference = customs_scrape_arrivals.reference_parser
+  parsers = [reference] + [parser for parser in
+                           (parsers or
+                            customs_scrape_arrivals.available_parsers())
+                           if parser != reference]
+
+  results = []
+  expected = None
+  for parser in parsers:
+    best = None
+    for _ in range(repeat):
+      start = time.time()
+      records = extract_corpus(listings, flight_pages, parser)
+      seconds = time.time() - start
+      best = seconds if best is None else min(best, seconds)
+    if expected is None: expected = records
+
+    results.append({'parser': parser, 'pages': pages, 'seconds': best,
+                    'pages_per_second': pages / max(best, 1e-9),
+                    'mb_per_second': megabytes / max(best, 1e-9),
+                    'records': len(records),
+                    'identical': records == expected})
+  return results
+
+
+## ====================================================================
+
+
+class _Quiet(object):
+  """
+  Context manager silencing stdout, for stages that print progress.
+  """
+
+  def __enter__(self):
+    self._stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+
+  def __exit__(self, *exc_info):
+    sys.stdout.close()
+    sys.stdout = self._stdout
+
+
+def git_revision():
+  """
+  Returns the short git revision of the working tree.
+
+  Args:
+    None
+
+  Returns:
+    revision: a string, or None outside a git checkout
+  """
+  try:
+    with open(os.devnull, 'w') as devnull:
+      revision = subprocess.check_output(['git', 'rev-parse', '--short',
+                                          'HEAD'], stderr=devnull)
+  except (OSError, subprocess.CalledProcessError):
+    return None
+  return revision.decode().strip()
+
+
+def scaled_schedule(scale):
+  """
+  Reads the sample server schedule and multiplies its server counts.
+
+  Args:
+    scale: integer multiple of the sample schedule
+
+  Returns:
+    schedule: a Pandas dataframe
+  """
+  schedule = pd.read_csv(server_schedule_file)
+  counts = [column for column in schedule.columns if column != 'subsection']
+  schedule[counts] = schedule[counts] * scale
+  return schedule
+
+
+def copy_database(source, path):
+  """
+  Replaces a scratch database file with a copy of another database.
+
+  Args:
+    source: filename of the database to copy
+    path: filename of the scratch database
+
+  Returns:
+    path: filename of the scratch database
+  """
+  customs_sql.close_connection(path)
+  for suffix in ("", "-wal", "-shm"):
+    if os.path.exists(path + suffix): os.remove(path + suffix)
+  shutil.copyfile(source, path)
+  return path
+
+
+def working_copy(scale, seed, label="work"):
+  """
+  Copies the synthetic database of a scale to a scratch file, building
+  it first if needed, so every stage starts from the same data.
+
+  Args:
+    scale: integer multiple of a day of JFK traffic
+    seed: integer random seed
+    label: prefix of the scratch filename
+
+  Returns:
+    path: filename of the scratch database
+  """
+  source = synthetic_db_path(scale, seed)
+  if not os.path.exists(source): build_synthetic_db(source, scale, seed)
+  return copy_database(source, os.path.join(bench_dir, "%s_%dx_%d.sqlite"
+                                                       % (label, scale, seed)))
+
+
+def _bench_init_service_times(path, scale, threshold, rng):
+  """
+  Times sampling the service times of every passenger.
+
+  Args:
+    path: filename of a scratch database
+    scale: integer scale of the database
+    threshold: unused
+    rng: numpy Generator for the stage's draws
+
+  Returns:
+    results: list of (benchmark, seconds, extra fields) tuples
+  """
+  start = time.time()
+  customs.init_service_times(path, rng)
+  return [("init_service_times", time.time() - start, {})]
+
+
+def _bench_simulate(path, scale, threshold, rng):
+  """
+  Times one simulation at the scaled schedule, and its report step.
+
+  Args:
+    path: filename of a scratch database
+    scale: integer scale of the database
+    threshold: unused
+    rng: numpy Generator for the stage's draws
+
+  Returns:
+    results: list of (benchmark, seconds, extra fields) tuples
+  """
+  customs.init_service_times(path, rng)
+  plane_dispatcher = PlaneDispatcher(path)
+  instrument = Instrument()
+
+  start = time.time()
+  customs.simulate(path, plane_dispatcher, scaled_schedule(scale),
+                   customs.spd_factor, instrument)
+  seconds = time.time() - start
+
+  record = instrument.records[-1]
+  return [("simulate", seconds,
+           {'passengers_served': record['passengers_served']}),
+          ("generate_report", record['generate_report_time'], {})]
+
+
+def _bench_optimize(path, scale, threshold, rng):
+  """
+  Times a full schedule optimization at the scaled schedule.
+
+  Args:
+    path: filename of a scratch database
+    scale: integer scale of the database
+    threshold: average wait threshold in minutes
+    rng: numpy Generator for the stage's draws
+
+  Returns:
+    results: list of (benchmark, seconds, extra fields) tuples
+  """
+  customs.init_service_times(path, rng)
+  plane_dispatcher = PlaneDispatcher(path)
+  instrument = Instrument()
+  report_file = os.path.join(bench_dir, "optimize_%dx.csv" % scale)
+
+  start = time.time()
+  with _Quiet():
+    customs.optimize(path, plane_dispatcher, scaled_schedule(scale),
+                     customs.spd_factor, threshold, report_file, instrument)
+  seconds = time.time() - start
+
+  return [("optimize", seconds, {'simulations': len(instrument.records),
+                                 'threshold': threshold})]
+
+
+def _bench_passenger_generator(path, scale, threshold, rng):
+  """
+  Times faking every manifest into an emptied passengers table.
+
+  Args:
+    path: filename of a scratch database
+    scale: integer scale of the database
+    threshold: unused
+    rng: numpy Generator for the stage's draws
+
+  Returns:
+    results: list of (benchmark, seconds, extra fields) tuples
+  """
+  connection = customs_sql.connect(path, 'bulk_load')
+  connection.execute('DELETE FROM passengers;')
+  connection.commit()
+  connection.close()
+
+  start = time.time()
+  with _Quiet():
+    customs_passenger_generator.fake_passengers(path, rng)
+  return [("passenger_generator", time.time() - start, {})]
+
+
+# Stage runners by benchmark name.
+suite_runners = {'init_service_times': _bench_init_service_times,
+                 'simulate': _bench_simulate,
+                 'optimize': _bench_optimize,
+                 'passenger_generator': _bench_passenger_generator}
+
+
+def bench_suite(scale, seed=0, benchmarks=suite_benchmarks, threshold=15):
+  """
+  Runs suite stages on a fresh copy of a synthetic database each, with
+  a generator seeded afresh for every stage.
+
+  Args:
+    scale: integer multiple of a day of JFK traffic and of the schedule
+    seed: integer random seed for the data and the stages
+    benchmarks: stage names, keys of suite_runners
+    threshold: average wait threshold for optimize
+
+  Returns:
+    records: list of dictionary history records
+  """
+  revision = git_revision()
+  records = []
+
+  for benchmark in benchmarks:
+    path = working_copy(scale, seed)
+    rng = customs_random.make_rng(seed)
+    results = suite_runners[benchmark](path, scale, threshold, rng)
+    customs_sql.close_connection(path)
+
+    for name, seconds, extra in results:
+      record = {'timestamp': time.time(),
+                'revision': revision,
+                'python': platform.python_version(),
+                'machine': platform.node(),
+                'benchmark': name,
+                'scale': scale,
+                'seed': seed,
+                'seconds': round(seconds, 6)}
+      record.update(extra)
+      records.append(record)
+
+  return records
+
+
+def read_history(history=None):
+  """
+  Reads every record from a history file.
+
+  Args:
+    history: filename of the history, defaults to history_file
+
+  Returns:
+    records: list of dictionaries, oldest first
+  """
+  history = history or history_file
+  if not os.path.exists(history): return []
+  with open(history) as the_file:
+    return [json.loads(line) for line in the_file if line.strip()]
+
+
+def append_history(records, history=None):
+  """
+  Appends records to a history file.
+
+  Args:
+    records: list of dictionary history records
+    history: filename of the history, defaults to history_file
+
+  Returns:
+    VOID
+  """
+  history = history or history_file
+  directory = os.path.dirname(history)
+  if directory and not os.path.exists(directory): os.makedirs(directory)
+  with open(history, 'a') as the_file:
+    for record in records:
+      the_file.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def previous_result(past, record):
+  """
+  Finds the latest earlier result of the same stage, scale and seed on
+  the same machine.
+
+  Args:
+    past: list of history records, oldest first
+    record: a new history record
+
+  Returns:
+    previous: a history record, or None
+  """
+  key = ('benchmark', 'scale', 'seed', 'machine')
+  for candidate in reversed(past):
+    if all(candidate.get(field) == record[field] for field in key):
+      return candidate
+  return None
+
+
+## ====================================================================
+
+
+def main():
+  """
+  Main.  Invoked from command line with a benchmark name.
+
+  Args:
+    None
+
+  Returns:
+    VOID
+  """
+  parser = argparse.ArgumentParser(description="Customs benchmarks.")
+  subparsers = parser.add_subparsers(dest="benchmark")
+
+  queries = subparsers.add_parser("queries", help="hot query latency before "
+                                  "and after the schema migration")
+  queries.add_argument("--scale", type=int, nargs="+", default=[1, 10])
+  queries.add_argument("--seed", type=int, default=0)
+  queries.add_argument("--samples", type=int, default=200)
+
+  suite = subparsers.add_parser("suite", help="time the pipeline stages and "
+                                "append the results to the history")
+  suite.add_argument("--scale", type=int, nargs="+", default=[1, 10, 100])
+  suite.add_argument("--seed", type=int, default=0)
+  suite.add_argument("--benchmarks", nargs="+", default=list(suite_benchmarks),
+                     choices=suite_benchmarks)
+  suite.add_argument("--threshold", type=int, default=15)
+  suite.add_argument("--history", default=history_file)
+
+  footprint = subparsers.add_parser("footprint", help="memory retained per "
+                                    "100k dispatched passengers and per "
+                                    "server")
+  footprint.add_argument("--scale", type=int, nargs="+", default=[1])
+  footprint.add_argument("--seed", type=int, default=0)
+  footprint.add_argument("--servers", type=int, default=1000)
+
+  startup = subparsers.add_parser("startup", help="interpreter startup of "
+                                  "the core, the CLI and a worker against "
+                                  "their budgets")
+  startup.add_argument("--seed", type=int, default=0)
+  startup.add_argument("--repeat", type=int, default=5)
+
+  parse = subparsers.add_parser("parse", help="HTML parse throughput per "
+                                "parser backend over recorded pages")
+  parse.add_argument("corpus", help="directory of recorded pages")
+  parse.add_argument("--parsers", nargs="+", default=None)
+  parse.add_argument("--repeat", type=int, default=3)
+
+  args = parser.parse_args()
+
+  if args.benchmark == "queries":
+    for scale in args.scale:
+      path = build_synthetic_db(synthetic_db_path(scale, args.seed), scale,
+                                args.seed, migrate=False)
+      print("=" * 67)
+      print("Query latency at ", scale, "x scale (ms):", sep="")
+      print("                   Query |  Version 0 |  Indexed |  Speedup")
+      print("-" * 67)
+      for name, before, after in bench_queries(path, args.samples, args.seed):
+        print("%24s | %10.3f | %8.3f | %7.1fx" % (name, before * 1000,
+                                                 after * 1000,
+                                                 before / max(after, 1e-9)))
+  elif args.benchmark == "suite":
+    past = read_history(args.history)
+    for scale in args.scale:
+      records = bench_suite(scale, args.seed, args.benchmarks, args.threshold)
+      append_history(records, args.history)
+      print("=" * 67)
+      print("Suite at ", scale, "x scale (s):", sep="")
+      print("               Benchmark |    Seconds |  Previous |   Change")
+      print("-" * 67)
+      for record in records:
+        previous = previous_result(past, record)
+        if previous is None:
+          print("%24s | %10.3f | %9s | %8s" % (record['benchmark'],
+                                              record['seconds'], "-", "-"))
+          continue
+        ratio = record['seconds'] / max(previous['seconds'], 1e-9)
+        print("%24s | %10.3f | %9.3f | %+7.1f%%%s"
+              % (record['benchmark'], record['seconds'], previous['seconds'],
+                 (ratio - 1) * 100,
+                 "  REGRESSION" if ratio > regression_ratio else ""))
+  elif args.benchmark == "footprint":
+    for scale in args.scale:
+      path = working_copy(scale, args.seed, label="footprint")
+      customs.init_service_times(path, customs_random.make_rng(args.seed))
+      result = bench_footprint(path, args.servers)
+      customs_sql.close_connection(path)
+      print("=" * 67)
+      print("Footprint at ", scale, "x scale:", sep="")
+      print("  Passengers dispatched: ", result['passengers'], sep="")
+      print("  MB per 100k passengers: %.2f"
+            % (result['per_100k_passengers'] / 1048576.0))
+      print("  KB per server: %.2f" % (result['per_server'] / 1024.0))
+  elif args.benchmark == "startup":
+    path = working_copy(1, args.seed, label="startup")
+    customs.init_service_times(path, customs_random.make_rng(args.seed))
+    customs_sql.close_connection(path)
+    results, pandas_loaded = bench_startup(path, args.repeat)
+    over = [name for name, seconds, budget in results if seconds > budget]
+    print("===================================================================")
+    print("Startup (s):")
+    print("                 Command |    Seconds |    Budget")
+    print("-------------------------------------------------------------------")
+    for name, seconds, budget in results:
+      print("%24s | %10.3f | %9.3f%s" % (name, seconds, budget,
+                                        "  OVER BUDGET" if name in over
+                                        else ""))
+    print("  Core imports pandas: ", "yes" if pandas_loaded else "no", sep="")
+    if over or pandas_loaded: sys.exit(1)
+  elif args.benchmark == "parse":
+    results = bench_parse(args.corpus, args.parsers, args.repeat)
+    print("===================================================================")
+    print("Parsing ", results[0]['pages'], " pages of ", args.corpus, ":",
+          sep="")
+    print("                  Parser |    Seconds |  Pages/s |   MB/s | Records")
+    print("-------------------------------------------------------------------")
+    for result in results:
+      print("%24s | %10.3f | %8.1f | %6.2f | %s"
+            % (result['parser'], result['seconds'],
+               result['pages_per_second'], result['mb_per_second'],
+               "identical" if result['identical'] else "DIFFERENT"))
+    if not all(result['identical'] for result in results): sys.exit(1)
+  else:
+    parser.print_help()
+
+
+if __name__ == "__main__":
+  main()
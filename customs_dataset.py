@@ -0,0 +1,513 @@
+##
+##  JFK Customs Simulation
+##  customs_dataset.py
+##
+##  Created by Justin Fung on 10/22/17.
+##  Copyright 2017 Justin Fung. All rights reserved.
+##
+## ====================================================================
+# pylint: disable=bad-indentation,bad-continuation,multiple-statements
+# pylint: disable=invalid-name
+
+"""
+Compiles a customs database into a flat, versioned binary dataset of
+typed arrays, and loads it back through a read-only memory map.  Can be
+invoked from the command line through the following:
+
+> python customs_dataset.py customs_db.sqlite customs_db.dat
+
+The compiled file holds the international arrivals that the
+PlaneDispatcher would select, sorted by arrival time, and their
+passenger manifests in compressed-row form:
+
+  Array          | Type  | Length      | Contents
+  ---------------------------------------------------------------------
+  flight_ids     | int64 | flights     | arrivals.id
+  flight_nums    | S<n>  | flights     | arrivals.flight_num
+  arrival_secs   | int32 | flights     | arrival time in seconds of day
+  flight_offsets | int64 | flights + 1 | first passenger of each flight
+  passenger_ids  | int64 | passengers  | passengers.id
+  nationality    | uint8 | passengers  | 0 domestic, 1 foreign
+  service_times  | int32 | passengers  | sim time units, -1 if not set
+
+Loading maps the file and wraps each array in a NumPy view, so startup
+costs a header parse regardless of dataset size and the manifests never
+touch the Python heap.  Flight numbers are stored at the width of the
+longest one, which the array table records in the dtype (e.g. S7), so
+none is ever truncated.  The SHA-1 of the array contents is stored in
+the header and exposed as CompiledDataset.content_hash for caches.
+
+Usage:
+  Please see README for how to compile the program and run the
+  model and data formatting requirements.
+"""
+
+from __future__ import print_function
+
+from array import array
+
+import hashlib
+import mmap
+import struct
+import sys
+
+import numpy as np
+
+from customs_obj import Plane
+from customs_obj import _get_sec
+from customs_obj import _get_ttime
+from customs_obj import TriangularSampler
+from customs_obj import service_dist_dom
+from customs_obj import service_dist_intl
+from customs_obj import spd_factor
+
+import customs_random
+import customs_sql
+
+
+## ====================================================================
+
+
+# Format identification.
+format_magic = b'CUSTOMSD'
+format_version = 1
+
+# File header: magic, version, number of arrays, flights, passengers and
+# the hex SHA-1 of the array contents.
+header_struct = struct.Struct('<8sIIqq40s')
+
+# Array table entry: name, NumPy dtype string, byte offset, item count.
+entry_struct = struct.Struct('<16s8sqq')
+
+# Arrays are aligned so that every view starts on a cache line.
+alignment = 64
+
+# Nationality codes.
+nationality_codes = {'domestic': 0, 'foreign': 1}
+nationality_names = ('domestic', 'foreign')
+
+# Array names and dtypes, in file order.  Flight numbers are sized to
+# the longest one when compiled.
+dataset_arrays = (('flight_ids', '<i8'),
+                  ('flight_nums', None),
+                  ('arrival_secs', '<i4'),
+                  ('flight_offsets', '<i8'),
+                  ('passenger_ids', '<i8'),
+                  ('nationality', '|u1'),
+                  ('service_times', '<i4'))
+
+# International arrivals, as selected by PlaneDispatcher.
+intl_arrivals_query = ('SELECT arrivals.id, '
+                         'arrivals.flight_num, '
+                         'arrivals.arrival_time '
+                       'FROM arrivals LEFT JOIN airports '
+                         'ON arrivals.airport_code = airports.code '
+                       'WHERE arrivals.code_share = \'\' '
+                         'AND arrivals.terminal = \'4\' '
+                         'AND airports.country != "United States" '
+                         'AND airports.preclearance != "true";')
+
+
+## ====================================================================
+
+
+def _align(offset):
+  """
+  Rounds a byte offset up to the array alignment.
+
+  Args:
+    offset: an integer
+
+  Returns:
+    offset: an integer multiple of the alignment
+  """
+  return (offset + alignment - 1) // alignment * alignment
+
+
+def _content_hash(arrays):
+  """
+  Computes the SHA-1 of the format version and every array's name,
+  dtype and bytes.
+
+  Args:
+    arrays: a list of (name, numpy array) tuples in file order
+
+  Returns:
+    digest: hex digest as a string
+  """
+  sha = hashlib.sha1()
+  sha.update(struct.pack('<I', format_version))
+  for name, values in arrays:
+    sha.update(name.encode('ascii'))
+    sha.update(values.dtype.str.encode('ascii'))
+    sha.update(np.ascontiguousarray(values).tobytes())
+  return sha.hexdigest()
+
+
+def read_arrays(database):
+  """
+  Reads the international arrivals and their manifests out of a customs
+  database into typed arrays.
+
+  Args:
+    database: sqlite database holding 'arrivals', 'airports' and
+              'passengers' tables
+
+  Returns:
+    arrays: a list of (name, numpy array) tuples in file order
+  """
+
+  # Open connection to DB.
+  connection = customs_sql.connect(database, 'read')
+  cursor = connection.cursor()
+
+  # Service times only exist once init_service_times has been run.
+  columns = customs_sql.table_columns(connection, 'passengers')
+  service_column = 'service_time' if 'service_time' in columns else '-1'
+
+  # Sort the arrivals by time so the dispatcher can walk them in order.
+  arrivals = cursor.execute(intl_arrivals_query).fetchall()
+  arrivals.sort(key=lambda arrival: (_get_sec(arrival[2], 1), arrival[0]))
+
+  flight_ids = array('q')
+  flight_nums = []
+  arrival_secs = array('i')
+  flight_offsets = array('q', [0])
+  passenger_ids = array('q')
+  nationality = array('B')
+  service_times = array('i')
+
+  # Stream each manifest straight into the passenger arrays.
+  for arrival_id, flight_num, arrival_time in arrivals:
+    cursor.execute('SELECT id, nationality, {service} '
+                   'FROM passengers '
+                   'WHERE flight_num = ? '
+                   'ORDER BY id;'.format(service=service_column),
+                   (flight_num,))
+    for pid, nation, service_time in cursor:
+      passenger_ids.append(pid)
+      nationality.append(nationality_codes.get(nation, 1))
+      service_times.append(-1 if service_time is None else int(service_time))
+
+    flight_ids.append(arrival_id)
+    flight_nums.append(flight_num.encode('utf-8'))
+    arrival_secs.append(int(_get_sec(arrival_time, 1)))
+    flight_offsets.append(len(passenger_ids))
+
+  connection.close()
+
+  # Size the flight numbers to the longest, so none is truncated.
+  width = max([len(flight_num) for flight_num in flight_nums] or [1])
+
+  # Wrap as NumPy arrays of the on-disk dtypes.
+  values = {'flight_ids': np.frombuffer(flight_ids, dtype=np.int64),
+            'flight_nums': np.array(flight_nums, dtype='|S%d' % width),
+            'arrival_secs': np.frombuffer(arrival_secs, dtype=np.int32),
+            'flight_offsets': np.frombuffer(flight_offsets, dtype=np.int64),
+            'passenger_ids': np.frombuffer(passenger_ids, dtype=np.int64),
+            'nationality': np.frombuffer(nationality, dtype=np.uint8),
+            'service_times': np.frombuffer(service_times, dtype=np.int32)}
+
+  return [(name, values[name] if dtype is None else
+                 values[name].astype(dtype, copy=False))
+          for name, dtype in dataset_arrays]
+
+
+def write_dataset(arrays, output_file):
+  """
+  Writes typed arrays out in the compiled dataset format.
+
+  Args:
+    arrays: a list of (name, numpy array) tuples in file order
+    output_file: filename of the compiled dataset
+
+  Returns:
+    digest: content hash of the written dataset as a string
+  """
+
+  digest = _content_hash(arrays)
+  values = dict(arrays)
+  num_flights = len(values['flight_ids'])
+  num_passengers = len(values['passenger_ids'])
+
+  # Lay out the array table and the aligned array offsets.
+  offset = _align(header_struct.size + entry_struct.size * len(arrays))
+  entries = []
+  for name, data in arrays:
+    # The table's fixed-width fields would silently cut a longer name
+    # or dtype, e.g. of a very wide flight number.
+    if len(name) > 16 or len(data.dtype.str) > 8:
+      raise ValueError('Array %s of dtype %s does not fit the array table.'
+                       % (name, data.dtype.str))
+    entries.append(entry_struct.pack(name.encode('ascii'),
+                                     data.dtype.str.encode('ascii'),
+                                     offset, len(data)))
+    offset = _align(offset + data.nbytes)
+
+  # Write header, table and arrays.
+  with open(output_file, 'wb') as the_file:
+    the_file.write(header_struct.pack(format_magic, format_version,
+                                      len(arrays), num_flights,
+                                      num_passengers,
+                                      digest.encode('ascii')))
+    for entry in entries:
+      the_file.write(entry)
+    for (name, data), entry in zip(arrays, entries):
+      the_file.seek(entry_struct.unpack(entry)[2])
+      the_file.write(np.ascontiguousarray(data).tobytes())
+
+  return digest
+
+
+def compile_dataset(database, output_file):
+  """
+  Compiles a customs database into a binary dataset file.
+
+  Args:
+    database: sqlite database holding 'arrivals', 'airports' and
+              'passengers' tables
+    output_file: filename of the compiled dataset
+
+  Returns:
+    digest: content hash of the compiled dataset as a string
+  """
+  return write_dataset(read_arrays(database), output_file)
+
+
+## ====================================================================
+
+
+class CompiledDataset(object):
+  """
+  Read-only view of a compiled dataset file.
+
+  Member Data:
+    path: filename of the compiled dataset
+    version: format version of the file
+    content_hash: hex SHA-1 of the array contents
+    num_flights: number of international arrivals
+    num_passengers: number of passengers across all manifests
+    flight_num_width: bytes per flight number
+    arrays: dictionary of read-only NumPy views by array name
+
+  Member Functions:
+    manifest: returns the passenger slice of one flight
+    close: releases the memory map
+  """
+
+  def __init__(self, path):
+    """
+    Maps a compiled dataset file and validates its header.
+    """
+    self.path = path
+    with open(path, 'rb') as the_file:
+      self._map = mmap.mmap(the_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # Parse and verify the header.
+    magic, self.version, num_arrays, self.num_flights, \
+    self.num_passengers, digest = header_struct.unpack_from(self._map, 0)
+    if magic != format_magic:
+      raise ValueError('%s is not a compiled customs dataset.' % path)
+    if self.version != format_version:
+      raise ValueError('%s has format version %d, expected %d.'
+                       % (path, self.version, format_version))
+    self.content_hash = digest.decode('ascii')
+
+    # Wrap each array in a view onto the map.
+    self.arrays = {}
+    for i in range(num_arrays):
+      name, dtype, offset, count = entry_struct.unpack_from(
+                  self._map, header_struct.size + i * entry_struct.size)
+      name = name.rstrip(b'\0').decode('ascii')
+      dtype = np.dtype(dtype.rstrip(b'\0').decode('ascii'))
+      self.arrays[name] = np.frombuffer(self._map, dtype=dtype, count=count,
+                                        offset=offset)
+    self.flight_num_width = self.arrays['flight_nums'].dtype.itemsize
+
+  def __getattr__(self, name):
+    """
+    Exposes the arrays as attributes.
+    """
+    arrays = self.__dict__.get('arrays', {})
+    if name in arrays:
+      return arrays[name]
+    raise AttributeError(name)
+
+  def manifest(self, flight_idx):
+    """
+    Returns the passenger slice of one flight.
+
+    Args:
+      flight_idx: index of the flight in arrival order
+
+    Returns:
+      rows: a slice object into the passenger arrays
+    """
+    offsets = self.arrays['flight_offsets']
+    return slice(int(offsets[flight_idx]), int(offsets[flight_idx + 1]))
+
+  def close(self):
+    """
+    Drops the array views and releases the memory map.
+
+    Args:
+      None
+
+    Returns:
+      VOID
+    """
+    self.arrays = {}
+    self._map.close()
+
+
+def load_dataset(path):
+  """
+  Memory-maps a compiled dataset file.
+
+  Args:
+    path: filename of the compiled dataset
+
+  Returns:
+    dataset: an initialized CompiledDataset object
+  """
+  return CompiledDataset(path)
+
+
+## ====================================================================
+
+
+class DatasetPlaneDispatcher(object):
+  """
+  PlaneDispatcher counterpart that builds planes from a compiled
+  dataset instead of querying SQLite.  Passengers without a service time
+  in the dataset are drawn one time at instantiation so that every
+  simulation of an optimization sees the same draws.
+
+  Member Data:
+    dataset: an initialized CompiledDataset object
+    service_times: service times by passenger index
+    intl_arrival_dict: dictionary with arrival times in seconds as keys
+                       and flight indices as values
+    plane_count: simple integer count of planes initialized
+    passenger_count: simple integer count of passengers initialized
+    in_memory_report: boolean for simulations reporting without the
+                      passengers table, e.g. in workers with no database
+
+  Member Functions:
+    dispatch_planes: returns initialized planes if simulation time
+                     matches an arrival.
+  """
+
+  def __init__(self, dataset, speed_factor=spd_factor, rng=None,
+               in_memory_report=False):
+    """
+    DatasetPlaneDispatcher must be instantiated with a CompiledDataset
+    or the filename of one, and optionally the Generator to draw missing
+    service times from.
+    """
+    if not isinstance(dataset, CompiledDataset):
+      dataset = load_dataset(dataset)
+    self.dataset = dataset
+    self.speed_factor = speed_factor
+    self.in_memory_report = in_memory_report
+    self.service_times = self.init_service_times(rng)
+    self.intl_arrival_dict = {}
+    for idx, secs in enumerate(dataset.arrival_secs.tolist()):
+      self.intl_arrival_dict.setdefault(secs, []).append(idx)
+    self.plane_count = 0
+    self.passenger_count = 0
+
+
+  def init_service_times(self, rng=None):
+    """
+    Fills in service times missing from the dataset.
+
+    Args:
+      rng: numpy Generator to draw the missing service times from
+
+    Returns:
+      service_times: the mapped array, or a filled-in copy of it
+    """
+    service_times = self.dataset.service_times
+    missing = np.flatnonzero(service_times < 0)
+    if len(missing) == 0: return service_times
+
+    rng = customs_random.make_rng(rng)
+    service_times = service_times.copy()
+    domestic = self.dataset.nationality[missing] == \
+               nationality_codes['domestic']
+    for dist, rows in ((service_dist_dom, missing[domestic]),
+                       (service_dist_intl, missing[~domestic])):
+      service_times[rows] = TriangularSampler(dist, rng).draws(len(rows))
+    return service_times
+
+
+  def dispatch_planes(self, current_time):
+    """
+    DatasetPlaneDispatcher class method for initializing and returning
+    new planes on schedule.
+
+    Args:
+      current_time: simulation time in simulation time units.
+
+    Returns:
+      planes: a list of instantiated Plane objects
+    """
+    planes = []
+
+    # If a plane is not due, return empty list immediately.
+    flights = self.intl_arrival_dict.get(current_time * self.speed_factor)
+    if flights is None: return planes
+
+    arrival_time = _get_ttime(current_time, self.speed_factor)
+    dataset = self.dataset
+
+    for idx in flights:
+      flight_num = dataset.flight_nums[idx].decode('utf-8')
+      rows = dataset.manifest(idx)
+
+      # Build the manifest in the row format of the passengers table.
+      plist = [(pid, flight_num, None, None, None,
+                nationality_names[nation], service_time)
+               for pid, nation, service_time in
+               zip(dataset.passenger_ids[rows].tolist(),
+                   dataset.nationality[rows].tolist(),
+                   self.service_times[rows].tolist())]
+
+      planes.append(Plane(int(dataset.flight_ids[idx]), None, None,
+                          arrival_time, None, flight_num, '4', plist))
+
+      # Increment counts for planes and passengers dispatched.
+      self.plane_count += 1
+      self.passenger_count += len(plist)
+
+    return planes
+
+
+## ====================================================================
+
+
+def main():
+  """
+  Main.  Invoked from command line with the database and output
+  filenames.
+
+  Args:
+    None
+
+  Returns:
+    VOID
+  """
+  database = sys.argv[1]
+  output_file = sys.argv[2]
+
+  digest = compile_dataset(database, output_file)
+  dataset = load_dataset(output_file)
+  print("Compiled ", dataset.num_flights, " flights and ",
+        dataset.num_passengers, " passengers into ", output_file,
+        " (", digest, ").", sep="")
+  dataset.close()
+
+
+if __name__ == "__main__":
+  main()
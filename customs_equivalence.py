@@ -0,0 +1,316 @@
+##
+##  JFK Customs Simulation
+##  customs_equivalence.py
+##
+##  Created by Justin Fung on 10/22/17.
+##  Copyright 2017 Justin Fung. All rights reserved.
+##
+## ====================================================================
+# pylint: disable=bad-indentation,bad-continuation,multiple-statements
+# pylint: disable=invalid-name
+
+"""
+Equivalence and speed harness for simulation engines.  Runs the
+reference tick engine and alternative engines on identical inputs,
+checks that every engine reproduces the reference report hour by hour,
+and reports each engine's speedup.  Can be invoked from the command line
+through the following:
+
+> python customs_equivalence.py --scale 1 10 --tolerance 0
+
+An engine is a function taking a database filename, a server schedule
+and a speed factor, and returning the report of one simulation, as
+customs.simulate does.  Engines are registered by name in the engines
+dictionary; "tick" is the reference.
+
+Every engine runs on its own copy of one synthetic database whose
+service times were drawn once from a fixed seed, so all engines see the
+same passengers and the same service times.
+
+Reports are matched on (hour, type).  With a tolerance of 0 every
+column must be equal; otherwise each numeric column may differ by that
+fraction of the larger of the two values, for engines that are only
+statistically equivalent.
+
+Usage:
+  Please see README for how to compile the program and run the
+  model and data formatting requirements.
+"""
+
+from __future__ import print_function
+
+from collections import OrderedDict
+
+import argparse
+import os
+import sys
+import time
+
+import customs
+import customs_benchmark
+import customs_dataset
+import customs_random
+import customs_sql
+from customs_obj import PlaneDispatcher
+
+
+## ====================================================================
+
+
+# Report columns compared between engines, per (hour, type) row.
+report_values = ("count", "ave_wait", "max_wait", "ave_server_utilization",
+                 "num_servers")
+
+# Mismatches printed per engine on the command line.
+max_printed = 10
+
+
+## ====================================================================
+
+
+def tick_engine(database, server_schedule, speed_factor):
+  """
+  Reference engine: the tick loop with the SQLite plane dispatcher.
+
+  Args:
+    database: sqlite database holding the customs tables
+    server_schedule: a Pandas dataframe
+    speed_factor: a speed factor for simulation time
+
+  Returns:
+    report: simulation report as pandas dataframe
+  """
+  return customs.simulate(database, PlaneDispatcher(database),
+                          server_schedule, speed_factor)
+
+
+def dataset_engine(database, server_schedule, speed_factor):
+  """
+  The tick loop with planes built from a compiled dataset.  Compiling
+  the dataset is part of the timed run.
+
+  Args:
+    database: sqlite database holding the customs tables
+    server_schedule: a Pandas dataframe
+    speed_factor: a speed factor for simulation time
+
+  Returns:
+    report: simulation report as pandas dataframe
+  """
+  dataset_file = os.path.splitext(database)[0] + ".dat"
+  customs_dataset.compile_dataset(database, dataset_file)
+  dataset = customs_dataset.load_dataset(dataset_file)
+  plane_dispatcher = customs_dataset.DatasetPlaneDispatcher(dataset,
+                                                            speed_factor)
+  report = customs.simulate(database, plane_dispatcher, server_schedule,
+                            speed_factor)
+
+  # The dispatcher holds views onto the map, so release it first.
+  del plane_dispatcher
+  dataset.close()
+  return report
+
+
+# Registered engines by name.
+engines = OrderedDict([('tick', tick_engine),
+                       ('dataset', dataset_engine)])
+
+# Name of the engine every other engine is checked against.
+reference_engine = 'tick'
+
+
+def register_engine(name, engine):
+  """
+  Registers a simulation engine with the harness.
+
+  Args:
+    name: engine name as a string
+    engine: function of (database, server_schedule, speed_factor)
+            returning a report dataframe
+
+  Returns:
+    VOID
+  """
+  engines[name] = engine
+
+
+## ====================================================================
+
+
+def _report_rows(report):
+  """
+  Indexes a report's rows by (hour, type).
+
+  Args:
+    report: simulation report as pandas dataframe
+
+  Returns:
+    rows: dictionary of value tuples keyed by (hour, type)
+  """
+  rows = {}
+  for _, row in report.iterrows():
+    key = (int(row['hour']), str(row['type']))
+    rows[key] = tuple(float(row[column]) for column in report_values)
+  return rows
+
+
+def compare_reports(reference, candidate, tolerance=0.0):
+  """
+  Compares two simulation reports hour by hour.
+
+  Args:
+    reference: report of the reference engine
+    candidate: report of the engine under test
+    tolerance: allowed relative difference per value, 0 for equality
+
+  Returns:
+    mismatches: list of (hour, type, column, expected, actual) tuples;
+                a missing row has column None
+  """
+  expected = _report_rows(reference)
+  actual = _report_rows(candidate)
+  mismatches = []
+
+  for key in sorted(set(expected) | set(actual)):
+    if key not in actual or key not in expected:
+      mismatches.append(key + (None, expected.get(key), actual.get(key)))
+      continue
+
+    for column, want, got in zip(report_values, expected[key], actual[key]):
+      if abs(want - got) > tolerance * max(abs(want), abs(got)):
+        mismatches.append(key + (column, want, got))
+
+  return mismatches
+
+
+def prepare_database(scale, seed):
+  """
+  Builds the shared input of a scale: a synthetic database with service
+  times drawn from a fixed seed.
+
+  Args:
+    scale: integer multiple of a day of JFK traffic
+    seed: integer random seed
+
+  Returns:
+    path: filename of the prepared database
+  """
+  path = customs_benchmark.working_copy(scale, seed, label="equivalence")
+  customs.init_service_times(path, customs_random.make_rng(seed))
+  customs_sql.close_connection(path)
+  return path
+
+
+def run_engine(name, source, server_schedule, speed_factor):
+  """
+  Runs one engine on a fresh copy of the prepared database.
+
+  Args:
+    name: a key of engines
+    source: filename of the prepared database
+    server_schedule: a Pandas dataframe
+    speed_factor: a speed factor for simulation time
+
+  Returns:
+    report: simulation report as pandas dataframe
+    seconds: wall time of the engine
+  """
+  path = customs_benchmark.copy_database(
+                       source, "%s_%s.sqlite" % (os.path.splitext(source)[0],
+                                                 name))
+
+  start = time.time()
+  report = engines[name](path, server_schedule.copy(), speed_factor)
+  seconds = time.time() - start
+
+  customs_sql.close_connection(path)
+  return report, seconds
+
+
+def check_engines(scale, seed=0, names=None, tolerance=0.0):
+  """
+  Runs the reference engine and the named engines at one scale and
+  checks each against the reference.
+
+  Args:
+    scale: integer multiple of a day of JFK traffic and of the schedule
+    seed: integer random seed for the data and the service times
+    names: engine names to check, defaults to every registered engine
+    tolerance: allowed relative difference per value, 0 for equality
+
+  Returns:
+    results: list of dictionaries, the reference first
+  """
+  names = [name for name in (names or engines) if name != reference_engine]
+  source = prepare_database(scale, seed)
+  server_schedule = customs_benchmark.scaled_schedule(scale)
+  speed_factor = customs.spd_factor
+
+  reference, reference_seconds = run_engine(reference_engine, source,
+                                            server_schedule, speed_factor)
+  results = [{'engine': reference_engine, 'scale': scale,
+              'seconds': reference_seconds, 'speedup': 1.0,
+              'rows': len(reference), 'mismatches': []}]
+
+  for name in names:
+    report, seconds = run_engine(name, source, server_schedule, speed_factor)
+    results.append({'engine': name, 'scale': scale, 'seconds': seconds,
+                    'speedup': reference_seconds / max(seconds, 1e-9),
+                    'rows': len(report),
+                    'mismatches': compare_reports(reference, report,
+                                                  tolerance)})
+
+  return results
+
+
+## ====================================================================
+
+
+def main():
+  """
+  Main.  Invoked from command line.  Exits with status 1 if any engine
+  does not reproduce the reference report.
+
+  Args:
+    None
+
+  Returns:
+    VOID
+  """
+  parser = argparse.ArgumentParser(description="Simulation engine "
+                                   "equivalence and speed harness.")
+  parser.add_argument("--scale", type=int, nargs="+", default=[1, 10])
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--engines", nargs="+", choices=list(engines))
+  parser.add_argument("--tolerance", type=float, default=0.0)
+  args = parser.parse_args()
+
+  failed = False
+  for scale in args.scale:
+    results = check_engines(scale, args.seed, args.engines, args.tolerance)
+
+    print("===================================================================")
+    print("Engines at ", scale, "x scale:", sep="")
+    print("     Engine |  Seconds |  Speedup | Rows | Mismatches")
+    print("-------------------------------------------------------------------")
+    for result in results:
+      print("%11s | %8.2f | %7.2fx | %4d | %10d"
+            % (result['engine'], result['seconds'], result['speedup'],
+               result['rows'], len(result['mismatches'])))
+
+    for result in results:
+      if not result['mismatches']: continue
+      failed = True
+      print("-" * 67)
+      print("Mismatches of ", result['engine'], " at ", scale, "x scale:",
+            sep="")
+      for hour, kind, column, want, got in \
+          result['mismatches'][:max_printed]:
+        print("  hour ", hour, ", ", kind, ", ", column or "row", ": expected ",
+              want, ", got ", got, sep="")
+
+  if failed: sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
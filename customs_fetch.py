@@ -0,0 +1,609 @@
+##
+##  JFK Customs Simulation
+##  customs_fetch.py
+##
+##  Created by Justin Fung on 10/22/17.
+##  Copyright 2017 Justin Fung. All rights reserved.
+##
+## ====================================================================
+# pylint: disable=bad-indentation,bad-continuation,multiple-statements
+# pylint: disable=invalid-name
+
+"""
+Concurrent, rate-limited page fetching for the scrapers, and a local
+stand-in server that replays recorded pages.
+
+A Fetcher runs GET requests on a thread pool over one keep-alive
+session.  Requests to a host are bounded twice: at most `concurrency`
+are in flight at once, and they start no faster than a token bucket of
+`rate` requests per second with bursts of `burst` allows.  A parse
+function can be run on each page in the worker that fetched it, so
+parsing overlaps with the fetches still in flight and only the parsed
+result is kept.
+
+An HttpCache keeps responses in an SQLite file keyed by URL.  A page
+younger than its time-to-live is served from the cache without a
+request; an older one is revalidated with If-None-Match and
+If-Modified-Since, and a 304 answer serves the cached body.  The cache
+also holds small memos, such as the code-share status of a flight
+number, which let repeat and resumed scrapes skip pages altogether.
+
+Pages can be recorded to a directory as they are fetched, and replayed
+by the stand-in server, so the scrapers can be run against recorded
+pages instead of the live sites:
+
+> python customs_scrape_arrivals.py --record recorded/
+> python customs_fetch.py recorded/ --port 8000
+> python customs_scrape_arrivals.py --base-url http://localhost:8000
+
+Usage:
+  Please see README for how to compile the program and run the
+  model and data formatting requirements.
+"""
+
+from __future__ import print_function
+
+from concurrent.futures import ThreadPoolExecutor
+
+import argparse
+import os
+import threading
+import time
+import zlib
+
+try:
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+  from socketserver import ThreadingMixIn
+  from urllib.parse import quote, urlsplit
+except ImportError:
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+  from SocketServer import ThreadingMixIn
+  from urllib import quote
+  from urlparse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import customs_sql
+
+
+## ====================================================================
+
+
+# Requests in flight per host.
+default_concurrency = 4
+
+# Requests started per second per host.
+default_rate = 4.0
+
+# Seconds to wait on a connection or a response.
+default_timeout = 30
+
+# Filename of the HTTP response cache.
+cache_db = "http_cache.sqlite"
+
+# Tables of the HTTP response cache.  Times are seconds since epoch.
+cache_tables = (
+  'CREATE TABLE IF NOT EXISTS responses ('
+    'url TEXT PRIMARY KEY, '
+    'body TEXT, '
+    'etag TEXT, '
+    'last_modified TEXT, '
+    'fetched REAL);',
+  'CREATE TABLE IF NOT EXISTS memos ('
+    'kind TEXT, '
+    'key TEXT, '
+    'value TEXT, '
+    'updated REAL, '
+    'PRIMARY KEY (kind, key));')
+
+
+## ====================================================================
+
+
+class TokenBucket(object):
+  """
+  Thread-safe token bucket.  Tokens accrue at a fixed rate up to a
+  capacity, and each request takes one, waiting for it if need be.
+
+  Member Data:
+    rate: tokens added per second
+    capacity: most tokens held, i.e. the largest burst
+
+  Member Functions:
+    acquire: takes a token, blocking until one is available
+  """
+
+  def __init__(self, rate, capacity=None):
+    """
+    TokenBucket must be instantiated with a positive rate.  It starts
+    full.
+    """
+    self.rate = float(rate)
+    self.capacity = float(capacity or max(1.0, rate))
+    self._tokens = self.capacity
+    self._updated = time.time()
+    self._lock = threading.Lock()
+
+
+  def acquire(self):
+    """
+    Takes a token, sleeping until one has accrued.
+
+    Args:
+      None
+
+    Returns:
+      VOID
+    """
+    while True:
+      with self._lock:
+        now = time.time()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+          self._tokens -= 1
+          return
+        wait = (1 - self._tokens) / self.rate
+      time.sleep(wait)
+
+
+class HttpCache(object):
+  """
+  Thread-safe persistent cache of HTTP responses and memos in SQLite.
+
+  Member Data:
+    database: cache database filename
+    connection: the cache's connection, shared by the fetcher's threads
+
+  Member Functions:
+    lookup: returns a cached response
+    store: saves a response
+    touch: marks a response as revalidated
+    memo: returns a memoized value younger than a time-to-live
+    remember: saves a memoized value
+    commit: commits pending writes
+    close: commits and closes the cache
+  """
+
+  def __init__(self, database=cache_db):
+    """
+    HttpCache can be instantiated with the filename of its database,
+    which is created if need be.
+    """
+    self.database = database
+    self.connection = customs_sql.connect(database, 'bulk_load',
+                                          check_same_thread=False)
+    for query in cache_tables: self.connection.execute(query)
+    self.connection.commit()
+    self._lock = threading.Lock()
+
+
+  def lookup(self, url):
+    """
+    Returns a cached response.
+
+    Args:
+      url: page URL
+
+    Returns:
+      response: (body, etag, last_modified, fetched) tuple, or None
+    """
+    with self._lock:
+      return self.connection.execute(
+                   'SELECT body, etag, last_modified, fetched '
+                   'FROM responses WHERE url = ?;', (url,)).fetchone()
+
+
+  def store(self, url, body, etag=None, last_modified=None):
+    """
+    Saves a response, replacing any cached one.
+
+    Args:
+      url: page URL
+      body: decoded page body
+      etag: the response's ETag header, if any
+      last_modified: the response's Last-Modified header, if any
+
+    Returns:
+      VOID
+    """
+    with self._lock:
+      self.connection.execute('INSERT OR REPLACE INTO responses '
+                              'VALUES (?, ?, ?, ?, ?);',
+                              (url, body, etag, last_modified, time.time()))
+
+
+  def touch(self, url):
+    """
+    Marks a cached response as fresh again after revalidation.
+
+    Args:
+      url: page URL
+
+    Returns:
+      VOID
+    """
+    with self._lock:
+      self.connection.execute('UPDATE responses SET fetched = ? '
+                              'WHERE url = ?;', (time.time(), url))
+
+
+  def memo(self, kind, key, ttl=None):
+    """
+    Returns a memoized value.
+
+    Args:
+      kind: memo name, e.g. "code_share"
+      key: string key, e.g. a flight number
+      ttl: None, or the largest age in seconds of a value returned
+
+    Returns:
+      value: the memoized string, or None if absent or too old
+    """
+    with self._lock:
+      row = self.connection.execute('SELECT value, updated FROM memos '
+                                    'WHERE kind = ? AND key = ?;',
+                                    (kind, key)).fetchone()
+    if row is None: return None
+    if ttl is not None and time.time() - row[1] > ttl: return None
+    return row[0]
+
+
+  def remember(self, kind, key, value):
+    """
+    Saves a memoized value.
+
+    Args:
+      kind: memo name, e.g. "code_share"
+      key: string key, e.g. a flight number
+      value: string value
+
+    Returns:
+      VOID
+    """
+    with self._lock:
+      self.connection.execute('INSERT OR REPLACE INTO memos '
+                              'VALUES (?, ?, ?, ?);',
+                              (kind, key, value, time.time()))
+
+
+  def commit(self):
+    """
+    Commits pending writes, e.g. once per listing so an interrupted
+    scrape resumes from them.
+
+    Args:
+      None
+
+    Returns:
+      VOID
+    """
+    with self._lock:
+      self.connection.commit()
+
+
+  def close(self):
+    """
+    Commits and closes the cache.
+
+    Args:
+      None
+
+    Returns:
+      VOID
+    """
+    self.commit()
+    self.connection.close()
+
+
+def page_file(directory, url):
+  """
+  Names the file a page is recorded to, from its path and query.
+
+  Args:
+    directory: recording directory
+    url: page URL, or the path and query of one
+
+  Returns:
+    filename: a path in directory
+  """
+  parts = urlsplit(url)
+  name = parts.path + ("?" + parts.query if parts.query else "")
+  return os.path.join(directory, quote(name or "/", safe="") + ".html")
+
+
+class Fetcher(object):
+  """
+  Class fetching pages on a thread pool with per-host concurrency and
+  rate limits over one pooled keep-alive session.
+
+  Member Data:
+    concurrency: requests in flight per host
+    rate: requests started per second per host
+    burst: largest burst of requests per host
+    timeout: seconds to wait on a connection or a response
+    record_dir: None, or a directory every page returned is written to,
+                whether fetched or served from the cache
+    cache: None, or an HttpCache of responses
+    session: the shared requests Session
+
+  Member Functions:
+    get: fetches a page in the calling thread
+    submit: fetches a page, and optionally parses it, in the pool
+    close: shuts down the pool and the session
+  """
+
+  def __init__(self, concurrency=default_concurrency, rate=default_rate,
+               burst=None, workers=None, timeout=default_timeout,
+               record_dir=None, cache=None):
+    """
+    Fetcher can be instantiated with its limits; the pool defaults to
+    twice the per-host concurrency, so parsing in the pool does not
+    starve the fetches.
+    """
+    self.concurrency = concurrency
+    self.rate = rate
+    self.burst = burst
+    self.timeout = timeout
+    self.record_dir = record_dir
+    self.cache = cache
+    if record_dir is not None and not os.path.exists(record_dir):
+      os.makedirs(record_dir)
+
+    # Keep up to one connection per concurrent request to a host.
+    self.session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=concurrency)
+    self.session.mount("http://", adapter)
+    self.session.mount("https://", adapter)
+
+    self._limits = {}
+    self._lock = threading.Lock()
+    self._pool = ThreadPoolExecutor(workers or 2 * concurrency)
+
+
+  def _host_limits(self, url):
+    """
+    Returns the semaphore and token bucket of a URL's host.
+
+    Args:
+      url: page URL
+
+    Returns:
+      semaphore: bounds the requests in flight to the host
+      bucket: TokenBucket of the host
+    """
+    host = urlsplit(url).netloc
+    with self._lock:
+      if host not in self._limits:
+        self._limits[host] = (threading.BoundedSemaphore(self.concurrency),
+                              TokenBucket(self.rate, self.burst))
+      return self._limits[host]
+
+
+  def get(self, url, ttl=None):
+    """
+    Fetches a page within its host's limits, or from the cache.
+
+    Args:
+      url: page URL
+      ttl: seconds a cached page is served without revalidation; None
+           revalidates every cached page
+
+    Returns:
+      text: the page's decoded body
+    """
+    cached = self.cache.lookup(url) if self.cache is not None else None
+    if cached is not None and ttl is not None and \
+       time.time() - cached[3] <= ttl:
+      return self._record(url, cached[0])
+
+    # Revalidate a stale page by its validators.
+    headers = {}
+    if cached is not None:
+      if cached[1]: headers['If-None-Match'] = cached[1]
+      if cached[2]: headers['If-Modified-Since'] = cached[2]
+
+    semaphore, bucket = self._host_limits(url)
+    with semaphore:
+      bucket.acquire()
+      response = self.session.get(url, headers=headers, timeout=self.timeout)
+      if response.status_code == 304 and cached is not None:
+        self.cache.touch(url)
+        return self._record(url, cached[0])
+      response.raise_for_status()
+      text = response.text
+
+    if self.cache is not None:
+      self.cache.store(url, text, response.headers.get('ETag'),
+                       response.headers.get('Last-Modified'))
+
+    return self._record(url, text)
+
+
+  def _record(self, url, text):
+    """
+    Writes a page to the recording directory, if recording.
+
+    Args:
+      url: page URL
+      text: the page's decoded body
+
+    Returns:
+      text: the page's decoded body, unchanged
+    """
+    if self.record_dir is not None:
+      with open(page_file(self.record_dir, url), "wb") as the_file:
+        the_file.write(text.encode("utf-8"))
+    return text
+
+
+  def _get_and_parse(self, url, parse, ttl):
+    """
+    Fetches a page and parses it in the same worker.
+
+    Args:
+      url: page URL
+      parse: function of the page text
+      ttl: seconds a cached page is served without revalidation
+
+    Returns:
+      result: what parse returns
+    """
+    return parse(self.get(url, ttl))
+
+
+  def submit(self, url, parse=None, ttl=None):
+    """
+    Fetches a page in the pool.
+
+    Args:
+      url: page URL
+      parse: None, or a function of the page text run in the worker
+      ttl: seconds a cached page is served without revalidation
+
+    Returns:
+      future: resolves to the page text, or to the parsed result
+    """
+    if parse is None: return self._pool.submit(self.get, url, ttl)
+    return self._pool.submit(self._get_and_parse, url, parse, ttl)
+
+
+  def close(self):
+    """
+    Waits for pending fetches, then shuts down the pool and session.
+
+    Args:
+      None
+
+    Returns:
+      VOID
+    """
+    self._pool.shutdown(wait=True)
+    self.session.close()
+
+
+## ====================================================================
+
+
+class RecordedPageHandler(BaseHTTPRequestHandler):
+  """
+  Request handler serving the pages recorded under its server's
+  directory, and 404 for any other page.  Pages carry an ETag of their
+  contents and are answered with 304 when it matches.
+  """
+
+  def do_GET(self):
+    """
+    Serves a recorded page.
+
+    Args:
+      None
+
+    Returns:
+      VOID
+    """
+    path = page_file(self.server.directory, self.path)
+    if not os.path.exists(path):
+      self.send_error(404)
+      return
+
+    with open(path, "rb") as the_file:
+      body = the_file.read()
+    etag = '"%08x"' % (zlib.crc32(body) & 0xffffffff)
+    if self.headers.get("If-None-Match") == etag:
+      self.send_response(304)
+      self.send_header("ETag", etag)
+      self.send_header("Content-Length", "0")
+      self.end_headers()
+      return
+
+    self.send_response(200)
+    self.send_header("ETag", etag)
+    self.send_header("Content-Type", "text/html; charset=utf-8")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+
+  def log_message(self, *args):
+    """
+    Silences the per-request log.
+    """
+    pass
+
+
+class RecordedPageServer(ThreadingMixIn, HTTPServer):
+  """
+  Local stand-in HTTP server replaying recorded pages, one thread per
+  connection, with keep-alive.
+
+  Member Data:
+    directory: directory of recorded pages
+    base_url: URL to scrape the recorded pages from
+
+  Member Functions:
+    start: serves in a background thread
+  """
+
+  daemon_threads = True
+
+  def __init__(self, directory, port=0, host="127.0.0.1"):
+    """
+    RecordedPageServer must be instantiated with a directory of pages
+    recorded by a Fetcher.  Port 0 picks a free port.
+    """
+    RecordedPageHandler.protocol_version = "HTTP/1.1"
+    HTTPServer.__init__(self, (host, port), RecordedPageHandler)
+    self.directory = directory
+    self.base_url = "http://%s:%d" % self.server_address[:2]
+
+
+  def start(self):
+    """
+    Serves in a daemon thread, e.g. for a scrape in the same process.
+    Stop with shutdown().
+
+    Args:
+      None
+
+    Returns:
+      thread: the serving thread
+    """
+    thread = threading.Thread(target=self.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+## ====================================================================
+
+
+def main():
+  """
+  Main.  Invoked from command line.  Serves a directory of recorded
+  pages until interrupted.
+
+  Args:
+    None
+
+  Returns:
+    VOID
+  """
+  parser = argparse.ArgumentParser(description="Stand-in server replaying "
+                                   "recorded pages.")
+  parser.add_argument("directory")
+  parser.add_argument("--port", type=int, default=8000)
+  args = parser.parse_args()
+
+  server = RecordedPageServer(args.directory, args.port)
+  print("Serving ", args.directory, " at ", server.base_url, sep="")
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    server.server_close()
+
+
+if __name__ == "__main__":
+  main()
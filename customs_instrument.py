@@ -0,0 +1,454 @@
+##
+##  JFK Customs Simulation
+##  customs_instrument.py
+##
+##  Created by Justin Fung on 10/22/17.
+##  Copyright 2017 Justin Fung. All rights reserved.
+##
+## ====================================================================
+# pylint: disable=bad-indentation,bad-continuation,multiple-statements
+# pylint: disable=invalid-name
+
+"""
+Instrumentation for the simulation loop.  Records wall time and call
+counts for each phase of a simulation, counts events, and emits one
+profile record per simulation.
+
+An Instrument attaches to the objects of a single simulation by
+wrapping their bound methods on the instances, and detaches when the
+simulation finishes.  The simulation loop itself is unchanged, so a
+simulation run without an Instrument pays nothing for it.
+
+Phases:
+  update_servers, dispatch_planes, handle_arrivals, assign_passengers,
+  service_passengers, get_utilization, update_passengers,
+  generate_report
+
+Counters:
+  update_state_calls, passengers_assigned, planes_dispatched,
+  passengers_dispatched, passengers_served
+
+A SimulationProfiler runs whole simulations under cProfile and
+tracemalloc instead.  It writes one pstats file per simulation, tagged
+with the optimizer's hour, candidate server count and iteration, plus
+the replication index of replicated candidates, and ranks hours and
+candidates by the time and memory they consumed.
+
+Usage:
+  Please see README for how to compile the program and run the
+  model and data formatting requirements.
+"""
+
+from __future__ import print_function
+
+from collections import OrderedDict
+from timeit import default_timer
+
+import cProfile
+import csv
+import os
+import time
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+
+## ====================================================================
+
+
+# Phases of a simulation tick, in loop order.
+phases = ('update_servers', 'dispatch_planes', 'handle_arrivals',
+          'assign_passengers', 'service_passengers', 'get_utilization',
+          'update_passengers', 'generate_report')
+
+# Event counters.
+counters = ('update_state_calls', 'passengers_assigned', 'planes_dispatched',
+            'passengers_dispatched', 'passengers_served')
+
+
+## ====================================================================
+
+
+class Instrument(object):
+  """
+  Class for timing the phases of simulations and counting their
+  events.
+
+  Member Data:
+    times: dictionary of seconds per phase for the current simulation
+    calls: dictionary of call counts per phase for the current simulation
+    counts: dictionary of event counts for the current simulation
+    records: list of profile records, one per finished simulation
+
+  Member Functions:
+    attach: wraps the methods of a simulation's objects
+    finish: detaches and emits the simulation's profile record
+    write: appends the profile records to a CSV file
+  """
+
+  def __init__(self):
+    """
+    Instrument class initializer.
+    """
+    self.times = {}
+    self.calls = {}
+    self.counts = {}
+    self.records = []
+    self._wrapped = []
+    self._start = None
+
+
+  def _wrap(self, obj, name, phase, counter=None):
+    """
+    Replaces a bound method on an instance with a timed wrapper.
+
+    Args:
+      obj: the instance to wrap
+      name: method name as a string
+      phase: phase to charge the time to, or None to only count calls
+      counter: counter to increment per call, or None
+
+    Returns:
+      VOID
+    """
+    func = getattr(obj, name)
+    times = self.times
+    calls = self.calls
+    counts = self.counts
+    clock = default_timer
+
+    if phase is None:
+      def wrapper(*args, **kwargs):
+        counts[counter] += 1
+        return func(*args, **kwargs)
+    else:
+      def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+          return func(*args, **kwargs)
+        finally:
+          times[phase] += clock() - start
+          calls[phase] += 1
+
+    setattr(obj, name, wrapper)
+    self._wrapped.append((obj, name))
+
+
+  def _wrap_dispatch(self, plane_dispatcher):
+    """
+    Wraps dispatch_planes to also count planes and passengers.
+
+    Args:
+      plane_dispatcher: an initialized plane dispatcher
+
+    Returns:
+      VOID
+    """
+    self._wrap(plane_dispatcher, 'dispatch_planes', 'dispatch_planes')
+    timed = plane_dispatcher.dispatch_planes
+    counts = self.counts
+
+    def wrapper(current_time):
+      planes = timed(current_time)
+      if planes:
+        counts['planes_dispatched'] += len(planes)
+        counts['passengers_dispatched'] += sum(len(plane.plist)
+                                               for plane in planes)
+      return planes
+
+    plane_dispatcher.dispatch_planes = wrapper
+
+
+  def _wrap_assign(self, assignment_agent):
+    """
+    Wraps assign_passengers to also count passengers moved out of the
+    assignment queue.
+
+    Args:
+      assignment_agent: an initialized AssignmentAgent object
+
+    Returns:
+      VOID
+    """
+    self._wrap(assignment_agent, 'assign_passengers', 'assign_passengers')
+    timed = assignment_agent.assign_passengers
+    queue = assignment_agent.queue
+    counts = self.counts
+
+    def wrapper():
+      waiting = len(queue)
+      timed()
+      counts['passengers_assigned'] += waiting - len(queue)
+
+    assignment_agent.assign_passengers = wrapper
+
+
+  def attach(self, customs, plane_dispatcher):
+    """
+    Starts instrumenting a simulation.
+
+    Args:
+      customs: the simulation's initialized Customs object
+      plane_dispatcher: the simulation's plane dispatcher
+
+    Returns:
+      VOID
+    """
+    self.times = dict.fromkeys(phases, 0.0)
+    self.calls = dict.fromkeys(phases, 0)
+    self.counts = dict.fromkeys(counters, 0)
+    self._wrapped = []
+
+    self._wrap(customs, 'update_servers', 'update_servers')
+    self._wrap_dispatch(plane_dispatcher)
+    self._wrap(customs, 'handle_arrivals', 'handle_arrivals')
+    for section in customs.subsections:
+      parallel_server = section.parallel_server
+      self._wrap(parallel_server, 'update_state', None, 'update_state_calls')
+      self._wrap_assign(section.assignment_agent)
+      self._wrap(parallel_server, 'service_passengers', 'service_passengers')
+      self._wrap(parallel_server, 'get_utilization', 'get_utilization')
+    self._wrap(customs.outputs, 'update_passengers', 'update_passengers')
+    self._wrap(customs, 'generate_report', 'generate_report')
+
+    self._start = default_timer()
+
+
+  def finish(self, customs, **tags):
+    """
+    Stops instrumenting a simulation and emits its profile record.
+
+    Args:
+      customs: the simulation's Customs object
+      tags: extra fields to add to the record
+
+    Returns:
+      record: dictionary profile record
+    """
+    wall_time = default_timer() - self._start
+
+    # Restore the class methods.
+    for obj, name in self._wrapped:
+      obj.__dict__.pop(name, None)
+    self._wrapped = []
+
+    self.counts['passengers_served'] = customs.outputs.passengers_served
+
+    record = {'timestamp': time.time(),
+              'simulation': len(self.records),
+              'wall_time': round(wall_time, 6)}
+    record.update(tags)
+    for phase in phases:
+      record[phase + '_time'] = round(self.times[phase], 6)
+      record[phase + '_calls'] = self.calls[phase]
+    record.update(self.counts)
+
+    self.records.append(record)
+    return record
+
+
+  def write(self, output_file):
+    """
+    Appends the profile records to a CSV file, writing a header if the
+    file is new, and clears them.
+
+    Args:
+      output_file: file name as string for output
+
+    Returns:
+      VOID
+    """
+    if not self.records: return
+
+    fields = ['timestamp', 'simulation', 'wall_time']
+    for record in self.records:
+      for key in sorted(record):
+        if key not in fields: fields.append(key)
+
+    write_header = not os.path.exists(output_file)
+    with open(output_file, 'a') as the_file:
+      writer = csv.DictWriter(the_file, fieldnames=fields, delimiter=",")
+      if write_header: writer.writeheader()
+      for record in self.records:
+        writer.writerow(record)
+
+    self.records = []
+
+
+## ====================================================================
+
+
+class SimulationProfiler(object):
+  """
+  Class for profiling whole simulations called by the optimizer.
+
+  Member Data:
+    output_dir: directory for pstats files and the summary
+    rows: list of dictionaries, one per profiled simulation
+
+  Member Functions:
+    run: runs one simulation under the profilers
+    hours: ranks hours by total time
+    candidates: ranks (hour, server count) candidates by total time
+    summary: formats the rankings as text tables
+    write: writes the per-simulation rows to a CSV file
+  """
+
+  def __init__(self, output_dir):
+    """
+    SimulationProfiler class initializer.
+    """
+    self.output_dir = output_dir
+    self.rows = []
+    if not os.path.exists(output_dir):
+      os.makedirs(output_dir)
+
+
+  def run(self, func, args, hour, num_servers, iteration, replication=None):
+    """
+    Runs one simulation under cProfile and, where available,
+    tracemalloc, and dumps its stats.
+
+    Args:
+      func: the simulation function
+      args: tuple of arguments to func
+      hour: hour being optimized, or a label such as "final"
+      num_servers: candidate server count for the hour
+      iteration: index of the simulation within the optimization
+      replication: replication index of the candidate, or None if the
+                   candidate is simulated once
+
+    Returns:
+      result: the return value of func
+    """
+    profile = cProfile.Profile()
+    if tracemalloc is not None: tracemalloc.start()
+
+    start = default_timer()
+    result = profile.runcall(func, *args)
+    wall_time = default_timer() - start
+
+    peak = None
+    if tracemalloc is not None:
+      peak = tracemalloc.get_traced_memory()[1]
+      tracemalloc.stop()
+
+    # Tag the stats file with the candidate it belongs to.
+    label = hour if isinstance(hour, str) else "h%02d" % hour
+    label = "%s_s%03d_i%04d" % (label, int(num_servers), iteration)
+    if replication is not None: label += "_r%03d" % replication
+    stats_file = os.path.join(self.output_dir, label + ".pstats")
+    profile.dump_stats(stats_file)
+
+    self.rows.append(OrderedDict([('hour', hour),
+                                  ('num_servers', int(num_servers)),
+                                  ('iteration', iteration),
+                                  ('replication', replication),
+                                  ('wall_time', round(wall_time, 6)),
+                                  ('peak_mb', None if peak is None else
+                                              round(peak / 1048576.0, 3)),
+                                  ('stats_file', stats_file)]))
+    return result
+
+
+  def _rank(self, key):
+    """
+    Aggregates the rows by a key and sorts by total time.
+
+    Args:
+      key: function mapping a row to its group
+
+    Returns:
+      ranking: list of (group, simulations, seconds, peak MB) tuples
+    """
+    groups = OrderedDict()
+    for row in self.rows:
+      count, seconds, peak = groups.get(key(row), (0, 0.0, None))
+      if row['peak_mb'] is not None:
+        peak = max(peak or 0.0, row['peak_mb'])
+      groups[key(row)] = (count + 1, seconds + row['wall_time'], peak)
+
+    ranking = [(group,) + values for group, values in groups.items()]
+    ranking.sort(key=lambda item: item[2], reverse=True)
+    return ranking
+
+
+  def hours(self):
+    """
+    Ranks hours by the total time of their simulations.
+
+    Args:
+      None
+
+    Returns:
+      ranking: list of (hour, simulations, seconds, peak MB) tuples
+    """
+    return self._rank(lambda row: row['hour'])
+
+
+  def candidates(self):
+    """
+    Ranks (hour, server count) candidates by the total time of their
+    simulations.
+
+    Args:
+      None
+
+    Returns:
+      ranking: list of ((hour, servers), simulations, seconds, peak MB)
+               tuples
+    """
+    return self._rank(lambda row: (row['hour'], row['num_servers']))
+
+
+  def summary(self, top=10):
+    """
+    Formats the hour and candidate rankings as text tables.
+
+    Args:
+      top: number of candidates to list
+
+    Returns:
+      text: a string
+    """
+    lines = ["=" * 67,
+             "Most expensive hours:",
+             "    Hour | Simulations |  Seconds | Peak MB",
+             "-" * 67]
+    for hour, count, seconds, peak in self.hours():
+      lines.append("%8s | %11d | %8.2f | %7s" % (hour, count, seconds,
+                                                  "-" if peak is None
+                                                      else "%.1f" % peak))
+
+    lines += ["=" * 67,
+              "Most expensive candidates:",
+              "    Hour | Servers | Simulations |  Seconds | Peak MB",
+              "-" * 67]
+    for (hour, servers), count, seconds, peak in self.candidates()[:top]:
+      lines.append("%8s | %7d | %11d | %8.2f | %7s"
+                   % (hour, servers, count, seconds,
+                      "-" if peak is None else "%.1f" % peak))
+
+    return "\n".join(lines)
+
+
+  def write(self, output_file):
+    """
+    Writes the per-simulation rows to a CSV file.
+
+    Args:
+      output_file: file name as string for output
+
+    Returns:
+      VOID
+    """
+    if not self.rows: return
+
+    with open(output_file, 'w') as the_file:
+      writer = csv.DictWriter(the_file, fieldnames=list(self.rows[0].keys()),
+                              delimiter=",")
+      writer.writeheader()
+      for row in self.rows:
+        writer.writerow(row)
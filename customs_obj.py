@@ -14,6 +14,10 @@ Objects for simulating throughput of the international arrivals
 customs at JFK airport.  The customs system is modeled through OO
 construction.
 
+The simulation objects do not import pandas; it is loaded when a
+report is generated.  Server schedules given as dataframes are compiled
+to a plain ServerSchedule once per simulation.
+
 Usage:
   Please see the README for how to compile the program and run th
   model.
@@ -25,23 +29,23 @@ from collections import deque
 
 import csv
 import re
-import sqlite3
-import numpy as np
-import pandas as pd
 import os
-import time
 
+import customs_random
+import customs_schema
+import customs_sql
 
-## ====================================================================
 
+## ====================================================================
 
-# Random seed
-np.random.seed(int(time.time()))
 
 # Hourly timestamps (for output)
 hourly_timestamps = ["0" + str(i) + ":00:00" for i in range(0,10)] + \
                     [str(i) + ":00:00" for i in range(10,24)]
 
+# Canonical nationality strings, shared by every Passenger.
+nationalities = {'domestic': 'domestic', 'foreign': 'foreign'}
+
 # Service Distributions
 service_dist_dom = ("00:00:30", "00:01:00", "00:02:00")
 service_dist_intl = ("00:01:00", "00:02:00", "00:04:00")
@@ -49,11 +53,15 @@ service_dist_intl = ("00:01:00", "00:02:00", "00:04:00")
 # Speed up factor
 spd_factor = 10
 
+# Parsed "HH:MM:SS" strings, keyed by (string, speed factor).
+_sec_cache = {}
+
 # Helper functions
 def _get_sec(time_str, speed_factor):
   """
   Convert a string in "HH:MM:SS" format to seconds as an integer,
-  adjusted by a time resolution ("speed") factor.
+  adjusted by a time resolution ("speed") factor.  Results are cached,
+  as the same few timestamps are parsed for every passenger.
 
   Args:
     time_str: a string in "HH:MM:SS" format
@@ -62,14 +70,17 @@ def _get_sec(time_str, speed_factor):
   Returns:
     seconds: an integer
   """
+  seconds = _sec_cache.get((time_str, speed_factor))
+  if seconds is not None: return seconds
 
   # Split string and convert.
   h, m, s = time_str.split(':')
   seconds = int(h) * 3600 + int(m) * 60 + int(s)
 
   # Adjust for speed.
-  seconds = seconds / speed_factor
+  seconds = seconds // speed_factor
 
+  _sec_cache[(time_str, speed_factor)] = seconds
   return seconds
 
 
@@ -86,12 +97,17 @@ def _get_ttime(seconds, speed_factor):
     time_str: a string in "HH:MM:SS" format
   """
 
+  # Look up simulation ticks in the precomputed table.
+  if speed_factor == spd_factor:
+    time_str = tick_timestamps.get(seconds)
+    if time_str is not None: return time_str
+
   # Adjust for speed.
   seconds = seconds * speed_factor
 
   # Factor out hours, minutes and seconds into integers.
-  h = int(seconds/3600)
-  m = int(seconds%3600)/60
+  h = int(seconds//3600)
+  m = int(seconds%3600)//60
   s = int(seconds%3600)%60
 
   # If number of characters of the factors is 1, prepend zeroes to string.
@@ -104,13 +120,25 @@ def _get_ttime(seconds, speed_factor):
   return time_str
 
 
-def sample_from_triangular(service_dist):
+# Simulation ticks per hour and per day at the default speed factor.
+hour_ticks = _get_sec("01:00:00", spd_factor)
+day_ticks = _get_sec("24:00:00", spd_factor)
+
+# "HH:MM:SS" timestamps of every tick of a day, keyed by tick.  Empty
+# while it is filled, as _get_ttime looks ticks up in it.
+tick_timestamps = {}
+tick_timestamps.update((tick, _get_ttime(tick, spd_factor))
+                       for tick in range(0, day_ticks + 1))
+
+
+def sample_from_triangular(service_dist, rng=None):
   """
   Returns number of seconds.
 
   Args:
     service_dist: tuple of lower, middle, upper parameters of a
                   triangular distribution as strings in MM:SS format.
+    rng: numpy Generator to draw from; None draws from a fresh stream
 
   Returns:
     sample: service time in seconds as integer
@@ -123,10 +151,118 @@ def sample_from_triangular(service_dist):
   upper = _get_sec(service_dist[2], spd_factor)
 
   # Sample using Numpy triangular, and return.
-  sample = int(np.random.triangular(lower, mode, upper))
+  rng = customs_random.make_rng(rng)
+  sample = int(rng.triangular(lower, mode, upper))
   return sample
 
 
+class TriangularSampler(object):
+  """
+  Class drawing service times from a triangular distribution whose
+  parameters are parsed once, in vectorized blocks from a generator.
+
+  Member Data:
+    params: tuple of lower, mode and upper in simulation time units
+    rng: numpy Generator drawn from
+
+  Member Functions:
+    draws: returns an array of service times
+  """
+
+  def __init__(self, service_dist, rng=None, speed_factor=spd_factor):
+    """
+    TriangularSampler must be instantiated with a service distribution
+    as a tuple of "HH:MM:SS" strings.
+    """
+    self.params = tuple(_get_sec(value, speed_factor)
+                        for value in service_dist)
+    self.rng = customs_random.make_rng(rng)
+
+
+  def draws(self, count):
+    """
+    Returns a block of service times.
+
+    Args:
+      count: number of draws
+
+    Returns:
+      samples: integer array, truncated as int() truncates a sample
+    """
+    lower, mode, upper = self.params
+    return self.rng.triangular(lower, mode, upper, count).astype('int64')
+
+
+## ====================================================================
+
+
+class ServerSchedule(object):
+  """
+  Plain representation of a server schedule: for each subsection, its
+  maximum number of servers and its number of online servers per hour.
+
+  Member Data:
+    subsections: list of subsection labels in schedule order
+    max_servers: dictionary of maximum servers by subsection
+    hourly: dictionary of online server counts by subsection and hour
+
+  Member Functions:
+    online: returns the number of online servers of a subsection
+  """
+
+  def __init__(self, rows):
+    """
+    ServerSchedule must be instantiated with the rows of a schedule as
+    dictionaries with "subsection", "max" and hour columns "0" to "23".
+    The first row of each subsection is used.
+    """
+    self.subsections = []
+    self.max_servers = {}
+    self.hourly = {}
+
+    for row in rows:
+      subsection = str(row['subsection'])
+      if subsection in self.max_servers: continue
+
+      self.subsections.append(subsection)
+      self.max_servers[subsection] = int(row['max'])
+      self.hourly[subsection] = dict((int(str(column).strip()), int(value))
+                                     for column, value in row.items()
+                                     if re.match(r'\s*[0-9]+\s*$',
+                                                 str(column)))
+
+
+  def online(self, subsection, hour):
+    """
+    Returns the number of online servers of a subsection in an hour.
+
+    Args:
+      subsection: subsection label
+      hour: integer hour of the day
+
+    Returns:
+      num_servers: an integer
+    """
+    return self.hourly[subsection][hour]
+
+
+def compile_schedule(server_schedule):
+  """
+  Compiles a server schedule to a ServerSchedule.
+
+  Args:
+    server_schedule: a Pandas dataframe, a list of row dictionaries, or
+                     an already compiled ServerSchedule
+
+  Returns:
+    schedule: a ServerSchedule
+  """
+  if isinstance(server_schedule, ServerSchedule): return server_schedule
+  if hasattr(server_schedule, 'to_dict'):
+    server_schedule = server_schedule.to_dict('records')
+  return ServerSchedule(server_schedule)
+
+
 ## ====================================================================
 
 
@@ -137,12 +273,14 @@ class PlaneDispatcher(object):
   instantiated only one per simulation.
 
   Member Data:
-    connection: initialized connection to sqlite database
+    connection: shared connection to sqlite database from customs_sql
     cursor: initialized cursor for querying sqlite database
     intl_arrival_dict: dictionary with arrival times as keys and plane
                        ids as values
     intl_arrival_times: a set of unique arrival times of international
                         arrivals
+    service_times: None, or a dictionary of service times by passenger
+                   id overriding those in the database
     plane_count: simple integer count of planes initialized
     passenger_count: simple integer count of passengers initialized
 
@@ -151,7 +289,6 @@ class PlaneDispatcher(object):
                     matches an arrival.
     get_intl_arrivals: gets a dict of international arrival times and
                        plane ids from a sqlite database
-    __del__: overwritten destroyer function to close sqlite connection
   """
 
   def __init__(self, sqlite_database):
@@ -159,10 +296,11 @@ class PlaneDispatcher(object):
     PlaneDispatcher must be instantiated with an arrivals schedule
     whose format is specified in the README.
     """
-    self.connection = sqlite3.connect(sqlite_database)
+    self.connection = customs_sql.get_connection(sqlite_database)
     self.cursor = self.connection.cursor()
     self.intl_arrival_dict = self.get_intl_arrivals()
     self.intl_arrival_times = set(self.intl_arrival_dict.keys())
+    self.service_times = None
     self.plane_count = 0
     self.passenger_count = 0
 
@@ -216,12 +354,10 @@ class PlaneDispatcher(object):
     planes = []
 
     # If a plane is not due, return empty list immediately.
-    if _get_ttime(current_time, spd_factor) not in self.intl_arrival_times:
+    planes_list = self.intl_arrival_dict.get(tick_timestamps.get(current_time))
+    if planes_list is None:
       return planes
 
-    # Query dictionary for international arrival plane ids.
-    planes_list = self.intl_arrival_dict[_get_ttime(current_time, spd_factor)]
-
     # Build SQL statement.
     sql = ('SELECT id, origin, airport_code, arrival_time, airline, '
               'flight_num, terminal '
@@ -240,17 +376,23 @@ class PlaneDispatcher(object):
       pid, origin, airport_code, \
       arrival_time, airline, flight_num, terminal = arrival
 
-      # Grab the passenger manifest from the database.
+      # Grab the passenger manifest from the database.  Names and
+      # birthdates are left out; Passengers load them only if asked.
       plist = self.cursor.execute('SELECT id, '
                                      'flight_num, '
-                                     'first_name, '
-                                     'last_name, '
-                                     'birthdate, '
+                                     'NULL, '
+                                     'NULL, '
+                                     'NULL, '
                                      'nationality, '
                                      'service_time '
                                   'FROM passengers '
-                                  'WHERE flight_num = \'{flight_num}\';'\
-                                   .format(flight_num=flight_num)).fetchall()
+                                  'WHERE flight_num = ?;',
+                                  (flight_num,)).fetchall()
+
+      # Swap in overriding service times, if any.
+      if self.service_times is not None:
+        service_times = self.service_times
+        plist = [row[:6] + (service_times[row[0]],) for row in plist]
 
       # Init a Plane object and append to list.
       planes.append(Plane(pid,
@@ -260,7 +402,8 @@ class PlaneDispatcher(object):
                           airline,
                           flight_num,
                           terminal,
-                          plist))
+                          plist,
+                          self.connection))
 
       # Increment counts for planes and passengers dispatched.
       self.plane_count += 1
@@ -270,22 +413,6 @@ class PlaneDispatcher(object):
     return planes
 
 
-  def __del__(self):
-    '''
-    Overwrites default destroyer method to close the sqlite database
-    connection.
-
-    Args:
-      None
-
-    Returns:
-      VOID
-    '''
-
-    # Close the connection.
-    self.connection.close()
-
-
 class Plane(object):
   """
   Class representing an arriving Plane.
@@ -306,10 +433,15 @@ class Plane(object):
                 of the Plane object
   """
 
+  __slots__ = ('id', 'origin', 'airport_code', 'arrival_time', 'airline',
+               'flight_num', 'terminal', 'num_dom_passengers',
+               'num_intl_passengers', 'plist')
+
   def __init__(self, plane_id, origin, airport_code, arrival_time, airline,
-               flight_num, terminal, passenger_list):
+               flight_num, terminal, passenger_list, identity_source=None):
     """
-    Plane class initializer method.
+    Plane class initializer method.  identity_source is the database
+    connection the passengers load missing names and birthdates from.
     """
     self.id = plane_id
     self.origin = origin
@@ -320,10 +452,10 @@ class Plane(object):
     self.terminal = terminal
     self.num_dom_passengers = 0
     self.num_intl_passengers = 0
-    self.plist = self.init_plist(passenger_list)
+    self.plist = self.init_plist(passenger_list, identity_source)
 
 
-  def init_plist(self, passenger_list):
+  def init_plist(self, passenger_list, identity_source=None):
     """
     Plane class member function for initializing a list of passenger
     objects.
@@ -331,6 +463,7 @@ class Plane(object):
     Args:
       passenger_list: a list of passengers and their attributes
                       represented as tuples
+      identity_source: connection to load missing identity fields from
 
     Returns:
       plist: a list of initialized Passenger objects.
@@ -346,15 +479,17 @@ class Plane(object):
       pid, flight_num, first_name, \
       last_name, birthdate, nationality, service_time = passenger
 
-      # Init and append Passenger object with attributes.
+      # Init and append Passenger object with attributes, sharing the
+      # plane's strings.
       plist.append(Passenger(pid,
-                             flight_num,
+                             self.flight_num,
                              self.arrival_time,
                              first_name,
                              last_name,
                              birthdate,
                              nationality,
-                             service_time))
+                             service_time,
+                             identity_source))
 
       # Increment passenger count.
       if plist[-1].nationality == 'domestic':
@@ -374,9 +509,9 @@ class Passenger(object):
     id: numeric id of passenger as string
     flight_num: flight number of the passenger as string
     arrival_time: arrival time of the passenger as string in HH:MM:SS
-    first_name: first name of the passenger as string
-    last_name: last name of the passenger as string
-    birthdate: birthdate of the passenger as string
+    first_name: first name of the passenger as string, loaded lazily
+    last_name: last name of the passenger as string, loaded lazily
+    birthdate: birthdate of the passenger as string, loaded lazily
     nationality = foreign/domestic designation
     enque_time = time of arrival to customs
     departure_time = time of departure
@@ -386,21 +521,31 @@ class Passenger(object):
 
   Member Functions:
     init_service_time: update function to indicate that service has begun.
+    load_identity: returns the identity fields, loading them if missing
     __iter__: overwritten iteration behavior for passenger class
   """
 
+  __slots__ = ('id', 'flight_num', 'arrival_time', 'nationality',
+               'enque_time', 'departure_time', 'service_time',
+               'connecting_flight', 'processed', '_identity',
+               '_identity_source')
+
   def __init__(self, pid, flight_num, arrival_time, first_name, last_name,
-               birthdate, nationality, service_time):
+               birthdate, nationality, service_time, identity_source=None):
     '''
     Passenger class must be initialized with nationality and global time.
+    Identity fields may be None, to be loaded from identity_source, an
+    open database connection, when first read.
     '''
     self.id = pid
     self.flight_num = flight_num
     self.arrival_time = arrival_time
-    self.first_name = first_name
-    self.last_name = last_name
-    self.birthdate = birthdate
-    self.nationality = nationality
+    if first_name is None and last_name is None and birthdate is None:
+      self._identity = None
+    else:
+      self._identity = (first_name, last_name, birthdate)
+    self._identity_source = identity_source
+    self.nationality = nationalities.get(nationality, nationality)
     self.enque_time = _get_sec(arrival_time, spd_factor)
     self.departure_time = -1
     self.service_time = int(service_time)
@@ -408,21 +553,50 @@ class Passenger(object):
     self.processed = False
 
 
-  def init_service_time(self):
+  def init_service_time(self, rng=None):
     """
     Generate a random service time from a passed distribution.
 
     Args:
-      None
+      rng: numpy Generator to draw from
 
     Returns:
       VOID
     """
 
     if self.nationality == "domestic":
-      return sample_from_triangular(service_dist_dom)
+      return sample_from_triangular(service_dist_dom, rng)
     elif self.nationality == "foreign":
-      return sample_from_triangular(service_dist_intl)
+      return sample_from_triangular(service_dist_intl, rng)
+
+
+  def load_identity(self):
+    """
+    Returns the passenger's identity fields, reading them from the
+    database on first use if they were not given.
+
+    Args:
+      None
+
+    Returns:
+      identity: tuple of first name, last name and birthdate
+    """
+    if self._identity is None:
+      row = None
+      if self._identity_source is not None:
+        row = self._identity_source.execute('SELECT first_name, '
+                                              'last_name, '
+                                              'birthdate '
+                                            'FROM passengers '
+                                            'WHERE id = ?;',
+                                            (self.id,)).fetchone()
+      self._identity = tuple(row) if row is not None else (None, None, None)
+    return self._identity
+
+
+  first_name = property(lambda self: self.load_identity()[0])
+  last_name = property(lambda self: self.load_identity()[1])
+  birthdate = property(lambda self: self.load_identity()[2])
 
 
   def __iter__(self):
@@ -447,6 +621,8 @@ class Customs(object):
     serviced_passengers: a class that holds all processed passengers
     subsections: a list of subsections containing parallel servers and
                  assignment agents/servers
+    in_memory_report: boolean for reporting from passenger statistics
+                      kept in memory instead of the passengers table
 
   Member Functions:
     init_subsections: initializes list of Subsections objects
@@ -454,20 +630,24 @@ class Customs(object):
     update_servers: updates individual servers online/offline statuses
   """
 
-  def __init__(self, database, server_architecture):
+  def __init__(self, database, server_architecture, in_memory_report=False):
     """
-    Customs Class initialization member function.
+    Customs Class initialization member function.  The architecture may
+    be a dataframe or a compiled ServerSchedule.  With in_memory_report,
+    the passengers table is neither read nor written.
     """
-        # connection
-    self.connection = sqlite3.connect(database)
+    self.connection = customs_sql.get_connection(database)
     self.cursor = self.connection.cursor()
-    self.outputs = Outputs()
-    self.subsections = self.init_subsections(server_architecture)
+    self.in_memory_report = in_memory_report
+    self.outputs = Outputs(in_memory_report)
+    self.schedule = compile_schedule(server_architecture)
+    self.subsections = self.init_subsections(self.schedule)
     self.prep_database(database)
 
 
   def prep_database(self, database):
     """"""
+    if self.in_memory_report: return
     self.cursor.execute('ALTER TABLE passengers ADD enque_time INTEGER;')
     self.cursor.execute('ALTER TABLE passengers ADD departure_time INTEGER;') 
     self.cursor.execute('ALTER TABLE passengers ADD connecting_flight bool;')
@@ -480,7 +660,7 @@ class Customs(object):
     Customs Class member function for initializing Subsection objects.
 
     Args:
-      customs_arch: a pandas dataframe representing the architecture of
+      customs_arch: a ServerSchedule representing the architecture of
                     the servers
 
     Returns:
@@ -488,33 +668,23 @@ class Customs(object):
     """
     section_list = []
 
-    # Identify number of unique subsections in the server arcitecture.
-    num_subsections = len(customs_arch['subsection'].unique())
-
-    # Retrieve number of total servers and start an ID counter.
-    num_servers = sum(customs_arch['max'])
+    # Start an ID counter.
     server_id = 1
 
     # Initialize each Subsection Class with a loop.
-    for i in range(num_subsections):
-
-      # Get the label of the subsection.
-      subsection_id = customs_arch['subsection'].unique()[i]
-
-      # Subset the master architecture into an architecture just for
-      # for the subsection.
-      subsection_arch = customs_arch[customs_arch['subsection'] == subsection_id]
+    for subsection_id in customs_arch.subsections:
 
       # Get server ID range.
-      server_range = (server_id, server_id + subsection_arch.iloc[0]['max'])
-      server_id = server_id + subsection_arch.iloc[0]['max']
+      server_range = (server_id,
+                      server_id + customs_arch.max_servers[subsection_id])
+      server_id = server_range[1]
 
       # Get the processed passenger queue from the Class Data Members list.
       serviced_passengers_list = self.outputs
 
       # Init a subsection and append to the list.
       section_list.append(Subsection(subsection_id,
-                                     subsection_arch,
+                                     customs_arch,
                                      server_range,
                                      serviced_passengers_list))
 
@@ -565,7 +735,8 @@ class Customs(object):
     Updates online/offline status of servers in parallel.
 
     Args:
-      server_schedule: a Pandas dataframe
+      server_schedule: a Pandas dataframe or a ServerSchedule; the
+                       schedule compiled at initialization is used
       current_time: simulation time in simulation time units
 
     Returns:
@@ -573,36 +744,19 @@ class Customs(object):
     """
 
     # If we are not on an hour, we skip.
-    if current_time % _get_sec("01:00:00", spd_factor) != 0: return
+    if current_time % hour_ticks != 0: return
 
     # If we at the end of the simulation, skip.
-    if current_time == _get_sec("24:00:00", spd_factor): return
-
-    # Use the global time to identify the apposite column of the schedule.
-    time_idx = None
-
-    # Loop through the server schedule columns to find the correct column.
-    for idx, i in enumerate(server_schedule.columns):
+    if current_time == day_ticks: return
 
-      # Ensures the column names of the server schedule are formatted as:
-      # "0", "1", ... "23"...
-      if re.search('[0-9]+', i):
-
-        # Finds the column in the server schedule that corresponds
-        # with the global time and stores that index.
-        if _get_sec(i.strip()+ ":00:00", spd_factor) <= current_time < \
-           _get_sec(str(int(i.strip())+1)+ ":00:00", spd_factor) :
-          time_idx = idx
-          break
+    # Use the global time to identify the hour of the schedule.
+    hour = current_time // hour_ticks
 
     # Loop through all subsections.parallel_server.server_list:
     for section in self.subsections:
 
-      # Retrieve the section schedule from the master schedule.
-      schedule = server_schedule[server_schedule['subsection'] == section.id]
-
       # Retrieve number of online servers for the given time.
-      num_servers = schedule.iloc[0][time_idx]
+      num_servers = self.schedule.online(section.id, hour)
 
       # Loop through every server in the server list.
       for counter, server in enumerate(section.parallel_server.server_list):
@@ -615,24 +769,19 @@ class Customs(object):
 
   def generate_report(self, output_file, database):
     """"""
-
-    # Init an empty dataframe to hold the server utilization Series.
-    server_df = pd.DataFrame()
-
-    # Loop through all the sections in the subsections.
-    for section in self.subsections:
-
-      # Loop through all the servers in the secions.
-      for server in section.parallel_server.server_list:
-
-        # Add the server type to the Pd series.
-        server.utilization_series.set_value('type', server.type)
-
-        # Concat the server's utilization series to the dataframe.
-        server_df = pd.concat([server_df, server.utilization_series], axis=1)
+    # Pandas is only loaded for reporting.
+    import pandas as pd
+
+    # One row of hourly utilization per server, with its type.
+    servers = [server
+               for section in self.subsections
+               for server in section.parallel_server.server_list]
+    server_df = pd.DataFrame([server.hourly_utilization + [server.type]
+                              for server in servers],
+                             index=[server.id for server in servers],
+                             columns=hourly_timestamps + ['type'])
 
     # Insert into database
-    server_df = server_df.transpose()
     server_df.to_sql('servers', self.connection, if_exists='replace')
 
     # Perform a summary queries.
@@ -667,20 +816,24 @@ class Customs(object):
                'count("22:00:00") as \'22\', count("23:00:00") as \'23\' '
             'FROM servers group by type;', self.connection)
     
-    passenger_data = self.cursor.execute(
-              'SELECT arrival_hour, '
-                'nationality, '
-                'count(*) as count, '
-                'avg(wait_time) as wait_time, '
-                'max(wait_time) as max_wait '
-              'FROM '
-                '(SELECT cast(enque_time/\'{hour}\' as int) as arrival_hour, '
-                   'departure_time - enque_time as wait_time, '
-                   'nationality '
-                 'FROM passengers '
-                 'WHERE enque_time is NOT NULL) '
-              'GROUP BY 1, 2;'.format(
-                    hour=_get_sec("01:00:00", spd_factor))).fetchall()
+    # Wait statistics by arrival hour and nationality.
+    if self.in_memory_report:
+      passenger_data = self.outputs.passenger_rows()
+    else:
+      passenger_data = self.cursor.execute(
+                'SELECT arrival_hour, '
+                  'nationality, '
+                  'count(*) as count, '
+                  'avg(wait_time) as wait_time, '
+                  'max(wait_time) as max_wait '
+                'FROM '
+                  '(SELECT cast(enque_time/? as int) as arrival_hour, '
+                     'departure_time - enque_time as wait_time, '
+                     'nationality '
+                   'FROM passengers '
+                   'WHERE enque_time is NOT NULL) '
+                'GROUP BY 1, 2;',
+                (_get_sec("01:00:00", spd_factor),)).fetchall()
 
     # Headers
     headers = ["hour", "type", "count", "ave_wait", "max_wait",
@@ -714,6 +867,9 @@ class Customs(object):
 
   def clean_up_db(self):
     self.connection.execute('DROP TABLE IF EXISTS servers;')
+    if self.in_memory_report:
+      self.connection.commit()
+      return
 
     self.connection.execute('ALTER TABLE passengers RENAME TO tmp_passengers;')
 
@@ -738,12 +894,10 @@ class Customs(object):
 
     self.connection.execute('DROP TABLE tmp_passengers;')
 
-    self.connection.commit()
-
+    # The rebuild drops the table's indexes, so put them back.
+    customs_schema.create_indexes(self.connection, 'passengers')
 
-  def __del__(self):
-    """"""
-    self.connection.close()
+    self.connection.commit()
 
 
 class Subsection(object):
@@ -764,7 +918,7 @@ class Subsection(object):
     Subsection Class initialization function.
 
     Args:
-      subsection_arch: a Pandas dataframe
+      subsection_arch: a ServerSchedule
       serviced_passengers: a python list
     """
     self.id = subsection_id
@@ -799,7 +953,7 @@ class ParallelServer(object):
     ParallelServer Class initialization member function.
 
     Args:
-      subsection_arch: a Pandas dataframe
+      subsection_arch: a ServerSchedule
       serviced_passengers: a python list
     """
     self.server_list = self.init_server_list(subsection_arch,
@@ -819,7 +973,7 @@ class ParallelServer(object):
     ServiceAgent objects.
 
     Args:
-      subsection_arch: a Pandas dataframe.
+      subsection_arch: a ServerSchedule.
       output_list: a python list.
 
     Returns:
@@ -980,10 +1134,16 @@ class ServiceAgent(object):
     current_passenger: pointer to current Passenger
     output_queue: pointer to ServicedPassengers object
     max_queue_size: size of max num Passengers of server queue
+    hourly_utilization: list of utilization per hour, NaN while offline
 
   Member Functions:
     serve: general service functions for completing Passenger transactions.
   """
+
+  __slots__ = ('online', 'id', 'type', 'queue', 'is_serving',
+               'current_passenger', 'output_queue', 'max_queue_size',
+               'utilization', 'utilization_anchor', 'hourly_utilization')
+
   def __init__(self, server_id, subsection_id, output_queue):
     """
     ServiceAgent Class initialization member function.
@@ -1002,9 +1162,7 @@ class ServiceAgent(object):
     self.max_queue_size = 1
     self.utilization = 0.0
     self.utilization_anchor = 0
-    self.utilization_series = pd.Series(np.nan,
-                                        index=hourly_timestamps,
-                                        name=self.id)
+    self.hourly_utilization = [float("nan")] * len(hourly_timestamps)
 
 
   def serve(self, current_time):
@@ -1104,11 +1262,10 @@ class ServiceAgent(object):
     # If we are on the hour and the server has been online,
     # we flush the results and reset the utilization.
     if current_time != 0 and \
-       (current_time + 1) % _get_sec("01:00:00", spd_factor) == 0 and \
+       (current_time + 1) % hour_ticks == 0 and \
        self.online:
-      self.utilization_series[_get_ttime(
-                  current_time + 1 - _get_sec("01:00:00", spd_factor), 
-                  spd_factor)] = self.utilization
+      self.hourly_utilization[(current_time + 1) // hour_ticks - 1] = \
+                                                          self.utilization
 
 
       #self.output_queue.server_statistics.append(
@@ -1127,14 +1284,20 @@ class Outputs(object):
 
   Member Data:
     passengers: python list
+    in_memory: boolean for keeping passenger statistics in memory
+               instead of writing passengers to the database
+    passenger_stats: dictionary of [count, total wait, max wait] by
+                     (arrival hour, nationality), kept when in_memory
   """
-  def __init__(self):
+  def __init__(self, in_memory=False):
     """
     Outputs initialization member function.
     """
     self.serviced_passengers = deque()
     self.passengers_served = 0
     self.server_statistics = deque()
+    self.in_memory = in_memory
+    self.passenger_stats = {}
 
 
   def update_passengers(self, database, current_time):
@@ -1151,37 +1314,81 @@ class Outputs(object):
 
     # Check queue length or sim time.
     if len(self.serviced_passengers) >= 1000 or \
-       _get_ttime(current_time, spd_factor) == "24:00:00":
-
-      # Open connection to db.
-      connection = sqlite3.connect(database)
-      cursor = connection.cursor()
-
-      # Iterate through the deque and write out.
-      for passenger in self.serviced_passengers:
-        #writer.writerow(list(passenger))
-
-        cursor.execute('UPDATE passengers ' 
-                         'SET enque_time = \'{enque_time}\','
-                             'departure_time = \'{departure_time}\','
-                             'service_time = \'{service_time}\','
-                             'connecting_flight = \'{connecting_flight}\','
-                             'processed = \'{processed}\''
-                          'WHERE '
-                             'id = \'{id}\';'
-          .format(enque_time=passenger.enque_time,
-                  departure_time=passenger.departure_time,
-                  service_time=passenger.service_time,
-                  connecting_flight=passenger.connecting_flight,
-                  processed=passenger.processed,
-                  id=passenger.id))
+       current_time == day_ticks:
+
+      # Fold the deque into the statistics instead, if in memory.
+      if self.in_memory:
+        self.record_passengers()
+        return
+
+      # Reuse the shared connection to the db.
+      connection = customs_sql.get_connection(database)
+
+      # Write out the deque in one batch.
+      connection.executemany('UPDATE passengers '
+                               'SET enque_time = ?, '
+                                   'departure_time = ?, '
+                                   'service_time = ?, '
+                                   'connecting_flight = ?, '
+                                   'processed = ? '
+                             'WHERE id = ?;',
+                             [(passenger.enque_time,
+                               passenger.departure_time,
+                               passenger.service_time,
+                               passenger.connecting_flight,
+                               passenger.processed,
+                               passenger.id)
+                              for passenger in self.serviced_passengers])
 
       # Clear the queue of Passenger objects.
       self.serviced_passengers.clear()
 
-      # Close connection
+      # Commit.
       connection.commit()
-      connection.close()
+
+
+  def record_passengers(self):
+    """
+    Folds the serviced passengers into the per hour and nationality
+    wait statistics, and clears them.
+
+    Args:
+      None
+
+    Returns:
+      VOID
+    """
+    stats = self.passenger_stats
+    for passenger in self.serviced_passengers:
+      key = (passenger.enque_time // hour_ticks, passenger.nationality)
+      wait = passenger.departure_time - passenger.enque_time
+      entry = stats.get(key)
+      if entry is None:
+        stats[key] = [1, wait, wait]
+      else:
+        entry[0] += 1
+        entry[1] += wait
+        if wait > entry[2]: entry[2] = wait
+
+    self.serviced_passengers.clear()
+
+
+  def passenger_rows(self):
+    """
+    Returns the wait statistics in the row format of the report query
+    on the passengers table.
+
+    Args:
+      None
+
+    Returns:
+      rows: list of (arrival hour, nationality, count, average wait,
+            max wait) tuples sorted by hour and nationality
+    """
+    self.record_passengers()
+    return [(hour, nationality, count, float(total) / count, max_wait)
+            for (hour, nationality), (count, total, max_wait)
+            in sorted(self.passenger_stats.items())]
 
 
   def update_servers(self, output_file, current_time):
@@ -1199,7 +1406,7 @@ class Outputs(object):
 
     # Check the servers length list.
     if len(self.server_statistics) >= 1000 or \
-       _get_ttime(current_time, spd_factor) == "24:00:00":
+       current_time == day_ticks:
 
       # Open a context manager for the file.
       with open(output_file, 'a') as the_file:
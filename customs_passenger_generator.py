@@ -13,7 +13,11 @@
 Adds a table of passengers to a customs database.  Can be invoked from
 the command line through the following:
 
-> python customs_passenger_generator.py
+> python customs_passenger_generator.py --seed 0 --workers 4
+
+Manifests are faked in parallel shards.  Each flight's passengers are
+drawn from a stream keyed by its flight number under the run's seed, so
+a seed reproduces the same passengers with any number of workers.
 
 Usage:
   Please see README for how to compile the program and run the
@@ -22,12 +26,18 @@ Usage:
 
 from __future__ import print_function
 
+from multiprocessing import Pool, cpu_count
+
 from faker import Faker
-import sqlite3
-import random
+import argparse
+import os
 import re
+import shutil
+import tempfile
 
-import numpy as np
+import customs_random
+import customs_schema
+import customs_sql
 
 
 ## ====================================================================
@@ -35,31 +45,40 @@ import numpy as np
 
 customs_db = "customs_db.sqlite"
 
-passengers_table_create_query = ('CREATE TABLE IF NOT EXISTS passengers ('
-                                   'id integer PRIMARY KEY, '
-                                   'flight_num text, '
-                                   'first_name text, '
-                                   'last_name text, '
-                                   'birthdate text, '
-                                   'nationality text, '
-                                   'enque_time text, '
-                                   'departure_time text, '
-                                   'service_time text, '
-                                   'connecting_flight bool, '
-                                   'processed bool);')
-
 insertion_query = ('INSERT INTO passengers ('
                      'flight_num, '
                      'first_name, '
                      'last_name, '
                      'birthdate, '
                      'nationality) '
-                   'VALUES ('
-                     '\'{flight_num}\', '
-                     '\'{first_name}\', '
-                     '\'{last_name}\', '
-                     '\'{birthdate}\', '
-                     '\'{nationality}\');')
+                   'VALUES (?, ?, ?, ?, ?);')
+
+# Arrivals with the seat count of their plane, the first planes record
+# of the flight, and the integer average of the positive seat counts of
+# its aircraft type, in arrivals order.
+seats_query = ('SELECT arrivals.flight_num, '
+                 'arrivals.code_share, '
+                 'CAST(planes.total_seats AS INTEGER), '
+                 'averages.seats '
+               'FROM arrivals '
+               'LEFT JOIN planes '
+                 'ON planes.id = (SELECT MIN(id) FROM planes AS first '
+                                 'WHERE first.flight_num = '
+                                   'arrivals.flight_num) '
+               'LEFT JOIN (SELECT aircraft, '
+                           'SUM(CAST(total_seats AS INTEGER)) / COUNT(*) '
+                             'AS seats '
+                         'FROM planes '
+                         'WHERE CAST(total_seats AS INTEGER) > 0 '
+                         'GROUP BY aircraft) AS averages '
+                 'ON averages.aircraft = planes.aircraft '
+               'ORDER BY arrivals.id;')
+
+# Entries per pre-sampled pool of first names, last names and years.
+name_pool_size = 4096
+
+# Flights per shard handed to a worker.
+shard_flights = 100
 
 
 ## ====================================================================
@@ -76,43 +95,24 @@ def create_passengers_table(database):
     VOID
   """
   # Open a connection to the database.
-  connection = sqlite3.connect(database)
-  cursor = connection.cursor()
+  connection = customs_sql.connect(database, 'bulk_load')
 
-  # Build the table according to the SQLite query.
-  cursor.execute(passengers_table_create_query)
+  # Build the table and its indexes from the customs schema.
+  customs_schema.create_table(connection, 'passengers')
 
   # Commit chnages and clean up resources.
   connection.commit()
   connection.close()  
 
 
-def guess_seat_count(plane_list):
+def generate_nationality_distribution(rng):
   ''''''
-  passenger_count = 0
-  plane_count = 0
-
-  for plane in plane_list:
-    if int(plane[0]) > 0:
-      passenger_count += int(plane[0])
-      plane_count += 1
+  return rng.triangular(0.3,0.4,0.5)
 
-  if plane_count == 0:
-    average = 0
-  else:
-    average = int(passenger_count / plane_count)
 
-  return average
-
-
-def generate_nationality_distribution():
-  ''''''
-  return np.random.triangular(0.3,0.4,0.5)
-
-
-def generate_nationality(probability):
+def generate_nationality(probability, rng):
   ''''''
-  if random.random() < probability:
+  if rng.random() < probability:
     return "domestic"
   else:
     return "foreign"
@@ -141,124 +141,264 @@ def insert_passengers(database, flight_num, total_seats):
   #connection.close()
 
 
-def fake_passengers(database):
-  ''''''
-  # Establish connection to the database.
-  connection = sqlite3.connect(customs_db)
-  cursor = connection.cursor()
+def sample_name_pools(fake, size=name_pool_size):
+  """
+  Pre-samples pools of first names, last names and birth years from a
+  Faker generator, for manifests to draw from by index.
 
-  # Build the passengers database if it does not exist.
-  create_passengers_table(database)
+  Args:
+    fake: a seeded Faker generator
+    size: entries per pool
 
-  # Initialize a faker generator.
-  fake = Faker()
+  Returns:
+    pools: tuple of first name, last name and birth year lists
+  """
+  return ([fake.first_name() for _ in range(size)],
+          [fake.last_name() for _ in range(size)],
+          [fake.year() for _ in range(size)])
+
+
+def generate_manifest(flight_num, total_seats, probability, pools, rng):
+  """
+  Fakes the passenger rows of one flight with vectorized draws.
+
+  Args:
+    flight_num: flight number the passengers are listed under
+    total_seats: number of passengers
+    probability: probability of a passenger being domestic
+    pools: name pools from sample_name_pools
+    rng: numpy Generator
 
-  # Retrieve arrivals.
-  cursor.execute('SELECT * '
-                   'FROM arrivals;')
-  arrivals = cursor.fetchall()
+  Returns:
+    rows: list of (flight_num, first_name, last_name, birthdate,
+          nationality) tuples
+  """
+  first_names, last_names, years = pools
+  domestic = (rng.random(total_seats) < probability).tolist()
+  first = rng.integers(0, len(first_names), total_seats).tolist()
+  last = rng.integers(0, len(last_names), total_seats).tolist()
+  year = rng.integers(0, len(years), total_seats).tolist()
 
-  inserted = 0
+  return [(flight_num, first_names[i], last_names[j], years[k],
+           "domestic" if is_domestic else "foreign")
+          for i, j, k, is_domestic in zip(first, last, year, domestic)]
 
-  # Loop through arrivals to get plane types.
-  for idx, arrival in enumerate(arrivals):
-    print ("Working on arrival ", idx, ".", sep="")
 
-    flight_num = arrival[5]
-    code_share = arrival[7]
-    total_seats = None
-    nationality_distribution = generate_nationality_distribution()
+def plan_manifests(cursor):
+  """
+  Decides which flights get a manifest, walking the arrivals in order.
+  An operating flight is listed under its own number; a code share is
+  listed under its operating flight's number, unless that flight
+  already has passengers.
+
+  Seat counts come from one join of the arrivals with their planes and
+  with per-aircraft averages computed in a single GROUP BY; a plane
+  with a missing count gets the average of the positive counts of its
+  aircraft type.  Code shares are deduplicated against a set of the
+  flights already listed, so planning issues a fixed number of queries.
+
+  Args:
+    cursor: cursor on the customs database
+
+  Returns:
+    plan: list of (listed flight number, seat count, occurrence) tuples
+          in arrivals order; occurrence counts earlier entries listed
+          under the same number
+  """
+  rows = cursor.execute(seats_query).fetchall()
+
+  # Flights that already have passengers, and entries per listed flight.
+  existing = set(row[0] for row in cursor.execute(
+                        'SELECT DISTINCT flight_num FROM passengers;'))
+  occurrences = {}
+  plan = []
+
+  for flight_num, code_share, total_seats, average_seats in rows:
 
     # Duplicate detection is done by checking for code shares.
     if code_share == "":
-
-      # Get the aircraft and seat count from the planes table.
-      rslt = cursor.execute('SELECT aircraft, total_seats '
-                              'FROM planes '
-                              'WHERE flight_num = \'{flight_num}\';'\
-                                 .format(flight_num=flight_num)).fetchone()
-      if rslt is not None:
-        aircraft = str(rslt[0])
-        total_seats = int(rslt[1])
-        # If we have missing seat count, we average the counts for the
-        # same plane types.
-        if total_seats <= 0:
-          rslt2 = cursor.execute('SELECT total_seats '
-                                'FROM planes '
-                                'WHERE aircraft = \'{aircraft}\';'\
-                                     .format(aircraft=aircraft)).fetchall()
-          total_seats = guess_seat_count(rslt2)
-
-        # Fake the data.
-        for passenger in range(total_seats):
-          passenger_info = {}
-          passenger_info['flight_num'] = flight_num
-          passenger_info['first_name'] = fake.first_name()
-          passenger_info['last_name'] = fake.last_name()
-          passenger_info['birthdate'] = fake.year()
-          passenger_info['nationality'] = generate_nationality(
-                                              nationality_distribution)
-
-          # Insert into database.
-          cursor.execute(insertion_query.format(
-                                        flight_num=passenger_info['flight_num'],
-                                        first_name=passenger_info['first_name'],
-                                        last_name=passenger_info['last_name'],
-                                        birthdate=passenger_info['birthdate'],
-                                        nationality=passenger_info['nationality']))
-
-        inserted += 1
-        print("Inserted ", total_seats, " passengers into the database for flight ",
-              flight_num, ". (", inserted, " planes in total.)", sep="")
-        connection.commit()
+      listed_as = flight_num
 
     else:
-      rslt3 = cursor.execute('SELECT * from passengers ' 
-                               'WHERE flight_num = \'{code_share}\';'\
-                                    .format(code_share=code_share)).fetchone()
-
-      if rslt3 is not None: continue
-
-      # Get the aircraft and seat count from the planes table.
-      rslt4 = cursor.execute('SELECT aircraft, total_seats '
-                                 'FROM planes '
-                                 'WHERE flight_num = \'{flight_num}\';'\
-                                   .format(flight_num=flight_num)).fetchone()
-      if rslt4 is not None:
-        aircraft = str(rslt4[0])
-        total_seats = int(rslt4[1])
-        
-        # If we have missing seat count, we average the counts for the
-        # same plane types.
-        if total_seats <= 0:
-          rslt5 = cursor.execute('SELECT total_seats '
-                                   'FROM planes '
-                                   'WHERE aircraft = \'{aircraft}\';'\
-                                     .format(aircraft=aircraft)).fetchall()
-          total_seats = guess_seat_count(rslt5)
-
-        # Fake the data.
-        for passenger in range(total_seats):
-          passenger_info = {}
-          passenger_info['flight_num'] = code_share
-          passenger_info['first_name'] = fake.first_name()
-          passenger_info['last_name'] = fake.last_name()
-          passenger_info['birthdate'] = fake.year()
-          passenger_info['nationality'] = generate_nationality(
-                                              nationality_distribution)
-
-          # Insert into database.
-          cursor.execute(insertion_query.format(
-                                        flight_num=passenger_info['flight_num'],
-                                        first_name=passenger_info['first_name'],
-                                        last_name=passenger_info['last_name'],
-                                        birthdate=passenger_info['birthdate'],
-                                        nationality=passenger_info['nationality']))
-
-        inserted += 1
-        print("Inserted ", total_seats, " passengers into the database for flight ",
-              flight_num, ". (", inserted, " planes in total.)", sep="")
-        connection.commit()
+      if code_share in occurrences or code_share in existing: continue
+      listed_as = code_share
+
+    # Skip flights without a plane record.
+    if total_seats is None: continue
+    if total_seats <= 0: total_seats = average_seats or 0
+
+    occurrence = occurrences.get(listed_as, 0)
+    occurrences[listed_as] = occurrence + 1
+    plan.append((listed_as, total_seats, occurrence))
+
+  return plan
+
+
+def flight_rng(sequence, flight_num, occurrence):
+  """
+  Returns the stream of one manifest, keyed by the crc32 of its flight
+  number and its occurrence under the run's seed sequence.
+
+  Args:
+    sequence: the run's SeedSequence
+    flight_num: listed flight number as a string
+    occurrence: index among manifests listed under the same number
+
+  Returns:
+    rng: a numpy Generator
+  """
+  return customs_random.keyed_rng(sequence,
+                                 customs_random.string_key(flight_num),
+                                 occurrence)
+
+
+# Per-process generation state, set by init_worker.
+worker_state = {}
+
+
+def init_worker(sequence, pools):
+  """
+  Pool initializer: stores the run's seed sequence and name pools.
+
+  Args:
+    sequence: the run's SeedSequence
+    pools: name pools from sample_name_pools
+
+  Returns:
+    VOID
+  """
+  worker_state.update(sequence=sequence, pools=pools)
+
+
+def fake_manifests(flights):
+  """
+  Fakes the manifests of plan entries from their flights' streams.
+
+  Args:
+    flights: list of plan entries from plan_manifests
+
+  Returns:
+    manifests: generator of row lists, one per plan entry
+  """
+  for flight_num, total_seats, occurrence in flights:
+    rng = flight_rng(worker_state['sequence'], flight_num, occurrence)
+    yield generate_manifest(flight_num, total_seats,
+                            generate_nationality_distribution(rng),
+                            worker_state['pools'], rng)
+
+
+def fake_shard(task):
+  """
+  Fakes the manifests of one shard of the plan into a shard database.
+
+  Args:
+    task: tuple of (shard database filename, list of plan entries)
+
+  Returns:
+    shard_file: the shard database filename
+    count: number of passenger rows written
+  """
+  shard_file, flights = task
+  connection = customs_sql.connect(shard_file, 'bulk_load')
+  connection.execute('CREATE TABLE passengers (flight_num TEXT, '
+                                              'first_name TEXT, '
+                                              'last_name TEXT, '
+                                              'birthdate TEXT, '
+                                              'nationality TEXT);')
+  count = 0
+  for rows in fake_manifests(flights):
+    connection.executemany(insertion_query, rows)
+    count += len(rows)
+
+  connection.commit()
+  connection.close()
+  return shard_file, count
+
+
+def fake_passengers(database, seed=None, workers=None):
+  """
+  Fakes a manifest for every arriving plane.  With several workers the
+  plan of manifests is split into shards of shard_flights flights,
+  faked by a pool of workers into shard databases, and merged into the
+  passengers table in plan order in a single transaction.  Every
+  manifest draws from a stream keyed by its flight, so the output does
+  not depend on the number of workers.
+
+  Args:
+    database: a string representing database filename.
+    seed: integer seed, SeedSequence or numpy Generator, or None for
+          fresh entropy
+    workers: number of worker processes, defaults to the CPU count; 1
+             fakes in this process
+
+  Returns:
+    VOID
+  """
+  # Draw names and nationalities from streams of one seed.
+  sequence = customs_random.seed_sequence(seed)
+
+  # Establish connection to the database.
+  connection = customs_sql.connect(database, 'bulk_load')
+  cursor = connection.cursor()
+
+  # Build the passengers database if it does not exist.
+  create_passengers_table(database)
+
+  # Initialize a faker generator and sample the name pools.
+  fake = Faker()
+  fake.seed_instance(int(customs_random.keyed_rng(sequence, 0)
+                                       .integers(2**32)))
+  pools = sample_name_pools(fake)
+
+  # Plan the manifests.
+  plan = plan_manifests(cursor)
+  passenger_count = 0
+  workers = workers or cpu_count()
+
+  # On one worker, fake straight into the table.
+  if workers <= 1 or len(plan) <= shard_flights:
+    init_worker(sequence, pools)
+    for rows in fake_manifests(plan):
+      cursor.executemany(insertion_query, rows)
+      passenger_count += len(rows)
+    connection.commit()
+
+  # Otherwise split the plan into shards for a pool of workers.
+  else:
+    shard_dir = tempfile.mkdtemp(prefix="passenger_shards_")
+    tasks = [(os.path.join(shard_dir, "shard%05d.sqlite" % i),
+              plan[start:start + shard_flights])
+             for i, start in enumerate(range(0, len(plan), shard_flights))]
+    pool = Pool(min(workers, len(tasks)), initializer=init_worker,
+                initargs=(sequence, pools))
+
+    # Merge the shards in plan order as they finish, committing once.
+    try:
+      for shard_file, count in pool.imap(fake_shard, tasks):
+        shard = customs_sql.connect(shard_file, 'read')
+        cursor.executemany(insertion_query,
+                           shard.execute('SELECT flight_num, '
+                                            'first_name, '
+                                            'last_name, '
+                                            'birthdate, '
+                                            'nationality '
+                                         'FROM passengers ORDER BY rowid;'))
+        shard.close()
+        passenger_count += count
+        print("Merged ", passenger_count, " passengers into the database.",
+              sep="")
+      connection.commit()
+
+    finally:
+      pool.close()
+      pool.join()
+      shutil.rmtree(shard_dir, ignore_errors=True)
+
+  print("Inserted ", passenger_count, " passengers into the database. (",
+        len(plan), " planes in total.)", sep="")
+
+  # Clean up resources.
+  connection.close()
 
 
 ## ====================================================================
@@ -274,8 +414,14 @@ def main():
   Returns:
     VOID
   """
+  parser = argparse.ArgumentParser(description="Fake passenger manifests "
+                                   "for every arrival.")
+  parser.add_argument("--seed", type=int, default=None)
+  parser.add_argument("--workers", type=int, default=None)
+  args = parser.parse_args()
+
   # Get the database name.
-  fake_passengers(customs_db)
+  fake_passengers(customs_db, args.seed, args.workers)
 
 
 if __name__ == "__main__":
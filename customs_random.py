@@ -0,0 +1,119 @@
+##
+##  JFK Customs Simulation
+##  customs_random.py
+##
+##  Created by Justin Fung on 10/22/17.
+##  Copyright 2017 Justin Fung. All rights reserved.
+##
+## ====================================================================
+# pylint: disable=bad-indentation,bad-continuation,multiple-statements
+# pylint: disable=invalid-name
+
+"""
+Random streams for the customs modules.  Every stochastic step draws
+from a generator object passed in by its caller instead of the global
+NumPy state, so a run is reproduced by its seed alone.
+
+A run's seed becomes a SeedSequence, from which independent child
+streams are spawned for each replication or worker.  Children of the
+same sequence never overlap, and spawned sequences can be pickled to
+worker processes, so two workers never share a stream even when they
+start at the same moment.
+
+Streams can also be keyed by integers under a run's sequence, e.g. by
+comparison block and replication, or by flight, so a stream is found
+again from its key alone, in any order and in any process.
+
+Requires NumPy 1.17 or later.
+
+Usage:
+  Please see README for how to compile the program and run the
+  model and data formatting requirements.
+"""
+
+from __future__ import print_function
+
+import zlib
+
+import numpy as np
+
+
+## ====================================================================
+
+
+def seed_sequence(seed=None):
+  """
+  Returns the seed sequence of a run.
+
+  Args:
+    seed: integer seed, an existing SeedSequence, a numpy Generator to
+          draw the entropy from, or None for fresh OS entropy
+
+  Returns:
+    sequence: a numpy SeedSequence
+  """
+  if isinstance(seed, np.random.SeedSequence): return seed
+  if isinstance(seed, np.random.Generator):
+    return np.random.SeedSequence(int(seed.integers(2**63)))
+  return np.random.SeedSequence(seed)
+
+
+def make_rng(seed=None):
+  """
+  Returns a generator for a run.  A generator passed in is returned
+  as is, so functions can accept either a seed or a caller's stream.
+
+  Args:
+    seed: integer seed, SeedSequence, numpy Generator, or None for
+          fresh OS entropy
+
+  Returns:
+    rng: a numpy Generator
+  """
+  return np.random.default_rng(seed)
+
+
+def spawn_seeds(seed, count):
+  """
+  Spawns independent child seed sequences, e.g. to hand to worker
+  processes.
+
+  Args:
+    seed: integer seed, SeedSequence, or None for fresh OS entropy
+    count: number of children
+
+  Returns:
+    sequences: list of numpy SeedSequences
+  """
+  return seed_sequence(seed).spawn(count)
+
+
+def keyed_rng(sequence, *keys):
+  """
+  Returns the generator of the stream keyed by non-negative integers
+  under a seed sequence.
+
+  Args:
+    sequence: a numpy SeedSequence
+    keys: non-negative integers identifying the stream
+
+  Returns:
+    rng: a numpy Generator
+  """
+  return np.random.default_rng(
+              np.random.SeedSequence(sequence.entropy,
+                                     spawn_key=sequence.spawn_key + keys))
+
+
+def string_key(text):
+  """
+  Maps a string, such as a flight number, to a stream key.
+
+  Args:
+    text: a string
+
+  Returns:
+    key: the crc32 of the string's UTF-8 bytes, a non-negative integer
+  """
+  return zlib.crc32(text.encode('utf-8')) & 0xffffffff
+
@@ -0,0 +1,300 @@
+##
+##  JFK Customs Simulation
+##  customs_replication.py
+##
+##  Created by Justin Fung on 10/22/17.
+##  Copyright 2017 Justin Fung. All rights reserved.
+##
+## ====================================================================
+# pylint: disable=bad-indentation,bad-continuation,multiple-statements
+# pylint: disable=invalid-name
+
+"""
+Common random numbers for comparing candidate schedules.  Replication r
+of every candidate evaluated in the same comparison block (an hour of
+the optimizer) serves every passenger with the same service time, so
+two candidates differ only by their schedules and the difference of
+their waits has far less variance than that of independent runs.
+
+The draws of block b, replication r come from a stream keyed by
+(b, r) under the run's seed, so they can be regenerated in any order
+and in any process.  Only the current block's draws are kept.
+
+Paired-difference statistics over replications give the mean change in
+an hour's average wait between two candidates with a 95% confidence
+interval.
+
+Usage:
+  Please see README for how to compile the program and run the
+  model and data formatting requirements.
+"""
+
+from __future__ import print_function
+
+import math
+
+import numpy as np
+
+import customs_random
+from customs_dataset import DatasetPlaneDispatcher
+from customs_dataset import nationality_codes
+from customs_obj import TriangularSampler
+from customs_obj import service_dist_dom
+from customs_obj import service_dist_intl
+from customs_synthetic import CsvPlaneDispatcher
+from customs_synthetic import SyntheticPlaneDispatcher
+
+
+## ====================================================================
+
+
+# Two-sided 95% critical values of Student's t by degrees of freedom.
+t_critical_95 = (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306,
+                 2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120,
+                 2.110, 2.101, 2.093, 2.086, 2.080, 2.074, 2.069, 2.064,
+                 2.060, 2.056, 2.052, 2.048, 2.045, 2.042)
+
+# Report columns averaged over replications.
+report_columns = ["hour", "type", "count", "ave_wait", "max_wait",
+                  "ave_server_utilization", "num_servers"]
+
+# Columns added by mean_report: the 95% interval of each row's average
+# wait over the replications, and the number of replications.
+interval_columns = ["ci_low", "ci_high", "replications"]
+
+
+## ====================================================================
+
+
+def t_critical(df):
+  """
+  Returns the two-sided 95% critical value of Student's t.
+
+  Args:
+    df: degrees of freedom, at least 1
+
+  Returns:
+    t: a float; the normal value past 30 degrees of freedom
+  """
+  if df > len(t_critical_95): return 1.96
+  return t_critical_95[df - 1]
+
+
+def confidence_interval(values):
+  """
+  Returns the mean of a sample with its 95% confidence interval.
+
+  Args:
+    values: list of floats
+
+  Returns:
+    mean: sample mean
+    ci_low: lower bound, equal to the mean for fewer than two values
+    ci_high: upper bound, equal to the mean for fewer than two values
+  """
+  n = len(values)
+  mean = float(sum(values)) / n
+  if n < 2: return mean, mean, mean
+
+  variance = sum((value - mean) ** 2 for value in values) / (n - 1)
+  half_width = t_critical(n - 1) * math.sqrt(variance / n)
+  return mean, mean - half_width, mean + half_width
+
+
+def paired_difference(before, after):
+  """
+  Paired-difference statistics of two candidates evaluated on the same
+  replications.
+
+  Args:
+    before: list of per-replication values of the first candidate
+    after: list of per-replication values of the second candidate
+
+  Returns:
+    stats: dictionary of n, mean, ci_low and ci_high of after - before
+  """
+  differences = [b - a for a, b in zip(before, after)]
+  mean, ci_low, ci_high = confidence_interval(differences)
+  return {'n': len(differences), 'mean': mean,
+          'ci_low': ci_low, 'ci_high': ci_high}
+
+
+def hour_waits(reports, hour):
+  """
+  Collects the average wait of one hour from each replication's report.
+
+  Args:
+    reports: list of report dataframes, one per replication
+    hour: integer hour
+
+  Returns:
+    waits: list of floats, one per replication with activity in the hour
+  """
+  return [float(report[report['hour'] == hour].iloc[0]['ave_wait'])
+          for report in reports if hour in report['hour'].tolist()]
+
+
+def mean_report(reports):
+  """
+  Averages the numeric columns of replication reports by (hour, type),
+  and adds the confidence interval of the average wait.
+
+  Args:
+    reports: list of report dataframes, one per replication
+
+  Returns:
+    report: a single report dataframe with interval_columns
+  """
+  import pandas as pd
+  stacked = pd.concat(reports, ignore_index=True)
+  for column in report_columns[2:]:
+    stacked[column] = stacked[column].astype(float)
+
+  groups = stacked.groupby(["hour", "type"], sort=True)
+  report = groups[report_columns[2:]].mean().reset_index()[report_columns]
+
+  intervals = [confidence_interval(group['ave_wait'].tolist())
+               for _, group in groups]
+  report['ci_low'] = [interval[1] for interval in intervals]
+  report['ci_high'] = [interval[2] for interval in intervals]
+  report['replications'] = groups.size().values
+  return report
+
+
+## ====================================================================
+
+
+def _block_key(block):
+  """
+  Maps a comparison block label to an integer stream key.
+
+  Args:
+    block: integer hour, or a label such as "final"
+
+  Returns:
+    key: a non-negative integer
+  """
+  if isinstance(block, (int, np.integer)): return int(block)
+  return customs_random.string_key(str(block))
+
+
+class CommonRandomNumbers(object):
+  """
+  Class holding the per-replication service draws of the current
+  comparison block and installing them on a plane dispatcher.
+
+  Member Data:
+    sequence: the run's SeedSequence
+    replications: number of replications per candidate
+    passenger_ids: passenger ids in dispatcher order
+    domestic: boolean array of domestic passengers in dispatcher order
+
+  Member Functions:
+    draws: returns the service times of a block and replication
+    apply: installs a replication's service times on the dispatcher
+    restore: reinstates the dispatcher's own service times
+  """
+
+  def __init__(self, plane_dispatcher, seed=None, replications=1):
+    """
+    CommonRandomNumbers must be instantiated with the plane dispatcher
+    whose passengers it draws for.
+    """
+    self.sequence = customs_random.seed_sequence(seed)
+    self.replications = replications
+    self.passenger_ids, self.domestic = self._population(plane_dispatcher)
+    self._original = plane_dispatcher.service_times
+    self._block = None
+    self._draws = {}
+
+    # Triangular parameters in simulation time units.
+    params = [TriangularSampler(service_dist).params
+              for service_dist in (service_dist_dom, service_dist_intl)]
+    self._params = [np.where(self.domestic, dom, intl)
+                    for dom, intl in zip(*params)]
+
+
+  def _population(self, plane_dispatcher):
+    """
+    Lists the passengers a dispatcher can dispatch.
+
+    Args:
+      plane_dispatcher: a PlaneDispatcher, DatasetPlaneDispatcher,
+                        SyntheticPlaneDispatcher or CsvPlaneDispatcher
+
+    Returns:
+      passenger_ids: integer array
+      domestic: boolean array
+    """
+    if isinstance(plane_dispatcher, DatasetPlaneDispatcher):
+      dataset = plane_dispatcher.dataset
+      domestic = nationality_codes['domestic']
+      return (np.asarray(dataset.passenger_ids),
+              np.asarray(dataset.nationality) == domestic)
+
+    if isinstance(plane_dispatcher, (SyntheticPlaneDispatcher,
+                                     CsvPlaneDispatcher)):
+      return plane_dispatcher.population()
+
+    rows = plane_dispatcher.connection.execute(
+                            'SELECT id, nationality FROM passengers '
+                            'ORDER BY id;').fetchall()
+    return (np.array([row[0] for row in rows], dtype=np.int64),
+            np.array([row[1] == 'domestic' for row in rows], dtype=bool))
+
+
+  def draws(self, block, replication):
+    """
+    Returns the service times of one replication of a block.
+
+    Args:
+      block: comparison block, an integer hour or a label
+      replication: replication index
+
+    Returns:
+      service_times: integer array in dispatcher order
+    """
+    if block != self._block:
+      self._block = block
+      self._draws = {}
+
+    if replication not in self._draws:
+      rng = customs_random.keyed_rng(self.sequence, _block_key(block),
+                                     replication)
+      lower, mode, upper = self._params
+      self._draws[replication] = rng.triangular(lower, mode, upper)\
+                                    .astype(np.int32)
+
+    return self._draws[replication]
+
+
+  def apply(self, plane_dispatcher, block, replication):
+    """
+    Installs one replication's service times on a plane dispatcher.
+
+    Args:
+      plane_dispatcher: the dispatcher the draws were made for
+      block: comparison block, an integer hour or a label
+      replication: replication index
+
+    Returns:
+      VOID
+    """
+    service_times = self.draws(block, replication)
+    if not isinstance(plane_dispatcher, DatasetPlaneDispatcher):
+      service_times = dict(zip(self.passenger_ids.tolist(),
+                               service_times.tolist()))
+    plane_dispatcher.service_times = service_times
+
+
+  def restore(self, plane_dispatcher):
+    """
+    Reinstates the service times the dispatcher was created with.
+
+    Args:
+      plane_dispatcher: the dispatcher the draws were made for
+
+    Returns:
+      VOID
+    """
+    plane_dispatcher.service_times = self._original
@@ -0,0 +1,340 @@
+##
+##  JFK Customs Simulation
+##  customs_schema.py
+##
+##  Created by Justin Fung on 10/22/17.
+##  Copyright 2017 Justin Fung. All rights reserved.
+##
+## ====================================================================
+# pylint: disable=bad-indentation,bad-continuation,multiple-statements
+# pylint: disable=invalid-name
+
+"""
+Versioned schema for the customs database.  Creates the arrivals,
+airports, planes and passengers tables with the indexes that back the
+hot lookups, and the scrape_progress checkpoint table of the arrivals
+scraper, and upgrades existing databases in place.  Can be invoked
+from the command line to upgrade a database through the following:
+
+> python customs_schema.py customs_db.sqlite
+
+The schema version is kept in SQLite's user_version pragma.  Databases
+built by the original scripts are at version 0.
+
+Migrations:
+
+  Version | Changes
+  ---------------------------------------------------------------------
+     1    | Tables created if missing; indexes on passengers.flight_num,
+          | airports.code, arrivals.airport_code, planes.flight_num and
+          | planes.aircraft.
+     2    | Unique index on the arrivals natural key (flight_num,
+          | arrival_time, terminal) for upserts, unless the table holds
+          | duplicates of it; scrape_progress table created.
+
+Migrations never delete rows.  Duplicate arrivals, e.g. from scrapes
+before the natural key existed, are removed by the arrivals scraper
+before it creates the key, or through --dedupe:
+
+> python customs_schema.py customs_db.sqlite --dedupe
+
+Upserts on a natural key need SQLite 3.24 or later.
+
+Usage:
+  Please see README for how to compile the program and run the
+  model and data formatting requirements.
+"""
+
+from __future__ import print_function
+
+import argparse
+
+import customs_sql
+
+
+## ====================================================================
+
+
+# Table definitions.
+tables = {
+  'arrivals': ('CREATE TABLE IF NOT EXISTS arrivals ('
+                 'id integer primary key, '
+                 'origin text, '
+                 'airport_code text, '
+                 'arrival_time text, '
+                 'airline text, '
+                 'flight_num text,'
+                 'terminal int, '
+                 'code_share text);'),
+  'airports': ('CREATE TABLE IF NOT EXISTS airports ('
+                 'code text, '
+                 'name text, '
+                 'city text, '
+                 'country text, '
+                 'preclearance text);'),
+  'planes': ('CREATE TABLE IF NOT EXISTS planes ('
+               'id integer primary key, '
+               'flight_num text, '
+               'carrier text, '
+               'aircraft text, '
+               'total_seats text);'),
+  'passengers': ('CREATE TABLE IF NOT EXISTS passengers ('
+                   'id integer PRIMARY KEY, '
+                   'flight_num text, '
+                   'first_name text, '
+                   'last_name text, '
+                   'birthdate text, '
+                   'nationality text);'),
+  'scrape_progress': ('CREATE TABLE IF NOT EXISTS scrape_progress ('
+                        'url text PRIMARY KEY, '
+                        'records int, '
+                        'completed int, '
+                        'updated real);')
+}
+
+# Natural keys by table, backed by unique indexes, for upserts.
+natural_keys = {
+  'arrivals': ('flight_num', 'arrival_time', 'terminal')
+}
+
+# Index definitions by table.
+indexes = {
+  'arrivals': ('CREATE INDEX IF NOT EXISTS arrivals_airport_code_idx '
+                 'ON arrivals (airport_code);',),
+  'airports': ('CREATE INDEX IF NOT EXISTS airports_code_idx '
+                 'ON airports (code);',),
+  'planes': ('CREATE INDEX IF NOT EXISTS planes_flight_num_idx '
+               'ON planes (flight_num);',
+             'CREATE INDEX IF NOT EXISTS planes_aircraft_idx '
+               'ON planes (aircraft);'),
+  'passengers': ('CREATE INDEX IF NOT EXISTS passengers_flight_num_idx '
+                   'ON passengers (flight_num);',),
+  'scrape_progress': ()
+}
+
+
+## ====================================================================
+
+
+def create_table(connection, table):
+  """
+  Creates a table, if missing, along with its indexes and natural key.
+
+  Args:
+    connection: an open sqlite3 connection
+    table: a key of tables
+
+  Returns:
+    VOID
+  """
+  connection.execute(tables[table])
+  create_indexes(connection, table)
+  create_natural_key(connection, table)
+
+
+def create_indexes(connection, table):
+  """
+  Creates the indexes of a table.  Tables rebuilt through a rename and
+  copy lose their indexes, so this is run again after every rebuild.
+
+  Args:
+    connection: an open sqlite3 connection
+    table: a key of indexes
+
+  Returns:
+    VOID
+  """
+  for query in indexes[table]:
+    connection.execute(query)
+
+
+def create_natural_key(connection, table):
+  """
+  Creates the unique index on a table's natural key, if it has one.
+  Fails if the table holds duplicates of the key.
+
+  Args:
+    connection: an open sqlite3 connection
+    table: a key of tables
+
+  Returns:
+    VOID
+  """
+  if table not in natural_keys: return
+  connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS {table}_key_idx '
+                     'ON {table} ({columns});'.format(
+                         table=table, columns=', '.join(natural_keys[table])))
+
+
+def _key_not_null(table):
+  """
+  Returns the SQL condition that a row's natural key has no NULLs.  A
+  unique index admits repeated NULLs, so such rows never conflict.
+
+  Args:
+    table: a key of natural_keys
+
+  Returns:
+    condition: an SQL expression as string
+  """
+  return ' AND '.join(column + ' IS NOT NULL'
+                      for column in natural_keys[table])
+
+
+def has_duplicates(connection, table):
+  """
+  Checks whether a table holds rows repeating a natural key.
+
+  Args:
+    connection: an open sqlite3 connection
+    table: a key of natural_keys
+
+  Returns:
+    boolean
+  """
+  return connection.execute('SELECT 1 FROM {table} WHERE {not_null} '
+                            'GROUP BY {columns} HAVING COUNT(*) > 1 '
+                            'LIMIT 1;'.format(
+                                table=table, not_null=_key_not_null(table),
+                                columns=', '.join(natural_keys[table]))) \
+                   .fetchone() is not None
+
+
+def remove_duplicates(connection, table):
+  """
+  Deletes the rows repeating an earlier row's natural key, keeping the
+  row with the lowest id, so that the key can be made unique.  Rows with
+  NULLs in the key are kept.
+
+  Args:
+    connection: an open sqlite3 connection
+    table: a key of natural_keys
+
+  Returns:
+    removed: number of rows deleted
+  """
+  cursor = connection.execute('DELETE FROM {table} WHERE id NOT IN ('
+                                'SELECT MIN(id) FROM {table} '
+                                'GROUP BY {columns}) '
+                              'AND {not_null};'.format(
+                                  table=table,
+                                  columns=', '.join(natural_keys[table]),
+                                  not_null=_key_not_null(table)))
+  return cursor.rowcount
+
+
+def _migration_1(connection):
+  """
+  Creates any missing tables and the lookup indexes.
+
+  Args:
+    connection: an open sqlite3 connection
+
+  Returns:
+    VOID
+  """
+  for table in ('arrivals', 'airports', 'planes', 'passengers'):
+    connection.execute(tables[table])
+    create_indexes(connection, table)
+
+
+def _migration_2(connection):
+  """
+  Creates the unique index on the arrivals natural key for upserts and
+  the scrape_progress table.  Migrations never delete data: a table
+  holding duplicates of the key is left without it until they are
+  removed, which the arrivals scraper does before every scrape.
+
+  Args:
+    connection: an open sqlite3 connection
+
+  Returns:
+    VOID
+  """
+  if not has_duplicates(connection, 'arrivals'):
+    create_natural_key(connection, 'arrivals')
+  create_table(connection, 'scrape_progress')
+
+
+# Migrations in version order.
+migrations = [(1, _migration_1), (2, _migration_2)]
+
+# Version of a fully migrated database.
+schema_version = migrations[-1][0]
+
+
+def get_version(connection):
+  """
+  Reads the schema version of a database.
+
+  Args:
+    connection: an open sqlite3 connection
+
+  Returns:
+    version: an integer
+  """
+  return connection.execute('PRAGMA user_version;').fetchone()[0]
+
+
+def migrate(connection):
+  """
+  Applies every pending migration to a database, each in its own
+  transaction.
+
+  Args:
+    connection: an open sqlite3 connection
+
+  Returns:
+    version: the schema version after migrating
+  """
+  version = get_version(connection)
+
+  for target, migration in migrations:
+    if target <= version: continue
+    migration(connection)
+    connection.execute('PRAGMA user_version = {version};'.format(
+                                                        version=target))
+    connection.commit()
+    version = target
+
+  return version
+
+
+## ====================================================================
+
+
+def main():
+  """
+  Main.  Invoked from command line with a database filename.
+
+  Args:
+    None
+
+  Returns:
+    VOID
+  """
+  parser = argparse.ArgumentParser(description="Upgrades a customs "
+                                   "database to the current schema.")
+  parser.add_argument("database")
+  parser.add_argument("--dedupe", action="store_true",
+                      help="remove duplicate arrivals, keeping the first "
+                           "of each natural key, and create the key")
+  args = parser.parse_args()
+
+  connection = customs_sql.connect(args.database, 'bulk_load')
+  before = get_version(connection)
+  after = migrate(connection)
+  print("Migrated ", args.database, " from schema version ", before, " to ",
+        after, ".", sep="")
+
+  if args.dedupe:
+    removed = remove_duplicates(connection, 'arrivals')
+    create_natural_key(connection, 'arrivals')
+    connection.commit()
+    print("Removed ", removed, " duplicate arrivals.", sep="")
+
+  connection.close()
+
+
+if __name__ == "__main__":
+  main()
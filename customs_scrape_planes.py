@@ -13,7 +13,20 @@ Adds a table of airplanes with carrier, aircraft, and number of seats
 to an SQLite database. Can be invoked from the command line through the
 following:
 
-> python customs_scrape_planes.py
+> python customs_scrape_planes.py customs_db.sqlite 0 --workers 4
+
+Arrival rows are put on a shared work queue and pulled by a pool of
+headless webdrivers, each searching SeatGuru for its rows in its own
+browser.  Extracted planes are funneled to a single writer, which
+inserts them in arrival order and commits every commit_every records,
+so a run can be restarted from the last committed record.
+
+The site URL is configurable, so the scraper can be run end to end
+against the mock seat-map site of customs_seatmap_mock.py:
+
+> python customs_seatmap_mock.py customs_db.sqlite --port 8001
+> python customs_scrape_planes.py customs_db.sqlite 0 --workers 4 \
+      --url http://localhost:8001/findseatmap/findseatmap.php
 
 Usage:
   Please see README for how to compile the program and run the
@@ -29,6 +42,9 @@ Performance:
   -----------------------------------------------------------------
         5 Mbps      |      ~ 4 hrs.      |      ~ 5.7 sec.
 
+  With N workers the time per record is divided by about N, as each
+  record's time is spent waiting on its own browser.
+
 
 TODO:
   - complete the fill_search_form_and_submit error handling
@@ -37,17 +53,28 @@ TODO:
 from __future__ import print_function
 
 from datetime import datetime
+import argparse
+import os
 import re
-import sqlite3
-import sys
+import threading
+
+try:
+  from queue import Empty, Queue
+except ImportError:
+  from Queue import Empty, Queue
 
+import selenium
 from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
 import html5lib
 
+import customs_schema
+import customs_sql
+
 
 ## ====================================================================
 
@@ -62,13 +89,15 @@ webdriver_exe = '/usr/local/bin/chromedriver'
 # URL we want to scrape.
 url = "https://www.seatguru.com/findseatmap/findseatmap.php"
 
-# SQLite query for creating a 'planes' table in an SQLite database.
-create_planes_table_query = ('CREATE TABLE planes ('
-                               'id integer primary key, '
-                               'flight_num text, '
-                               'carrier text, '
-                               'aircraft text, '
-                               'total_seats text);')
+# Selenium 4 starts drivers through a Service object, and locates one
+# itself when no executable is given.
+selenium_4 = int(selenium.__version__.split(".")[0]) >= 4
+
+# Number of headless webdrivers scraping at once.
+default_workers = 4
+
+# Arrival records written per commit.
+commit_every = 10
 
 # SQLite template query for inserting planes into the database.
 insertion_query = ('INSERT INTO planes ('
@@ -76,31 +105,41 @@ insertion_query = ('INSERT INTO planes ('
                      'carrier, '
                      'aircraft, '
                      'total_seats) '
-                   'VALUES ('
-                     '\'{flight_num}\', '
-                     '\'{carrier}\', '
-                     '\'{aircraft}\', '
-                     '\'{total_seats}\');')
+                   'VALUES (?, ?, ?, ?);')
 
 
 ## ====================================================================
 
 
-def load_driver(webdriver_exe, url):
+def load_driver(webdriver_exe, url, headless=False):
   """
   Starts up a webdriver and loads a passed URL.
 
   Args:
-    webdriver_exe: filepath to webdriver binary/executable
+    webdriver_exe: filepath to webdriver binary/executable; if missing,
+                   Selenium 4 locates a driver itself and Selenium 3
+                   looks for chromedriver on the PATH
     url: URL address as string
+    headless: boolean for running the browser without a window
 
   Returns:
     driver: a initialized selenium webdriver object
   """
-  # Use PhantomJS headless browser.
-  print("Loading PhantomJS webdriver...")
+  # Use a Chrome browser, headless for the worker pool.
+  print("Loading Chrome webdriver...")
   #driver = webdriver.PhantomJS(webdriver_exe)
-  driver = webdriver.Chrome(webdriver_exe)
+  options = webdriver.ChromeOptions()
+  if headless:
+    options.add_argument("--headless")
+    options.add_argument("--no-sandbox")
+  if selenium_4:
+    from selenium.webdriver.chrome.service import Service
+    service = Service(webdriver_exe) if os.path.exists(webdriver_exe) \
+                                     else Service()
+    driver = webdriver.Chrome(service=service, options=options)
+  else:
+    driver = webdriver.Chrome(webdriver_exe if os.path.exists(webdriver_exe)
+                              else "chromedriver", options=options)
 
   # Default implicit WAIT command for all AJAX and JS loading.
   driver.implicitly_wait(2) # seconds
@@ -109,7 +148,7 @@ def load_driver(webdriver_exe, url):
   driver.get(url)
 
   # Status update.
-  print("PhantomJS driver \'", webdriver_exe, " \' initialized.\n",
+  print("Chrome driver \'", webdriver_exe, " \' initialized.\n",
         "Driver has loaded \'", url, "\'.", sep="")
 
   # Return driver control to main.
@@ -127,14 +166,14 @@ def create_planes_table(database):
     VOID
   """
   # Open a connection to the database.
-  connection = sqlite3.connect(database)
+  connection = customs_sql.connect(database, 'bulk_load')
   cursor = connection.cursor()
 
   # TROUBLESHOOTING
   cursor.execute('DROP TABLE IF EXISTS planes;')
 
-  # Build the table according to the SQLite query.
-  cursor.execute(create_planes_table_query)
+  # Build the table and its indexes from the customs schema.
+  customs_schema.create_table(connection, 'planes')
 
   # Commit chnages and clean up resources.
   connection.commit()
@@ -158,11 +197,11 @@ def fill_search_form_and_submit(driver, flight_attrs):
   success = True
 
   # Fill out the carrier name on the front page first.
-  airline_field = driver.find_element_by_id('airline-select')
+  airline_field = driver.find_element(By.ID, 'airline-select')
   airline_field.clear()
   carrier_name = flight_attrs['carrier'].split(" ")
   airline_field.send_keys(" ".join(carrier_name))
-  airline_autocomplete = driver.find_element_by_css_selector(
+  airline_autocomplete = driver.find_element(By.CSS_SELECTOR,
            ".ui-autocomplete.ui-menu.ui-widget.ui-widget-content.ui-corner-all")
   try:
     WebDriverWait(driver,1).until(EC.visibility_of(airline_autocomplete))
@@ -183,30 +222,30 @@ def fill_search_form_and_submit(driver, flight_attrs):
   # If we triggered the airline autocomplete, choose the top result.
   # If we could not trigger the autocomplete, we must return False.
   if airline_autocomplete.is_displayed():
-    driver.find_element_by_class_name('ui-autocomplete')\
-                   .find_element_by_class_name('ui-corner-all').click()
+    driver.find_element(By.CLASS_NAME, 'ui-autocomplete')\
+                   .find_element(By.CLASS_NAME, 'ui-corner-all').click()
   else:
     print("(X) Airline is not in SeatGuru database.  Check airline name.")
     success = False
     return success
 
   # Fill out the flight number on the front page next.
-  flight_num = driver.find_element_by_id('flightno')
+  flight_num = driver.find_element(By.ID, 'flightno')
   flight_num.clear()
   flight_num.send_keys(flight_attrs['flight_num'].split(" ")[-1])
 
   # Fill out the departure date on the front page next.
-  arrival_date = driver.find_element_by_id('datepicker')
+  arrival_date = driver.find_element(By.ID, 'datepicker')
   arrival_date.clear()
   arrival_date.send_keys(datetime.today().strftime("%m/%d/%Y"))
-  driver.find_element_by_class_name('ui-datepicker-today').click()
+  driver.find_element(By.CLASS_NAME, 'ui-datepicker-today').click()
 
   # Submit the form and navigate to the search results.
-  driver.find_element_by_id('search').click()
+  driver.find_element(By.ID, 'search').click()
 
   # Control should now be looking at a results page.
   # If results are not present, go back and try next record.
-  if len(driver.find_elements_by_class_name('chooseFlights-row')) == 0:
+  if len(driver.find_elements(By.CLASS_NAME, 'chooseFlights-row')) == 0:
       success = False
       print("(X) No search results found.")
       return success
@@ -257,19 +296,18 @@ def _get_indices(cursor):
   return indices
 
 
-def extract_plane_insert_and_return(driver, cursor_planes, flight_attrs):
+def extract_plane(driver, flight_attrs, seat_counts):
   """
-  Extracts plane data from the plane's page.  Inserts plane data into
-  the customes database.
+  Extracts plane data from the plane's page into flight_attrs, for the
+  writer to insert into the customs database.
 
   Args:
     driver: an initialized selenium webdriver
-    cursor_planes: a secondary initialized sqlite cursor to operate on
-                   the plane table
     flight_attrs: a dictionary to store intermediate plane database
+    seat_counts: a SeatCounts of the seat maps already read
 
   Returns:
-    a boolean indicating successful insertion of plane data
+    a boolean indicating successful extraction of plane data
   """
   # Check for three cases: 1. airplane hyperlink, 2. airplane plain text,
   # and 3. no airplane
@@ -281,7 +319,7 @@ def extract_plane_insert_and_return(driver, cursor_planes, flight_attrs):
     flight_attrs['aircraft'] = airplane.text
   except:
     # Grab the top result as plaintext.
-    airplane_rows = driver.find_elements_by_class_name('chooseFlights-row')
+    airplane_rows = driver.find_elements(By.CLASS_NAME, 'chooseFlights-row')
     if len(airplane_rows) == 0:
       print("(X) No airplane types found.")
       return False
@@ -294,25 +332,19 @@ def extract_plane_insert_and_return(driver, cursor_planes, flight_attrs):
       print("(X) No airplane types found.")
       return False  
     
-    # If airplane found in plaintext.
+    # If airplane found in plaintext, it has no seat map to read.  The
+    # writer keeps the seats of a plane written before.
     airplane = match.group(1)
     flight_attrs['aircraft'] = airplane.strip()
+    flight_attrs['total_seats'] = -1
+    return True
 
-  # Check to see if this entry is already in the database.
+  # Check to see if this plane's seat map was already read.
   # If yes, return True.
-  cursor_planes.execute('SELECT total_seats FROM planes '
-                          'WHERE carrier = \'{carrier}\' '
-                          'AND aircraft = \'{aircraft}\';'\
-                                 .format(carrier=flight_attrs['carrier'],
-                                         aircraft=flight_attrs['aircraft']))
-  plane = cursor_planes.fetchall()
-
-  if len(plane) != 0:
-    cursor_planes.execute(insertion_query.format(
-                              flight_num=flight_attrs['flight_num'],
-                              carrier=flight_attrs['carrier'],
-                              aircraft=flight_attrs['aircraft'],
-                              total_seats=plane[0][0]))
+  total_seats = seat_counts.get(flight_attrs['carrier'],
+                                flight_attrs['aircraft'])
+  if total_seats is not None:
+    flight_attrs['total_seats'] = total_seats
     print("(+) Plane already exists in the database.", sep="")
     return True
 
@@ -321,7 +353,7 @@ def extract_plane_insert_and_return(driver, cursor_planes, flight_attrs):
     airplane.click()
 
     # Get all classes corresponding to the seats table.
-    seat_list = driver.find_elements_by_class_name('item4')
+    seat_list = driver.find_elements(By.CLASS_NAME, 'item4')
 
     # Extract number of seats and assign to plane dictionary.
     num_seats = 0
@@ -337,100 +369,254 @@ def extract_plane_insert_and_return(driver, cursor_planes, flight_attrs):
   except:
     flight_attrs['total_seats'] = -1
 
-  # Insert into database.
-  cursor_planes.execute(insertion_query.format(
-                        flight_num=flight_attrs['flight_num'],
-                        carrier=flight_attrs['carrier'],
-                        aircraft=flight_attrs['aircraft'],
-                        total_seats=flight_attrs['total_seats']))
-
+  # Share the seats read from a seat map with the other workers.
+  if flight_attrs['total_seats'] >= 0:
+    seat_counts.add(flight_attrs['carrier'], flight_attrs['aircraft'],
+                    flight_attrs['total_seats'])
   return True
 
 
-def scrape_planes(driver, database, initial_record):
+class SeatCounts(object):
+  """
+  Thread-safe seat counts of planes by carrier and aircraft.  Shared by
+  the workers, so a plane's seat map is read once, and kept by the
+  writer, so each plane is written with the first count in arrival
+  order, as a single driver would.
+
+  Member Functions:
+    get: returns the seat count of a plane, or None
+    add: records the seat count of a plane, keeping the first
+  """
+
+  def __init__(self, connection=None):
+    """
+    SeatCounts can be seeded from the planes table of a connection.
+    """
+    self._seats = {}
+    self._lock = threading.Lock()
+    if connection is not None:
+      for carrier, aircraft, total_seats in connection.execute(
+            'SELECT carrier, aircraft, total_seats FROM planes '
+            'ORDER BY id;'):
+        self._seats.setdefault((carrier, aircraft), total_seats)
+
+
+  def get(self, carrier, aircraft):
+    """
+    Returns the seat count of a plane.
+
+    Args:
+      carrier: carrier name
+      aircraft: aircraft type
+
+    Returns:
+      total_seats: the seat count, or None if the plane is unknown
+    """
+    with self._lock:
+      return self._seats.get((carrier, aircraft))
+
+
+  def add(self, carrier, aircraft, total_seats):
+    """
+    Records the seat count of a plane, unless already known.
+
+    Args:
+      carrier: carrier name
+      aircraft: aircraft type
+      total_seats: the seat count
+
+    Returns:
+      VOID
+    """
+    with self._lock:
+      self._seats.setdefault((carrier, aircraft), total_seats)
+
+
+def read_arrivals(connection, initial_record):
   """
-  Main routine for scraping plane data into an SQLite database.
+  Reads the arrival rows to scrape planes for.
 
   Args:
-    driver: an initialized selenium webdriver object
-    database: filepath to the customs database
+    connection: an open sqlite3 connection to the customs database
+    initial_record: number of arrival rows, by id, to skip
 
   Returns:
-    VOID
+    tasks: list of (record number, flight_attrs) tuples in arrival order
   """
-  # Open up a connection to the database, initialize a cursor.
-  connection = sqlite3.connect(database)
-  cursor_arrivals = connection.cursor()
-  cursor_planes = connection.cursor()
-
   # get indices from database.
+  cursor_arrivals = connection.cursor()
   indices = _get_indices(cursor_arrivals)
 
   # Point the cursor at the list of flights for which we want plane data.
   cursor_arrivals.execute('SELECT * FROM arrivals '
                             'ORDER BY id '
-                            'LIMIT -1 OFFSET {start};'\
-                           .format(start=initial_record))
+                            'LIMIT -1 OFFSET ?;', (int(initial_record),))
 
-  # SOME COUNTERS
-  inserted_planes = 0
-  bad_planes = 0
-
-  # Iterate through every flight.
+  tasks = []
   for idx, row in enumerate(cursor_arrivals):
 
-    # Status update.
-    print("==================================================")
-    print("FLIGHT RECORD #", int(initial_record) + idx, ":", sep="")
-    print(idx,row)
-
     # Initiate a dictionary of flight attributes for the web scraping
-    # routine.
-    flight_attrs = {'carrier': None,
-            'flight_num': None,
-            'date': None,
-            'arrival_time': None,
-            'aircraft': None,
-            'total_seats': None}
-
-    # Retrieve the carrier, flight number, arrival_time and date from
-    # the sqlite query.
-    flight_attrs['carrier'] = row[indices['airline']]
-    flight_attrs['flight_num'] = row[indices['flight_num']]
-    #flight_attrs['date'] = row[indices['date']]
-    flight_attrs['arrival_time'] = row[indices['arrival_time']]
-
-    # Fill out the search page.
-    found_potential_plane = fill_search_form_and_submit(driver,
-                                                        flight_attrs)
-
-    # If our search did not turn up a result, we move to the next record.
-    if not found_potential_plane: continue
-
-    # If we have a potential plane, let's extract it, insert it into
-    # the DB and return control to the search page.
-    extracted = extract_plane_insert_and_return(driver, cursor_planes,
-                                                flight_attrs)
-
-    # If we could not extract plane information, move to next record.
-    if not extracted: continue
-
-    # Status updates here.
-    connection.commit()
-    inserted_planes += 1
-    print("(*) Found and extracted plane #", inserted_planes, ": ",
-          flight_attrs['carrier'], " ", flight_attrs['aircraft'], ".", sep="")
-
-    if inserted_planes % 10 == 0:
-      print("==================================================")
-      print ("Loaded ", inserted_planes,
-             " total planes into the database so far.", sep="")
-
-    print (idx,row)
+    # routine.  Retrieve the carrier, flight number, arrival_time and
+    # date from the sqlite query.
+    flight_attrs = {'carrier': row[indices['airline']],
+                    'flight_num': row[indices['flight_num']],
+                    'date': None,
+                    'arrival_time': row[indices['arrival_time']],
+                    'aircraft': None,
+                    'total_seats': None}
+    tasks.append((int(initial_record) + idx, flight_attrs))
+
+  return tasks
+
+
+def plane_worker(load, url, tasks, results, seat_counts):
+  """
+  Worker thread: drives one webdriver through the arrival rows it pulls
+  from the work queue, and hands every row back to the writer with its
+  plane, or None.  A worker whose webdriver fails to start leaves the
+  queue to the others.
+
+  Args:
+    load: function of no arguments returning a webdriver at url
+    url: URL of the search page, reloaded after a driver error
+    tasks: Queue of (record number, flight_attrs) tuples, ending in None
+    results: Queue of (record number, flight_attrs or None) tuples
+    seat_counts: a SeatCounts shared by the workers
+
+  Returns:
+    VOID
+  """
+  try:
+    driver = load()
+  except WebDriverException as error:
+    print("(X) Webdriver failed to start: ", str(error).strip(), sep="")
+    return
+
+  while True:
+    task = tasks.get()
+    if task is None: break
+    record_num, flight_attrs = task
+
+    try:
+      # Fill out the search page, and if we have a potential plane,
+      # extract it and return control to the search page.
+      extracted = fill_search_form_and_submit(driver, flight_attrs) and \
+                  extract_plane(driver, flight_attrs, seat_counts)
+    except WebDriverException as error:
+      print("(X) Webdriver error on record #", record_num, ": ",
+            str(error).strip(), sep="")
+      extracted = False
+      try:
+        driver.get(url)
+      except WebDriverException:
+        pass
+
+    results.put((record_num, flight_attrs if extracted else None))
+
+  driver.quit()
+
+
+def scrape_planes(database, initial_record, workers=default_workers,
+                  webdriver_exe=webdriver_exe, url=url, headless=True,
+                  load=None):
+  """
+  Main routine for scraping plane data into an SQLite database.  Puts
+  every arrival row on a work queue for a pool of webdrivers, and
+  inserts their planes from this thread alone, in arrival order, each
+  carrier and aircraft with its first seat count.  Stops
+  with an error naming the record to restart from if every worker
+  stops before the rows are done.
+
+  Args:
+    database: filepath to the customs database
+    initial_record: number of arrival rows, by id, to skip
+    workers: number of webdrivers
+    webdriver_exe: filepath to webdriver binary/executable
+    url: URL of the SeatGuru search page, or of a mock of it
+    headless: boolean for running the browsers without windows
+    load: None, or a function of no arguments returning a webdriver
+          at url, replacing load_driver
+
+  Returns:
+    VOID
+  """
+  # Open up a connection to the database.
+  connection = customs_sql.connect(database, 'bulk_load')
+  flights = read_arrivals(connection, initial_record)
+  seat_counts = SeatCounts(connection)
+  written = SeatCounts(connection)
+  if load is None:
+    load = lambda: load_driver(webdriver_exe, url, headless)
+
+  # Queue every row, then one stop sign per worker.
+  tasks = Queue()
+  results = Queue()
+  for task in flights: tasks.put(task)
+  for _ in range(workers): tasks.put(None)
+
+  threads = [threading.Thread(target=plane_worker,
+                              args=(load, url, tasks, results, seat_counts))
+             for _ in range(workers)]
+  for thread in threads:
+    thread.daemon = True
+    thread.start()
+
+  # SOME COUNTERS
+  inserted_planes = 0
+  finished = {}
+  next_record = int(initial_record)
+
+  # Write the planes in arrival order as the rows come back.
+  received = 0
+  while received < len(flights):
+    try:
+      record_num, flight_attrs = results.get(timeout=1)
+    except Empty:
+      if any(thread.is_alive() for thread in threads): continue
+      connection.commit()
+      connection.close()
+      raise RuntimeError("Every webdriver worker stopped.  Restart from "
+                         "record #%d." % next_record)
+    received += 1
+    finished[record_num] = flight_attrs
+
+    while next_record in finished:
+      flight_attrs = finished.pop(next_record)
+      next_record += 1
+
+      # If we could not extract plane information, move to next record.
+      if flight_attrs is None: continue
+
+      # Insert into database.  A plane written before keeps its seats.
+      written.add(flight_attrs['carrier'], flight_attrs['aircraft'],
+                  flight_attrs['total_seats'])
+      flight_attrs['total_seats'] = written.get(flight_attrs['carrier'],
+                                                flight_attrs['aircraft'])
+      connection.execute(insertion_query, (flight_attrs['flight_num'],
+                                           flight_attrs['carrier'],
+                                           flight_attrs['aircraft'],
+                                           flight_attrs['total_seats']))
+
+      # Status updates here.
+      inserted_planes += 1
+      print("(*) Found and extracted plane #", inserted_planes, ": ",
+            flight_attrs['carrier'], " ", flight_attrs['aircraft'], ".", sep="")
+
+      if inserted_planes % commit_every == 0:
+        connection.commit()
+        print("==================================================")
+        print ("Loaded ", inserted_planes,
+               " total planes into the database so far.  Restart from ",
+               "record #", next_record, ".", sep="")
+
+  for thread in threads: thread.join()
 
   # Clean-up resources.
   connection.commit()
   connection.close()
+  print("==================================================")
+  print("Scraping completed.  ", inserted_planes, " planes loaded from ",
+        len(flights), " arrival records.", sep="")
 
 
 ## ====================================================================
@@ -446,23 +632,30 @@ def main():
   Returns:
     VOID
   """
-  # Get the database name.
-  customs_db = sys.argv[1]
-
-  # Get first index.
-  initial_record = sys.argv[2]
-
-  # Load up the webdriver and point it to the top-level URL.
-  driver = load_driver(webdriver_exe, url)
+  parser = argparse.ArgumentParser(description="Scrapes the planes of the "
+                                   "arrivals into the customs database.")
+  parser.add_argument("database")
+  parser.add_argument("initial_record", nargs="?", default="0",
+                      help="arrival record to start from; 0 recreates the "
+                           "planes table")
+  parser.add_argument("--workers", type=int, default=default_workers,
+                      help="headless webdrivers scraping at once")
+  parser.add_argument("--url", default=url,
+                      help="search page URL, e.g. of customs_seatmap_mock.py")
+  parser.add_argument("--webdriver", default=webdriver_exe,
+                      help="webdriver binary/executable")
+  parser.add_argument("--show", action="store_true",
+                      help="show the browser windows")
+  args = parser.parse_args()
 
   # Create table in SQLite database.
-  if initial_record == "0":
-    create_planes_table(customs_db)
+  if args.initial_record == "0":
+    create_planes_table(args.database)
 
   # Initiate Scraping.
-  scrape_planes(driver, customs_db, initial_record)
+  scrape_planes(args.database, args.initial_record, args.workers,
+                args.webdriver, args.url, not args.show)
 
 
 if __name__ == "__main__":
   main()
-
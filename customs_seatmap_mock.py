@@ -0,0 +1,367 @@
+##
+##  JFK Customs Simulation
+##  customs_seatmap_mock.py
+##
+##  Created by Justin Fung on 10/22/17.
+##  Copyright 2017 Justin Fung. All rights reserved.
+##
+## ====================================================================
+# pylint: disable=bad-indentation,bad-continuation,multiple-statements
+# pylint: disable=invalid-name
+
+"""
+Local mock of the SeatGuru seat-map site, for running the planes
+scraper end to end without the live site.  Serves the three pages the
+scraper drives, with the element ids and classes it looks for:
+
+  Page                             | Elements
+  ---------------------------------------------------------------------
+  /findseatmap/findseatmap.php     | airline autocomplete, flight number,
+                                   | date picker and search button
+  /findseatmap/results.php         | the search form again, and a
+                                   | chooseFlights-row per result
+  /seatmap.php                     | item4 seat counts per cabin
+
+Every carrier and flight number of a customs database's arrivals gets a
+plane chosen by the crc32 of the flight, so the planes the scraper
+should find are known in advance (see expected_planes).  One flight in
+ten has no results, and one in ten lists its aircraft without a seat
+map link.  Can be invoked from the command line through the following:
+
+> python customs_seatmap_mock.py customs_db.sqlite --port 8001
+> python customs_scrape_planes.py customs_db.sqlite 0 --workers 4 \
+      --url http://localhost:8001/findseatmap/findseatmap.php
+
+Usage:
+  Please see README for how to compile the program and run the
+  model and data formatting requirements.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import threading
+import zlib
+
+try:
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+  from socketserver import ThreadingMixIn
+  from urllib.parse import parse_qs, quote, urlsplit
+  from html import escape
+except ImportError:
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+  from SocketServer import ThreadingMixIn
+  from urllib import quote
+  from urlparse import parse_qs, urlsplit
+  from cgi import escape
+
+import customs_sql
+
+
+## ====================================================================
+
+
+# Mock aircraft and their seats per cabin.
+mock_aircraft = [("Boeing 777-300ER", (8, 56, 40, 250)),
+                 ("Boeing 787-9", (28, 21, 36, 149)),
+                 ("Airbus A330-300", (30, 24, 230)),
+                 ("Airbus A380-800", (14, 76, 44, 335)),
+                 ("Airbus A321", (16, 174))]
+
+# Path of the search page.
+search_path = "/findseatmap/findseatmap.php"
+
+# The search form, on the search and results pages.  The script mimics
+# the jQuery UI autocomplete and date picker of the live site.
+search_form = '''
+<form onsubmit="return false;">
+  <input id="airline-select" autocomplete="off">
+  <ul class="ui-autocomplete ui-menu ui-widget ui-widget-content ui-corner-all"
+      style="display: none;"></ul>
+  <input id="flightno">
+  <input id="datepicker">
+  <div id="ui-datepicker-div" style="display: none;">
+    <a class="ui-datepicker-today" href="#">Today</a>
+  </div>
+  <button id="search" type="button">Search</button>
+</form>
+<script>
+var carriers = %(carriers)s;
+var field = document.getElementById("airline-select");
+var menu = document.querySelector(".ui-autocomplete");
+var picker = document.getElementById("ui-datepicker-div");
+field.addEventListener("input", function () {
+  var text = field.value.toLowerCase();
+  var matches = carriers.filter(function (carrier) {
+    return text && carrier.toLowerCase().indexOf(text) === 0;
+  });
+  menu.innerHTML = "";
+  matches.slice(0, 10).forEach(function (carrier) {
+    var item = document.createElement("li");
+    var link = document.createElement("a");
+    link.className = "ui-corner-all";
+    link.href = "#";
+    link.textContent = carrier;
+    link.addEventListener("click", function (event) {
+      event.preventDefault();
+      field.value = carrier;
+      menu.style.display = "none";
+    });
+    item.appendChild(link);
+    menu.appendChild(item);
+  });
+  menu.style.display = matches.length ? "block" : "none";
+});
+document.getElementById("datepicker").addEventListener("focus", function () {
+  picker.style.display = "block";
+});
+picker.querySelector("a").addEventListener("click", function (event) {
+  event.preventDefault();
+  picker.style.display = "none";
+});
+document.getElementById("search").addEventListener("click", function () {
+  window.location.href = "/findseatmap/results.php?airline=" +
+      encodeURIComponent(field.value) + "&flightno=" +
+      encodeURIComponent(document.getElementById("flightno").value);
+});
+</script>
+'''
+
+
+## ====================================================================
+
+
+def _crc(*parts):
+  """
+  Hashes strings to a non-negative integer.
+
+  Args:
+    parts: strings
+
+  Returns:
+    key: the crc32 of the parts joined by "|"
+  """
+  return zlib.crc32("|".join(parts).encode("utf-8")) & 0xffffffff
+
+
+def mock_planes(database):
+  """
+  Chooses a plane for every carrier and flight number of a database's
+  arrivals.
+
+  Args:
+    database: customs database filename
+
+  Returns:
+    planes: dictionary of (aircraft, has seat map) tuples, or None for
+            no results, by (carrier, flight number digits)
+  """
+  connection = customs_sql.connect(database, 'read')
+  rows = connection.execute('SELECT DISTINCT airline, flight_num '
+                            'FROM arrivals;').fetchall()
+  connection.close()
+
+  planes = {}
+  for carrier, flight_num in rows:
+    key = (carrier, flight_num.split(" ")[-1])
+    crc = _crc(*key)
+    if crc % 10 == 0:
+      planes[key] = None
+    else:
+      planes[key] = (mock_aircraft[crc // 10 % len(mock_aircraft)][0],
+                     crc % 10 != 1)
+  return planes
+
+
+def seat_count(aircraft):
+  """
+  Returns the total seats of a mock aircraft.
+
+  Args:
+    aircraft: aircraft name
+
+  Returns:
+    total_seats: integer
+  """
+  return sum(dict(mock_aircraft)[aircraft])
+
+
+def expected_planes(planes, flights):
+  """
+  Lists the planes table rows the scraper should write for arrival
+  rows.  A plane listed without a seat map has -1 seats, unless the
+  same carrier and aircraft was read from a seat map earlier.
+
+  Args:
+    planes: dictionary returned by mock_planes
+    flights: list of (flight_num, carrier) tuples in arrival order
+
+  Returns:
+    rows: list of (flight_num, carrier, aircraft, total_seats) tuples
+  """
+  known = {}
+  rows = []
+  for flight_num, carrier in flights:
+    plane = planes.get((carrier, flight_num.split(" ")[-1]))
+    if plane is None: continue
+    aircraft, has_map = plane
+    seats = known.setdefault((carrier, aircraft),
+                             seat_count(aircraft) if has_map else -1)
+    rows.append((flight_num, carrier, aircraft, seats))
+  return rows
+
+
+## ====================================================================
+
+
+class SeatMapHandler(BaseHTTPRequestHandler):
+  """
+  Request handler for the mock site's pages.
+  """
+
+  def _page(self, body, status=200):
+    """
+    Sends an html page.
+
+    Args:
+      body: html of the page body
+      status: HTTP status code
+
+    Returns:
+      VOID
+    """
+    page = ("<html><head><title>Mock SeatGuru</title></head><body>%s"
+            "</body></html>" % body).encode("utf-8")
+    self.send_response(status)
+    self.send_header("Content-Type", "text/html; charset=utf-8")
+    self.send_header("Content-Length", str(len(page)))
+    self.end_headers()
+    self.wfile.write(page)
+
+
+  def do_GET(self):
+    """
+    Serves the search, results and seat-map pages.
+
+    Args:
+      None
+
+    Returns:
+      VOID
+    """
+    parts = urlsplit(self.path)
+    query = dict((name, values[0])
+                 for name, values in parse_qs(parts.query).items())
+    form = search_form % {'carriers': self.server.carriers_json}
+
+    if parts.path == search_path:
+      self._page(form)
+    elif parts.path == "/findseatmap/results.php":
+      plane = self.server.planes.get((query.get("airline", ""),
+                                      query.get("flightno", "")))
+      rows = ""
+      if plane is not None:
+        aircraft, has_map = plane
+        if has_map:
+          rows = ('<div class="chooseFlights-row">10:25A '
+                  '<a class="flightno" href="/seatmap.php?aircraft=%s">%s</a>'
+                  '</div>' % (quote(aircraft), escape(aircraft)))
+        else:
+          rows = ('<div class="chooseFlights-row">10:25A %s No Map</div>'
+                  % escape(aircraft))
+      self._page(form + rows)
+    elif parts.path == "/seatmap.php":
+      seats = dict(mock_aircraft).get(query.get("aircraft"))
+      if seats is None:
+        self._page("Not found", 404)
+        return
+      self._page("<table>%s</table>"
+                 % "".join('<tr><td class="item4">%d Seats</td></tr>' % count
+                           for count in seats))
+    else:
+      self._page("Not found", 404)
+
+
+  def log_message(self, *args):
+    """
+    Silences the per-request log.
+    """
+    pass
+
+
+class SeatMapMockServer(ThreadingMixIn, HTTPServer):
+  """
+  Mock seat-map site, one thread per connection.
+
+  Member Data:
+    planes: dictionary returned by mock_planes
+    url: URL of the search page, for the scraper's url
+
+  Member Functions:
+    start: serves in a background thread
+  """
+
+  daemon_threads = True
+
+  def __init__(self, planes, port=0, host="127.0.0.1"):
+    """
+    SeatMapMockServer must be instantiated with the planes it serves.
+    Port 0 picks a free port.
+    """
+    HTTPServer.__init__(self, (host, port), SeatMapHandler)
+    self.planes = planes
+    self.carriers_json = json.dumps(sorted(set(
+                             carrier for carrier, _ in planes))) \
+                             .replace("</", "<\\/")
+    self.url = "http://%s:%d%s" % (self.server_address[:2] + (search_path,))
+
+
+  def start(self):
+    """
+    Serves in a daemon thread, e.g. for a scrape in the same process.
+    Stop with shutdown().
+
+    Args:
+      None
+
+    Returns:
+      thread: the serving thread
+    """
+    thread = threading.Thread(target=self.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+## ====================================================================
+
+
+def main():
+  """
+  Main.  Invoked from command line with a customs database.  Serves the
+  mock site for its arrivals until interrupted.
+
+  Args:
+    None
+
+  Returns:
+    VOID
+  """
+  parser = argparse.ArgumentParser(description="Mock seat-map site for the "
+                                   "planes scraper.")
+  parser.add_argument("database")
+  parser.add_argument("--port", type=int, default=8001)
+  args = parser.parse_args()
+
+  server = SeatMapMockServer(mock_planes(args.database), args.port)
+  print("Serving mock seat maps for ", args.database, " at ", server.url,
+        sep="")
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    server.server_close()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,193 @@
+##
+##  JFK Customs Simulation
+##  customs_sequential.py
+##
+##  Created by Justin Fung on 10/22/17.
+##  Copyright 2017 Justin Fung. All rights reserved.
+##
+## ====================================================================
+# pylint: disable=bad-indentation,bad-continuation,multiple-statements
+# pylint: disable=invalid-name
+
+"""
+Sequential sampling for the optimizer's threshold decisions.  Instead of
+judging a candidate schedule on one simulation, replications are run in
+parallel batches until the 95% confidence interval of the hour's mean
+wait lies wholly above or below the threshold, or a replication budget
+runs out.  Close decisions get more replications and clear ones stop
+after the first batch.
+
+The run's compiled dataset is published once in shared memory
+(customs_shared) and every worker attaches to it as read-only NumPy
+views, so adding workers does not copy the arrivals and manifests.
+Workers simulate on a DatasetPlaneDispatcher that reports from memory,
+with only a scratch in-memory database for the server statistics.
+Replications draw common random numbers keyed by (hour, replication)
+under the run's seed, so every candidate of an hour sees the same
+service draws no matter which worker runs it.
+
+Usage:
+  Please see README for how to compile the program and run the
+  model and data formatting requirements.
+"""
+
+from __future__ import print_function
+
+from multiprocessing import Pool, cpu_count
+
+import customs
+import customs_replication
+import customs_shared
+import customs_sql
+from customs_dataset import DatasetPlaneDispatcher
+from customs_obj import compile_schedule
+from customs_obj import spd_factor
+
+
+## ====================================================================
+
+
+# Scratch database of the workers, for the server statistics only.
+worker_database = ":memory:"
+
+# Per-process simulation state, set by init_worker.
+worker_state = {}
+
+
+def init_worker(path, seed, speed_factor):
+  """
+  Pool initializer: attaches to the published dataset and builds the
+  worker's dispatcher and common random numbers.
+
+  Args:
+    path: filename of a dataset published by customs_shared
+    seed: the run's common random numbers seed
+    speed_factor: a speed factor for simulation time
+
+  Returns:
+    VOID
+  """
+  customs_sql.reset_after_fork()
+  customs_shared.init_worker(path)
+  plane_dispatcher = DatasetPlaneDispatcher(customs_shared.worker_dataset,
+                                            speed_factor,
+                                            in_memory_report=True)
+  worker_state.update(
+          speed_factor=speed_factor, plane_dispatcher=plane_dispatcher,
+          crn=customs_replication.CommonRandomNumbers(plane_dispatcher, seed))
+
+
+def simulate_replication(task):
+  """
+  Runs one replication of a candidate schedule in a worker.
+
+  Args:
+    task: tuple of (compiled ServerSchedule, block, replication)
+
+  Returns:
+    report: simulation report as pandas dataframe
+  """
+  server_schedule, block, replication = task
+  plane_dispatcher = worker_state['plane_dispatcher']
+  worker_state['crn'].apply(plane_dispatcher, block, replication)
+  return customs.simulate(worker_database, plane_dispatcher,
+                          server_schedule, worker_state['speed_factor'])
+
+
+## ====================================================================
+
+
+class SequentialSampler(object):
+  """
+  Class running replications of candidate schedules in a worker pool
+  until the threshold decision is statistically clear.
+
+  Member Data:
+    workers: number of worker processes
+    batch_size: replications run per batch
+    min_replications: replications run before any decision
+    max_replications: replication budget per candidate
+
+  Member Functions:
+    sample: runs replications of a candidate for an hour
+    close: shuts down the worker pool
+  """
+
+  def __init__(self, path, seed=None, workers=None, batch_size=None,
+               min_replications=2, max_replications=50,
+               speed_factor=spd_factor):
+    """
+    SequentialSampler must be instantiated with a dataset published by
+    customs_shared.publish_dataset or publish_database.
+    """
+    self.workers = workers or cpu_count()
+    self.batch_size = batch_size or self.workers
+    self.min_replications = max(2, min_replications)
+    self.max_replications = max(self.min_replications, max_replications)
+    self._pool = Pool(self.workers, initializer=init_worker,
+                      initargs=(path, seed, speed_factor))
+
+
+  def decided(self, reports, hour, threshold):
+    """
+    Checks whether the replications so far settle the threshold
+    decision for an hour.
+
+    Args:
+      reports: list of report dataframes, one per replication
+      hour: integer hour being decided
+      threshold: average wait threshold in minutes
+
+    Returns:
+      boolean
+    """
+    if len(reports) >= self.max_replications: return True
+    if len(reports) < self.min_replications: return False
+
+    waits = customs_replication.hour_waits(reports, hour)
+    if not waits: return True
+    _, ci_low, ci_high = customs_replication.confidence_interval(waits)
+    return ci_low >= threshold or ci_high < threshold
+
+
+  def sample(self, server_schedule, hour, threshold):
+    """
+    Runs batches of replications of a candidate schedule until its
+    decision for the hour is settled.
+
+    Args:
+      server_schedule: a Pandas dataframe
+      hour: integer hour being decided, or a label such as "final",
+            which gets a single batch
+      threshold: average wait threshold in minutes
+
+    Returns:
+      reports: list of report dataframes, one per replication
+    """
+    # Workers receive the compiled schedule, which pickles without pandas.
+    schedule = compile_schedule(server_schedule)
+
+    reports = []
+    while True:
+      start = len(reports)
+      stop = min(start + self.batch_size, self.max_replications)
+      tasks = [(schedule, hour, replication)
+               for replication in range(start, stop)]
+      reports += self._pool.map(simulate_replication, tasks)
+
+      if not isinstance(hour, int): return reports
+      if self.decided(reports, hour, threshold): return reports
+
+
+  def close(self):
+    """
+    Shuts down the worker pool.
+
+    Args:
+      None
+
+    Returns:
+      VOID
+    """
+    self._pool.close()
+    self._pool.join()
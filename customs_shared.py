@@ -0,0 +1,292 @@
+##
+##  JFK Customs Simulation
+##  customs_shared.py
+##
+##  Created by Justin Fung on 10/22/17.
+##  Copyright 2017 Justin Fung. All rights reserved.
+##
+## ====================================================================
+# pylint: disable=bad-indentation,bad-continuation,multiple-statements
+# pylint: disable=invalid-name
+
+"""
+Publishes a compiled dataset once in shared memory so that parallel
+simulation workers attach to the same physical pages as read-only NumPy
+views instead of each re-reading the database.  The sequential sampler's
+workers (customs_sequential) attach through init_worker and simulate on
+a DatasetPlaneDispatcher over the shared arrays.  Can be invoked from
+the command line to benchmark per-worker memory through the following:
+
+> python customs_shared.py customs_db.dat 1 2 4 8 16 32
+
+The dataset file is copied to a tmpfs mount (/dev/shm on Linux) and
+every worker maps it through customs_dataset.load_dataset.  Mapped pages
+show up under RssShmem/RssFile, which the kernel shares between
+processes, while the private heap (RssAnon) of each worker stays flat as
+workers are added.
+
+Usage:
+  Please see README for how to compile the program and run the
+  model and data formatting requirements.
+"""
+
+from __future__ import print_function
+
+from multiprocessing import Pool
+
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+from customs_dataset import compile_dataset
+from customs_dataset import load_dataset
+
+
+## ====================================================================
+
+
+# Preferred location for published datasets.
+shm_dir = "/dev/shm"
+
+# Per-process dataset set up by init_worker.
+worker_dataset = None
+
+
+## ====================================================================
+
+
+def _publish_directory(directory=None):
+  """
+  Returns the directory to publish datasets into.
+
+  Args:
+    directory: directory to publish into, or None for /dev/shm when
+               present and the system temp directory otherwise
+
+  Returns:
+    directory: a directory name
+  """
+  if directory is not None: return directory
+  return shm_dir if os.path.isdir(shm_dir) else tempfile.gettempdir()
+
+
+def publish_dataset(dataset_file, directory=None):
+  """
+  Copies a compiled dataset into shared memory.  The published copy is
+  named after the dataset's content hash, so publishing the same data
+  twice reuses the first copy.
+
+  Args:
+    dataset_file: filename of a compiled dataset
+    directory: directory to publish into, defaults to /dev/shm when
+               present and the system temp directory otherwise
+
+  Returns:
+    path: filename of the published dataset
+  """
+  directory = _publish_directory(directory)
+
+  dataset = load_dataset(dataset_file)
+  path = os.path.join(directory, "customs_" + dataset.content_hash + ".dat")
+  dataset.close()
+
+  # Copy under a temporary name and rename, so workers never attach to a
+  # partially written file.
+  if not os.path.exists(path):
+    tmp_path = path + "." + str(os.getpid())
+    shutil.copyfile(dataset_file, tmp_path)
+    os.rename(tmp_path, path)
+
+  return path
+
+
+def publish_database(database, directory=None):
+  """
+  Compiles a customs database straight into shared memory, without an
+  intermediate dataset file.  Compile after init_service_times and
+  commit, so that the published service times are the run's own.
+
+  Args:
+    database: sqlite database holding 'arrivals', 'airports' and
+              'passengers' tables
+    directory: directory to publish into, as for publish_dataset
+
+  Returns:
+    path: filename of the published dataset
+  """
+  directory = _publish_directory(directory)
+
+  # Compile under a temporary name and rename to the content hash, so
+  # workers never attach to a partially written file.
+  tmp_path = os.path.join(directory, "customs_%d.dat.tmp" % os.getpid())
+  digest = compile_dataset(database, tmp_path)
+  path = os.path.join(directory, "customs_" + digest + ".dat")
+  os.rename(tmp_path, path)
+
+  return path
+
+
+def unpublish_dataset(path):
+  """
+  Removes a published dataset.  Workers still attached keep their
+  mapping until they exit.
+
+  Args:
+    path: filename of the published dataset
+
+  Returns:
+    VOID
+  """
+  if os.path.exists(path):
+    os.remove(path)
+
+
+def attach_dataset(path):
+  """
+  Attaches to a published dataset as read-only NumPy views.
+
+  Args:
+    path: filename of the published dataset
+
+  Returns:
+    dataset: an initialized CompiledDataset object
+  """
+  return load_dataset(path)
+
+
+def init_worker(path):
+  """
+  Pool initializer that attaches a worker process to a published
+  dataset.  Workers build a DatasetPlaneDispatcher on worker_dataset,
+  with in_memory_report so that they need no database of their own;
+  compile the dataset after init_service_times so that the dispatcher
+  does not have to copy in service times of its own.
+
+  Args:
+    path: filename of the published dataset
+
+  Returns:
+    VOID
+  """
+  global worker_dataset
+  worker_dataset = attach_dataset(path)
+
+
+## ====================================================================
+
+
+def _memory_status():
+  """
+  Reads the resident set breakdown of the current process from
+  /proc/self/status.
+
+  Args:
+    None
+
+  Returns:
+    status: dictionary of resident sizes in kB
+  """
+  status = {'VmRSS': 0, 'RssAnon': 0, 'RssFile': 0, 'RssShmem': 0}
+  try:
+    with open("/proc/self/status") as the_file:
+      for line in the_file:
+        key = line.split(":")[0]
+        if key in status:
+          status[key] = int(line.split()[1])
+  except IOError:
+    pass
+  return status
+
+
+def _measure_worker(private):
+  """
+  Touches every page of the worker's dataset and reports its memory.
+
+  Args:
+    private: boolean for copying the arrays onto the worker heap, as a
+             worker reading its own copy of the database would
+
+  Returns:
+    row: tuple of pid and resident sizes in kB
+  """
+  before = _memory_status()
+
+  arrays = worker_dataset.arrays
+  if private:
+    arrays = dict((name, np.array(values)) for name, values in arrays.items())
+
+  checksum = 0
+  for values in arrays.values():
+    if values.dtype.kind in 'iu':
+      checksum += int(values.sum())
+
+  after = _memory_status()
+  return (os.getpid(), after['VmRSS'], after['RssAnon'] - before['RssAnon'],
+          after['RssFile'] + after['RssShmem'], checksum)
+
+
+def benchmark_memory(dataset_file, worker_counts, private=False):
+  """
+  Measures per-worker resident memory as workers are added.
+
+  Args:
+    dataset_file: filename of a compiled dataset
+    worker_counts: list of pool sizes to measure
+    private: boolean for copying the arrays onto each worker's heap
+
+  Returns:
+    results: list of (workers, mean rss, mean private growth, mean
+             shared) tuples in kB
+  """
+  path = publish_dataset(dataset_file)
+  results = []
+
+  for num_workers in worker_counts:
+    pool = Pool(num_workers, initializer=init_worker, initargs=(path,))
+    rows = pool.map(_measure_worker, [private] * num_workers, chunksize=1)
+    pool.close()
+    pool.join()
+
+    results.append((num_workers,
+                    sum(row[1] for row in rows) / len(rows),
+                    sum(row[2] for row in rows) / len(rows),
+                    sum(row[3] for row in rows) / len(rows)))
+
+  unpublish_dataset(path)
+  return results
+
+
+## ====================================================================
+
+
+def main():
+  """
+  Main.  Invoked from command line with a compiled dataset filename
+  and a list of worker counts.
+
+  Args:
+    None
+
+  Returns:
+    VOID
+  """
+  dataset_file = sys.argv[1]
+  worker_counts = [int(arg) for arg in sys.argv[2:]] or [1, 2, 4, 8]
+
+  for private in (False, True):
+    print("===================================================================")
+    print("Workers attached to ", "private copies" if private else
+          "shared memory", " (kB per worker):", sep="")
+    print(" Workers |   VmRSS   | Heap growth |  Shared  ")
+    print("-------------------------------------------------------------------")
+    for num_workers, rss, heap, shared in benchmark_memory(dataset_file,
+                                                          worker_counts,
+                                                          private):
+      print("%8d | %9d | %11d | %8d" % (num_workers, rss, heap, shared))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,337 @@
+##
+##  JFK Customs Simulation
+##  customs_sql.py
+##
+##  Created by Justin Fung on 10/22/17.
+##  Copyright 2017 Justin Fung. All rights reserved.
+##
+## ====================================================================
+# pylint: disable=bad-indentation,bad-continuation,multiple-statements
+# pylint: disable=invalid-name
+
+"""
+Shared SQLite access layer for the customs modules.  Owns the
+connections to each database, applies performance pragmas suited to the
+workload, and provides batch helpers for parameterized statements.
+
+Workloads:
+
+  Workload  | Journal | Synchronous | Temp Store | Page Cache
+  ---------------------------------------------------------------------
+  simulate  |   WAL   |   NORMAL    |   MEMORY   |   64 MB
+  bulk_load |   WAL   |     OFF     |   MEMORY   |  256 MB
+  read      |   WAL   |   NORMAL    |   MEMORY   |   32 MB + 256 MB mmap
+
+Connections are opened with a large prepared statement cache, so the
+parameterized statements issued every tick are compiled only once.
+
+A database can also be swapped for an in-memory working copy with
+load_into_memory.  Every later get_connection for that database returns
+the copy, and write_back saves it to disk in a single backup step.
+
+Usage:
+  Please see README for how to compile the program and run the
+  model and data formatting requirements.
+"""
+
+from __future__ import print_function
+
+import os
+import sqlite3
+
+
+## ====================================================================
+
+
+# Pragmas applied per workload, in order.
+workload_pragmas = {
+  'simulate': (('journal_mode', 'WAL'),
+               ('synchronous', 'NORMAL'),
+               ('temp_store', 'MEMORY'),
+               ('cache_size', -65536)),
+  'bulk_load': (('journal_mode', 'WAL'),
+                ('synchronous', 'OFF'),
+                ('temp_store', 'MEMORY'),
+                ('cache_size', -262144)),
+  'read': (('journal_mode', 'WAL'),
+           ('synchronous', 'NORMAL'),
+           ('temp_store', 'MEMORY'),
+           ('cache_size', -32768),
+           ('mmap_size', 268435456))
+}
+
+# Number of prepared statements kept per connection.
+statement_cache_size = 256
+
+# Default number of rows per transaction in the batch helpers.
+batch_size = 10000
+
+# Connections shared within this process, keyed by database path.
+_connections = {}
+_workloads = {}
+
+# Keys of the databases whose shared connection is an in-memory copy.
+_in_memory = set()
+
+
+## ====================================================================
+
+
+def _key(database):
+  """
+  Normalizes a database filename into a connection pool key.
+
+  Args:
+    database: sqlite database filename
+
+  Returns:
+    key: a string
+  """
+  if database == ':memory:': return database
+  return os.path.abspath(database)
+
+
+def apply_pragmas(connection, workload):
+  """
+  Applies the pragmas of a workload to an open connection.
+
+  Args:
+    connection: an open sqlite3 connection
+    workload: a key of workload_pragmas
+
+  Returns:
+    VOID
+  """
+  for pragma, value in workload_pragmas[workload]:
+    connection.execute('PRAGMA {pragma} = {value};'.format(pragma=pragma,
+                                                           value=value))
+
+
+def connect(database, workload='simulate', **kwargs):
+  """
+  Opens a new, unshared connection tuned for a workload.  Use this for
+  connections owned by a single thread or a short-lived script.
+
+  Args:
+    database: sqlite database filename
+    workload: a key of workload_pragmas
+    kwargs: further keyword arguments to sqlite3.connect
+
+  Returns:
+    connection: an open sqlite3 connection
+  """
+  kwargs.setdefault('cached_statements', statement_cache_size)
+  connection = sqlite3.connect(database, **kwargs)
+  apply_pragmas(connection, workload)
+  return connection
+
+
+def get_connection(database, workload='simulate'):
+  """
+  Returns the process-wide connection to a database, opening it on
+  first use.  Asking for a different workload re-applies the pragmas.
+
+  Args:
+    database: sqlite database filename
+    workload: a key of workload_pragmas
+
+  Returns:
+    connection: an open sqlite3 connection
+  """
+  key = _key(database)
+  connection = _connections.get(key)
+
+  if connection is None:
+    connection = connect(database, workload)
+    _connections[key] = connection
+    _workloads[key] = workload
+  elif _workloads[key] != workload:
+    apply_pragmas(connection, workload)
+    _workloads[key] = workload
+
+  return connection
+
+
+def close_connection(database):
+  """
+  Commits and closes the process-wide connection to a database.  An
+  in-memory working copy is discarded; call write_back first to keep it.
+
+  Args:
+    database: sqlite database filename
+
+  Returns:
+    VOID
+  """
+  key = _key(database)
+  connection = _connections.pop(key, None)
+  _workloads.pop(key, None)
+  _in_memory.discard(key)
+  if connection is not None:
+    connection.commit()
+    connection.close()
+
+
+def close_all():
+  """
+  Commits and closes every process-wide connection.
+
+  Args:
+    None
+
+  Returns:
+    VOID
+  """
+  for key in list(_connections.keys()):
+    close_connection(key)
+
+
+def reset_after_fork():
+  """
+  Forgets the connections inherited from a parent process without
+  closing them.  SQLite connections must not be used across fork, so a
+  forked worker calls this before opening its own.
+
+  Args:
+    None
+
+  Returns:
+    VOID
+  """
+  _connections.clear()
+  _workloads.clear()
+  _in_memory.clear()
+
+
+## ====================================================================
+
+
+def _copy_database(source, target):
+  """
+  Copies the full contents of one open database into another, with the
+  SQLite online backup API where the sqlite3 module provides it.
+
+  Args:
+    source: an open sqlite3 connection to copy from
+    target: an open sqlite3 connection to copy into
+
+  Returns:
+    VOID
+  """
+  source.commit()
+  if hasattr(source, 'backup'):
+    source.backup(target)
+  else:
+    target.executescript('\n'.join(source.iterdump()))
+  target.commit()
+
+
+def load_into_memory(database):
+  """
+  Copies a database into an in-memory working copy and makes it the
+  process-wide connection for that database.
+
+  Args:
+    database: sqlite database filename
+
+  Returns:
+    connection: an open sqlite3 connection to the in-memory copy
+  """
+  key = _key(database)
+  if key in _in_memory: return _connections[key]
+
+  # Flush and close any connection already open on the file.
+  close_connection(database)
+
+  # Copy the file into memory.
+  disk = sqlite3.connect(database)
+  memory = connect(':memory:', 'simulate')
+  _copy_database(disk, memory)
+  disk.close()
+
+  _connections[key] = memory
+  _workloads[key] = 'simulate'
+  _in_memory.add(key)
+  return memory
+
+
+def write_back(database):
+  """
+  Saves an in-memory working copy over its database file in one backup
+  step.  The working copy stays open.
+
+  Args:
+    database: sqlite database filename
+
+  Returns:
+    VOID
+  """
+  key = _key(database)
+  if key not in _in_memory: return
+
+  disk = sqlite3.connect(database)
+  _copy_database(_connections[key], disk)
+  disk.close()
+
+
+## ====================================================================
+
+
+def iter_batches(rows, size=None):
+  """
+  Groups an iterable of rows into lists of at most size rows.
+
+  Args:
+    rows: an iterable of parameter tuples
+    size: rows per batch, defaults to batch_size
+
+  Returns:
+    batches: a generator of lists
+  """
+  size = size or batch_size
+  batch = []
+  for row in rows:
+    batch.append(row)
+    if len(batch) >= size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+
+def execute_batches(connection, query, rows, size=None):
+  """
+  Executes a parameterized statement over an iterable of rows with
+  executemany, committing once per batch.
+
+  Args:
+    connection: an open sqlite3 connection
+    query: a parameterized SQL statement
+    rows: an iterable of parameter tuples
+    size: rows per transaction, defaults to batch_size
+
+  Returns:
+    count: number of rows executed
+  """
+  count = 0
+  for batch in iter_batches(rows, size):
+    connection.executemany(query, batch)
+    connection.commit()
+    count += len(batch)
+  return count
+
+
+def table_columns(connection, table):
+  """
+  Lists the column names of a table.
+
+  Args:
+    connection: an open sqlite3 connection
+    table: table name as a string
+
+  Returns:
+    columns: a list of strings
+  """
+  return [row[1] for row in
+          connection.execute('PRAGMA table_info({table});'.format(
+                                                        table=table))]
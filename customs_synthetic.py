@@ -0,0 +1,501 @@
+##
+##  JFK Customs Simulation
+##  customs_synthetic.py
+##
+##  Created by Justin Fung on 10/22/17.
+##  Copyright 2017 Justin Fung. All rights reserved.
+##
+## ====================================================================
+# pylint: disable=bad-indentation,bad-continuation,multiple-statements
+# pylint: disable=invalid-name
+
+"""
+Plane dispatcher that synthesizes passenger manifests at dispatch time
+instead of reading a materialized passengers table.  The simulation
+only needs each passenger's nationality and service time, so a
+manifest is drawn from the seat count of the flight's plane in the
+planes table:
+
+  Draw                  | Distribution
+  ---------------------------------------------------------------------
+  domestic share        | triangular nationality_dist, once per flight
+  nationality           | domestic with the flight's share
+  service time          | triangular service_dist_dom or service_dist_intl
+
+Each flight draws from a stream keyed by its flight number and its
+occurrence under the run's seed, so a manifest is the same whenever it
+is dispatched.  A plane with a missing seat count gets the average of
+the positive counts of its aircraft type, as in the passenger
+generator.
+
+Simulations with this dispatcher report from passenger statistics kept
+in memory, so the passengers table is never read or written and can be
+left empty.  Invoked from the command line through the following:
+
+> python customs.py 15 --synthetic --seed 0
+
+CsvPlaneDispatcher runs the simulator from an arrival schedule CSV
+with the columns of schedules/sample_arrival_schedule.csv, without any
+database:
+
+  id,arrival_time,passengers_dom,passengers_intl
+  1,00:25:00,200,200
+
+The CSV is streamed once into compact arrays indexed by simulation
+tick, so very large forecasts load quickly.  Arrivals between ticks are
+dispatched at the tick they fall in.  Only service times are drawn, per
+arrival from a stream keyed by its id and occurrence.
+
+> python customs.py 15 --arrivals schedules/sample_arrival_schedule.csv
+
+Usage:
+  Please see README for how to compile the program and run the
+  model and data formatting requirements.
+"""
+
+from __future__ import print_function
+
+from array import array
+
+import csv
+
+import numpy as np
+
+import customs_random
+import customs_sql
+from customs_obj import Plane
+from customs_obj import _get_sec
+from customs_obj import TriangularSampler
+from customs_obj import service_dist_dom
+from customs_obj import service_dist_intl
+from customs_obj import spd_factor
+
+
+## ====================================================================
+
+
+# Triangular distribution of a flight's share of domestic passengers.
+nationality_dist = (0.3, 0.4, 0.5)
+
+# International arrivals, as selected by the PlaneDispatcher, with the
+# seat count of the flight's first planes record and the integer
+# average of the positive seat counts of its aircraft type.
+intl_seats_query = ('SELECT arrivals.id, '
+                      'arrivals.origin, '
+                      'arrivals.airport_code, '
+                      'arrivals.arrival_time, '
+                      'arrivals.airline, '
+                      'arrivals.flight_num, '
+                      'arrivals.terminal, '
+                      'CAST(planes.total_seats AS INTEGER), '
+                      'averages.seats '
+                    'FROM arrivals '
+                    'LEFT JOIN airports '
+                      'ON arrivals.airport_code = airports.code '
+                    'LEFT JOIN planes '
+                      'ON planes.id = (SELECT MIN(id) FROM planes AS first '
+                                      'WHERE first.flight_num = '
+                                        'arrivals.flight_num) '
+                    'LEFT JOIN (SELECT aircraft, '
+                                'SUM(CAST(total_seats AS INTEGER)) / '
+                                  'COUNT(*) AS seats '
+                              'FROM planes '
+                              'WHERE CAST(total_seats AS INTEGER) > 0 '
+                              'GROUP BY aircraft) AS averages '
+                      'ON averages.aircraft = planes.aircraft '
+                    'WHERE arrivals.code_share = \'\' '
+                      'AND arrivals.terminal = \'4\' '
+                      'AND airports.country != "United States" '
+                      'AND airports.preclearance != "true";')
+
+
+## ====================================================================
+
+
+class SyntheticPlaneDispatcher(object):
+  """
+  PlaneDispatcher counterpart that draws each plane's manifest when it
+  is dispatched.
+
+  Member Data:
+    sequence: the run's SeedSequence
+    speed_factor: a speed factor for simulation time
+    flights: list of (arrival row, seats, first passenger id,
+             occurrence) tuples in arrival order
+    intl_arrival_dict: dictionary with arrival times in seconds as keys
+                       and flight indices as values
+    service_times: None, or a dictionary of service times by passenger
+                   id overriding the drawn ones
+    in_memory_report: True; simulations report without the passengers
+                      table
+    plane_count: simple integer count of planes initialized
+    passenger_count: simple integer count of passengers initialized
+
+  Member Functions:
+    manifest: draws the passengers of a flight
+    population: draws the nationalities of every passenger
+    dispatch_planes: returns initialized planes if simulation time
+                     matches an arrival.
+  """
+
+  in_memory_report = True
+
+  def __init__(self, sqlite_database, seed=None, speed_factor=spd_factor):
+    """
+    SyntheticPlaneDispatcher must be instantiated with a database
+    holding the arrivals, airports and planes tables, and optionally
+    the seed to draw manifests from.
+    """
+    self.sequence = customs_random.seed_sequence(seed)
+    self.speed_factor = speed_factor
+    self.flights = self.get_intl_flights(sqlite_database)
+    self.intl_arrival_dict = {}
+    for idx, flight in enumerate(self.flights):
+      secs = _get_sec(flight[0][3], 1)
+      self.intl_arrival_dict.setdefault(secs, []).append(idx)
+    self.service_times = None
+    self.plane_count = 0
+    self.passenger_count = 0
+
+
+  def get_intl_flights(self, sqlite_database):
+    """
+    Reads the international arrivals with their seat counts, and
+    numbers their passengers.
+
+    Args:
+      sqlite_database: sqlite database filename
+
+    Returns:
+      flights: list of (arrival row, seats, first passenger id,
+               occurrence) tuples sorted by arrival time
+    """
+    connection = customs_sql.get_connection(sqlite_database)
+    rows = connection.execute(intl_seats_query).fetchall()
+    rows.sort(key=lambda row: (_get_sec(row[3], 1), row[0]))
+
+    flights = []
+    occurrences = {}
+    next_id = 1
+    for row in rows:
+      arrival, total_seats, average_seats = row[:7], row[7], row[8]
+
+      # Planes without a record have no passengers.
+      if total_seats is None: total_seats = 0
+      elif total_seats <= 0: total_seats = average_seats or 0
+
+      flight_num = arrival[5]
+      occurrence = occurrences.get(flight_num, 0)
+      occurrences[flight_num] = occurrence + 1
+
+      flights.append((arrival, total_seats, next_id, occurrence))
+      next_id += total_seats
+
+    return flights
+
+
+  def _draw(self, idx):
+    """
+    Draws the nationalities and service times of a flight.
+
+    Args:
+      idx: index into flights
+
+    Returns:
+      domestic: boolean array
+      rng: the flight's generator, for the draws that follow
+    """
+    arrival, total_seats, _, occurrence = self.flights[idx]
+    rng = customs_random.keyed_rng(self.sequence,
+                                   customs_random.string_key(arrival[5]),
+                                   occurrence)
+    share = rng.triangular(*nationality_dist)
+    return rng.random(total_seats) < share, rng
+
+
+  def manifest(self, idx):
+    """
+    Draws the passengers of a flight.
+
+    Args:
+      idx: index into flights
+
+    Returns:
+      plist: list of passenger rows in the row format of the passengers
+             table, without identity fields
+    """
+    arrival, total_seats, first_id, _ = self.flights[idx]
+    flight_num = arrival[5]
+    domestic, rng = self._draw(idx)
+
+    service_times = np.where(
+        domestic,
+        TriangularSampler(service_dist_dom, rng,
+                          self.speed_factor).draws(total_seats),
+        TriangularSampler(service_dist_intl, rng,
+                          self.speed_factor).draws(total_seats)).tolist()
+
+    pids = range(first_id, first_id + total_seats)
+    if self.service_times is not None:
+      service_times = [self.service_times[pid] for pid in pids]
+
+    return [(pid, flight_num, None, None, None,
+             "domestic" if is_domestic else "foreign", service_time)
+            for pid, is_domestic, service_time
+            in zip(pids, domestic.tolist(), service_times)]
+
+
+  def population(self):
+    """
+    Draws the nationalities of every passenger the dispatcher can
+    dispatch, e.g. for common random numbers.
+
+    Args:
+      None
+
+    Returns:
+      passenger_ids: integer array
+      domestic: boolean array
+    """
+    if not self.flights:
+      return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+
+    domestic = np.concatenate([self._draw(idx)[0]
+                               for idx in range(len(self.flights))])
+    return np.arange(1, len(domestic) + 1, dtype=np.int64), domestic
+
+
+  def dispatch_planes(self, current_time):
+    """
+    SyntheticPlaneDispatcher class method for initializing and
+    returning new planes on schedule.
+
+    Args:
+      current_time: simulation time in simulation time units.
+
+    Returns:
+      planes: a list of instantiated Plane objects
+    """
+    planes = []
+
+    # If a plane is not due, return empty list immediately.
+    flights = self.intl_arrival_dict.get(current_time * self.speed_factor)
+    if flights is None: return planes
+
+    for idx in flights:
+      pid, origin, airport_code, arrival_time, airline, flight_num, \
+      terminal = self.flights[idx][0]
+      plist = self.manifest(idx)
+
+      planes.append(Plane(pid, origin, airport_code, arrival_time, airline,
+                          flight_num, terminal, plist))
+
+      # Increment counts for planes and passengers dispatched.
+      self.plane_count += 1
+      self.passenger_count += len(plist)
+
+    return planes
+
+
+## ====================================================================
+
+
+# Columns required of an arrival schedule CSV.
+arrival_columns = ("id", "arrival_time", "passengers_dom", "passengers_intl")
+
+
+class CsvPlaneDispatcher(object):
+  """
+  PlaneDispatcher counterpart that builds planes from an arrival
+  schedule CSV of passenger counts, drawing service times at dispatch.
+
+  Member Data:
+    sequence: the run's SeedSequence
+    speed_factor: a speed factor for simulation time
+    flight_ids: list of arrival ids as strings
+    arrival_times: list of arrival times as "HH:MM:SS" strings
+    num_dom: array of domestic passengers per arrival
+    num_intl: array of international passengers per arrival
+    first_ids: array of the first passenger id of each arrival
+    occurrences: array of each arrival's index among rows with its id
+    intl_arrival_dict: dictionary with ticks as keys and arrival
+                       indices as values
+    service_times: None, or a dictionary of service times by passenger
+                   id overriding the drawn ones
+    in_memory_report: True; simulations report without the passengers
+                      table
+    plane_count: simple integer count of planes initialized
+    passenger_count: simple integer count of passengers initialized
+
+  Member Functions:
+    read_schedule: streams the CSV into the arrival index
+    manifest: draws the passengers of an arrival
+    population: lists the nationality of every passenger
+    dispatch_planes: returns initialized planes if simulation time
+                     matches an arrival.
+  """
+
+  in_memory_report = True
+
+  def __init__(self, schedule_file, seed=None, speed_factor=spd_factor):
+    """
+    CsvPlaneDispatcher must be instantiated with the filename of an
+    arrival schedule CSV, and optionally the seed to draw service times
+    from.
+    """
+    self.sequence = customs_random.seed_sequence(seed)
+    self.speed_factor = speed_factor
+    self.flight_ids = []
+    self.arrival_times = []
+    self.num_dom = array('i')
+    self.num_intl = array('i')
+    self.first_ids = array('q')
+    self.occurrences = array('i')
+    self.intl_arrival_dict = {}
+    self.read_schedule(schedule_file)
+    self.service_times = None
+    self.plane_count = 0
+    self.passenger_count = 0
+
+
+  def read_schedule(self, schedule_file):
+    """
+    Streams an arrival schedule CSV into the arrival index.
+
+    Args:
+      schedule_file: filename of the CSV
+
+    Returns:
+      VOID
+    """
+    occurrences = {}
+    times = {}
+    next_id = 1
+
+    with open(schedule_file) as the_file:
+      reader = csv.reader(the_file)
+      header = [column.strip() for column in next(reader, [])]
+      missing = [column for column in arrival_columns
+                 if column not in header]
+      if missing:
+        raise ValueError("%s lacks columns: %s"
+                         % (schedule_file, ", ".join(missing)))
+      columns = [header.index(column) for column in arrival_columns]
+
+      id_col, time_col, dom_col, intl_col = columns
+
+      # Bind the appends once; this loop runs once per row.
+      index = self.intl_arrival_dict
+      append_id, append_time = self.flight_ids.append, \
+                               self.arrival_times.append
+      append_dom, append_intl = self.num_dom.append, self.num_intl.append
+      append_first, append_occurrence = self.first_ids.append, \
+                                        self.occurrences.append
+
+      for idx, row in enumerate(row for row in reader if row):
+        flight_id = row[id_col].strip()
+        num_dom, num_intl = int(row[dom_col]), int(row[intl_col])
+
+        # Parse each distinct arrival time once, and share its string.
+        arrival_time = row[time_col].strip()
+        if arrival_time not in times:
+          times[arrival_time] = (arrival_time,
+                                 _get_sec(arrival_time, self.speed_factor))
+        arrival_time, tick = times[arrival_time]
+
+        occurrence = occurrences.get(flight_id, 0)
+        occurrences[flight_id] = occurrence + 1
+
+        if tick in index: index[tick].append(idx)
+        else: index[tick] = [idx]
+        append_id(flight_id)
+        append_time(arrival_time)
+        append_dom(num_dom)
+        append_intl(num_intl)
+        append_first(next_id)
+        append_occurrence(occurrence)
+        next_id += num_dom + num_intl
+
+
+  def manifest(self, idx):
+    """
+    Draws the passengers of an arrival, domestic passengers first.
+
+    Args:
+      idx: index of the arrival
+
+    Returns:
+      plist: list of passenger rows in the row format of the passengers
+             table, without identity fields
+    """
+    flight_id = self.flight_ids[idx]
+    num_dom, num_intl = self.num_dom[idx], self.num_intl[idx]
+    first_id = self.first_ids[idx]
+    rng = customs_random.keyed_rng(self.sequence,
+                                   customs_random.string_key(flight_id),
+                                   self.occurrences[idx])
+
+    service_times = TriangularSampler(service_dist_dom, rng,
+                                      self.speed_factor).draws(num_dom)\
+                                                        .tolist() + \
+                    TriangularSampler(service_dist_intl, rng,
+                                      self.speed_factor).draws(num_intl)\
+                                                        .tolist()
+
+    pids = range(first_id, first_id + num_dom + num_intl)
+    if self.service_times is not None:
+      service_times = [self.service_times[pid] for pid in pids]
+
+    nationalities = ["domestic"] * num_dom + ["foreign"] * num_intl
+    return [(pid, flight_id, None, None, None, nationality, service_time)
+            for pid, nationality, service_time
+            in zip(pids, nationalities, service_times)]
+
+
+  def population(self):
+    """
+    Lists the nationality of every passenger the dispatcher can
+    dispatch, e.g. for common random numbers.
+
+    Args:
+      None
+
+    Returns:
+      passenger_ids: integer array
+      domestic: boolean array
+    """
+    counts = np.column_stack((np.frombuffer(self.num_dom, dtype=np.int32),
+                              np.frombuffer(self.num_intl, dtype=np.int32)))
+    flags = np.tile(np.array([True, False]), len(self.flight_ids))
+    domestic = np.repeat(flags, counts.ravel())
+    return np.arange(1, len(domestic) + 1, dtype=np.int64), domestic
+
+
+  def dispatch_planes(self, current_time):
+    """
+    CsvPlaneDispatcher class method for initializing and returning new
+    planes on schedule.
+
+    Args:
+      current_time: simulation time in simulation time units.
+
+    Returns:
+      planes: a list of instantiated Plane objects
+    """
+    planes = []
+
+    # If a plane is not due, return empty list immediately.
+    flights = self.intl_arrival_dict.get(current_time)
+    if flights is None: return planes
+
+    for idx in flights:
+      plist = self.manifest(idx)
+      planes.append(Plane(self.flight_ids[idx], None, None,
+                          self.arrival_times[idx], None,
+                          self.flight_ids[idx], '4', plist))
+
+      # Increment counts for planes and passengers dispatched.
+      self.plane_count += 1
+      self.passenger_count += len(plist)
+
+    return planes